@@ -0,0 +1,223 @@
+"""
+Pre-aggregated distinct-case counts for the dashboard callbacks.
+
+The cube is computed once at start-up from the row-level records and extended
+with CaseCube.add when new records arrive. Callbacks answer every request by
+slicing days and picking series columns, so their cost depends on the number of
+selected series and days, not on the raw record count.
+
+Distinct cases are counted on the dense integer case IDs of dataset.case_ids:
+each (group, case) pair is packed into one int64 and the pairs are sorted and
+deduplicated, so no case number is ever hashed.
+"""
+import numpy as np
+import pandas as pd
+
+from dataset import DATE_COLUMN, case_ids, date_slice, share_array
+
+SERIES_COLUMNS = ['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY']
+
+PER_CAPITA_SCALE = 100000
+
+
+def count_distinct(groups, ids):
+    """
+    Count the distinct case IDs of each group.
+
+    :param groups: Non-negative int64 group code of each row.
+    :param ids: Dense case ID of each row, see dataset.case_ids.
+    :return: (groups, counts): the sorted group codes present and their distinct cases.
+    """
+    if not len(ids):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    cases = int(ids.max()) + 1
+    pairs = np.unique(groups.astype(np.int64) * cases + ids)
+    return np.unique(pairs // cases, return_counts=True)
+
+
+class CaseCube:
+    """
+    Daily distinct-case counts indexed by date x age group x race x gender x morbidity.
+
+    Only combinations present in the data get a column in ``counts``; ``grid`` maps
+    the category codes of the four series dimensions to that column. Absent
+    combinations map to ``empty``, a trailing column of zeros, and each grid axis
+    has one extra slot so the -1 code of an unknown value lands there too. A
+    selection can therefore always be answered with plain array indexing.
+    """
+
+    def __init__(self, dates, counts, keys, population):
+        """
+
+        :param dates: Dense datetime64[D] grid of consecutive days.
+        :param counts: int32 array of shape (len(dates), len(keys) + 1), last column all zeros.
+        :param keys: DataFrame of the SERIES_COLUMNS values of each column, in column order.
+        :param population: TOTAL_POP of each column, see population.PopulationTable.lookup.
+        """
+        self.dates = dates
+        self.counts = counts
+        self.keys = keys
+        self.population = population
+        self.empty = len(keys)
+
+        self.levels = {column: pd.Index(keys[column].unique()).sort_values() for column in SERIES_COLUMNS}
+        self.grid = np.full([len(self.levels[column]) + 1 for column in SERIES_COLUMNS], self.empty, dtype=np.int64)
+        codes = tuple(self.levels[column].get_indexer(keys[column]) for column in SERIES_COLUMNS)
+        self.grid[codes] = np.arange(len(keys))
+
+    @staticmethod
+    def daily_counts(df):
+        """
+        Count each case once per day and series.
+
+        :param df: Records with DATE_OF_DEATH, CASE_NUMBER (or CASE_ID) and the SERIES_COLUMNS.
+        :return: Series of distinct cases indexed by DAY and the SERIES_COLUMNS.
+        """
+        columns = [df[DATE_COLUMN].to_numpy().astype('datetime64[D]')] + [df[column] for column in SERIES_COLUMNS]
+        codes, levels = zip(*[pd.factorize(values) for values in columns])
+        known = np.logical_and.reduce([code >= 0 for code in codes])
+        shape = [len(level) for level in levels]
+        groups = np.ravel_multi_index([code[known] for code in codes], shape)
+        groups, counts = count_distinct(groups, case_ids(df)[known])
+        index = pd.MultiIndex(levels=[pd.Index(level) for level in levels], codes=np.unravel_index(groups, shape),
+                              names=['DAY'] + SERIES_COLUMNS, verify_integrity=False)
+        return pd.Series(counts, index=index)
+
+    @classmethod
+    def from_frame(cls, df, population):
+        """
+        Aggregate row-level records; a case counted once per day and series.
+
+        :param df: Records with DATE_OF_DEATH, CASE_NUMBER and the SERIES_COLUMNS.
+        :param population: PopulationTable of the demographics in df.
+        :return: A CaseCube.
+        """
+        return cls.from_counts(cls.daily_counts(df), population)
+
+    @classmethod
+    def from_counts(cls, daily, population):
+        """
+
+        :param daily: Counts as returned by daily_counts; repeated entries are summed.
+        :param population: PopulationTable of the series in daily.
+        :return: A CaseCube.
+        """
+        empty = cls(np.array([], dtype='datetime64[D]'), np.zeros((0, 1), dtype=np.int32),
+                    pd.DataFrame({column: pd.Series(dtype=object) for column in SERIES_COLUMNS}),
+                    np.array([], dtype=np.float64))
+        return empty.add(daily, population)
+
+    def add(self, daily, population):
+        """
+        A new cube with more distinct-case counts added; this one is left unchanged.
+
+        Days and series not in this cube yet are added, so a batch of new records is
+        merged without re-aggregating the records already counted. Columns stay
+        sorted by their keys, as in a cube built from all records at once.
+
+        :param daily: Counts to add, as returned by daily_counts; repeated entries are summed.
+        :param population: PopulationTable for the series new to the cube.
+        :return: A CaseCube.
+        """
+        keys = pd.MultiIndex.from_frame(self.keys)
+        series = daily.index.droplevel('DAY').unique()
+        new_series = series[keys.get_indexer(series) < 0] if len(keys) else series
+        if len(new_series):
+            added = new_series.to_frame(index=False)
+            for column in SERIES_COLUMNS:
+                added[column] = added[column].astype(object)
+            keys_frame = pd.concat([self.keys, added], ignore_index=True)
+            order = keys_frame.sort_values(SERIES_COLUMNS, kind='stable').index.to_numpy()
+            keys_frame = keys_frame.iloc[order].reset_index(drop=True)
+            all_population = np.concatenate([self.population, population.lookup(added)])[order]
+            # New column of each existing one
+            moved = np.argsort(order)[:self.empty]
+        else:
+            keys_frame, all_population, moved = self.keys, self.population, slice(None, self.empty)
+        keys = pd.MultiIndex.from_frame(keys_frame)
+
+        days = daily.index.get_level_values('DAY').to_numpy().astype('datetime64[D]')
+        bounds = [self.dates[[0, -1]]] if len(self.dates) else []
+        if len(days):
+            bounds.append(np.array([days.min(), days.max()]))
+        if bounds:
+            bounds = np.concatenate(bounds)
+            dates = np.arange(bounds.min(), bounds.max() + np.timedelta64(1, 'D'))
+        else:
+            dates = np.array([], dtype='datetime64[D]')
+
+        counts = np.zeros((len(dates), len(keys) + 1), dtype=np.int32)
+        if len(self.dates):
+            offset = int((self.dates[0] - dates[0]).astype(np.int64))
+            counts[offset:offset + len(self.dates), moved] = self.counts[:, :self.empty]
+        rows = (days - dates[:1]).astype(np.int64)
+        columns = keys.get_indexer(daily.index.droplevel('DAY'))
+        np.add.at(counts, (rows, columns), daily.to_numpy(dtype=np.int32))
+        return type(self)(dates, counts, keys_frame, all_population)
+
+    def with_population(self, population):
+        """
+        The same counts over different denominators, e.g. another census vintage.
+
+        :param population: PopulationTable.
+        :return: A CaseCube sharing this cube's counts.
+        """
+        return type(self)(self.dates, self.counts, self.keys, population.lookup(self.keys))
+
+    def share(self):
+        """
+        Move the cube arrays into read-only shared memory, see dataset.share_array.
+        """
+        self.dates = share_array(self.dates)
+        self.counts = share_array(self.counts)
+        self.population = share_array(self.population)
+        self.grid = share_array(self.grid)
+
+    def day_slice(self, start_date, end_date):
+        """
+
+        :return: A slice of cube rows for the inclusive date range.
+        """
+        return date_slice(self.dates, pd.Timestamp(start_date).normalize(), end_date)
+
+    def select(self, age, race, sex, morbidity):
+        """
+        Look up the columns of the selected series.
+
+        :return: Array of column positions shaped (len(age), len(race), len(sex), len(morbidity)).
+        """
+        codes = [self.levels[column].get_indexer(list(values))
+                 for column, values in zip(SERIES_COLUMNS, (age, race, sex, morbidity))]
+        return self.grid[np.ix_(*codes)]
+
+    def daily(self, days, columns):
+        """
+
+        :param days: Slice of cube rows, see day_slice.
+        :param columns: Column positions, see select.
+        :return: (dates, counts) with counts shaped (days, len(columns)).
+        """
+        return self.dates[days], self.counts[days][:, columns]
+
+    def totals(self, days, columns):
+        """
+
+        :return: Distinct cases of each column summed over the sliced days.
+        """
+        return self.counts[days][:, columns].sum(axis=0)
+
+    def series_population(self, columns):
+        """
+
+        :return: TOTAL_POP of each column, NaN for the empty column.
+        """
+        return np.append(self.population, np.nan)[columns]
+
+    def per_capita(self, values, columns):
+        """
+
+        :return: values scaled to deaths per 100,000 of each column's population, NaN
+            where it is unknown or 0.
+        """
+        population = self.series_population(columns)
+        return values / np.where(population > 0, population, np.nan) * PER_CAPITA_SCALE
@@ -1,14 +1,32 @@
+import contextvars
+import itertools
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from uuid import uuid4
 from pathlib import Path
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash import ctx, dcc, html
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 import pandas as pd
 import numpy as np
-from collections import Counter
-import plotly.graph_objs as go
-import plotly.express as px
-from plotly.subplots import make_subplots
 from datetime import datetime as dt
+from dataset import load_dataset, date_slice, default_cache_dir
+from rolling import rolling_mean
+from figures import PLOT_WIDTH, WEBGL_POINT_THRESHOLD, bar_figure, figure_patch, trend_figure
+from figure_cache import FigureCache, source_fingerprint
+from clientside import cube_payload
+from metrics import SlowCallProfiler, register_metrics, selection, stage
+from ingest import DashboardData, Ingestor, LiveData
+from population import PopulationTable
+from partitions import PartitionedDataset
+from warmup import CacheWarmer
+from generations import checkpoint, registry as request_generations
+from export import FORMATS as export_formats, register_export, series_frames
 
 # Define your CSS style sheets
 external_css = [
@@ -16,16 +34,35 @@ external_css = [
     "assets/base.css",
 ]
 
+# CLIENTSIDE_CHARTS=1 ships the case cube to the browser once and draws both charts
+# there (assets/clientside_charts.js) instead of on every control change here
+clientside_charts = os.environ.get('CLIENTSIDE_CHARTS') == '1'
+
+# Trend series are downsampled to TREND_MAX_POINTS points each (one per pixel of the
+# plot width by default) and drawn with WebGL above WEBGL_POINT_THRESHOLD points
+trend_max_points = int(os.environ.get('TREND_MAX_POINTS', PLOT_WIDTH))
+webgl_threshold = int(os.environ.get('WEBGL_POINT_THRESHOLD', WEBGL_POINT_THRESHOLD))
+
 # Initialize the Dash app
 app = dash.Dash(__name__, meta_tags=[{"name": "viewport", "content": "width=device-width, initial-scale=1"}],
                 external_stylesheets=external_css)
 
 server = app.server
+
+# Per-stage latency histograms at /metrics; PROFILE_SLOW_SECONDS also writes a
+# cProfile dump of every chart update slower than that many seconds (and one of
+# the bar chart, which is computed in a thread pool, when that is slow)
+register_metrics(server)
+slow_call_profiler = SlowCallProfiler.from_environ()
 app.config.suppress_callback_exceptions = True
 
 # Set the title of the dashboard
 app.title = "Covid-Related Deaths, Cook County, IL Dashboard"
 
+# Initial state of the controls, see generate_control_card
+default_time_span = 30
+default_end_date = dt(2022, 7, 1)
+
 # Create the dropdown menu options
 trend_options = [
     {'label': 'Daily', 'value': 1},
@@ -33,6 +70,35 @@ trend_options = [
     {'label': '30 Day', 'value': 30}
 ]
 
+# Checklist options, also the order selected series are drawn in
+sex_options = [
+    {'label': 'All Sexes', 'value': 'All'},
+    {'label': 'Female', 'value': 'Female'},
+    {'label': 'Male', 'value': 'Male'},
+]
+
+race_options = [
+    {'label': 'All Races', 'value': 'All'},
+    {'label': 'White', 'value': 'White'},
+    {'label': 'Black', 'value': 'Black'},
+    {'label': 'Asian', 'value': 'Asian'},
+    {'label': 'Other', 'value': 'Other'},
+]
+
+age_options = [
+    {'label': 'All Ages', 'value': 'All'},
+    {'label': '< 18 Yrs', 'value': '< 18 Yrs'},
+    {'label': '19-29 Yrs', 'value': '19-29 Yrs'},
+    {'label': '30-39 Yrs', 'value': '30-39 Yrs'},
+    {'label': '40-49 Yrs', 'value': '40-49 Yrs'},
+    {'label': '50-59 Yrs', 'value': '50-59 Yrs'},
+    {'label': '60-69 Yrs', 'value': '60-69 Yrs'},
+    {'label': '70-79 Yrs', 'value': '70-79 Yrs'},
+    {'label': '80-89 Yrs', 'value': '80-89 Yrs'},
+    {'label': '90-99 Yrs', 'value': '90-99 Yrs'},
+    {'label': '100 Yrs <', 'value': '100 Yrs <'},
+]
+
 
 def description_card():
     """
@@ -53,20 +119,36 @@ def description_card():
     )
 
 
-def generate_control_card():
+def generate_control_card(data, counties=None):
     """
 
+    :param data: The current DashboardData, for the default dates and the morbidity list.
+    :param counties: Counties to choose from, if the data has several.
     :return: A Div containing controls for graphs.
     """
+    county_controls = [
+        html.Br(),
+        html.P("Select Counties"),
+        dcc.Dropdown(
+            id='county-select',
+            options=[{'label': county, 'value': county} for county in counties],
+            value=counties,
+            placeholder="No County Selected",
+            clearable=False,
+            multi=True,
+            style={'color': '#000000'}
+        ),
+    ] if counties else []
     return html.Div(
         id="control-card",
         children=[
+            *county_controls,
             html.Br(),
             html.P("Select Daily, 7-Day, or 30-day Average"),
             dcc.Dropdown(
                 id='trend-statistics',
                 options=trend_options,
-                value=30,
+                value=default_time_span,
                 placeholder='Select Rolling Window',
                 clearable=False,
                 style={'color': '#000000'}
@@ -75,8 +157,8 @@ def generate_control_card():
             html.P("Select Date Range"),
             dcc.DatePickerRange(
                 id="date-picker-select",
-                start_date=df_no_covid['DATE_OF_DEATH'].min(),
-                end_date=dt(2022, 7, 1),
+                start_date=data.first_death_date,
+                end_date=default_end_date,
                 display_format='YYYY-MM-DD',
             ),
             html.Div(
@@ -88,21 +170,8 @@ def generate_control_card():
                          html.P("Select a Sex:"),
                          dcc.Checklist(
                              id='sex-select',
-                             options=[
-                                 {
-                                     "label": html.Div(['All Sexes'],
-                                                       style={'fontSize': 14}),
-                                     "value": 'All'
-                                 },
-                                 {
-                                     "label": html.Div(['Female'], style={'fontSize': 14}),
-                                     "value": 'Female'
-                                 },
-                                 {
-                                     "label": html.Div(['Male'], style={'fontSize': 14}),
-                                     "value": 'Male'
-                                 },
-                             ],
+                             options=[{"label": html.Div([option['label']], style={'fontSize': 14}),
+                                       "value": option['value']} for option in sex_options],
                              value=['All'],
                              labelStyle={"display": "flex"},
                              inline=True
@@ -111,28 +180,8 @@ def generate_control_card():
                          html.P("Select a Race:"),
                          dcc.Checklist(
                              id='race-select',
-                             options=[
-                                 {
-                                     "label": html.Div(['All Races'], style={'fontSize': 14}),
-                                     "value": "All"
-                                 },
-                                 {
-                                     "label": html.Div(['White'], style={'fontSize': 14}),
-                                     "value": "White"
-                                 },
-                                 {
-                                     "label": html.Div(['Black'], style={'fontSize': 14}),
-                                     "value": "Black"
-                                 },
-                                 {
-                                     "label": html.Div(['Asian'], style={'fontSize': 14}),
-                                     "value": "Asian"
-                                 },
-                                 {
-                                     "label": html.Div(['Other'], style={'fontSize': 14}),
-                                     "value": "Other"
-                                 }
-                             ],
+                             options=[{"label": html.Div([option['label']], style={'fontSize': 14}),
+                                       "value": option['value']} for option in race_options],
                              value=['All'],
                              labelStyle={"display": "flex"},
                          )
@@ -144,52 +193,8 @@ def generate_control_card():
                                       html.P("Select Age-Groups:"),
                                       dcc.Checklist(
                                           id='age-selections',
-                                          options=[
-                                              {
-                                                  "label": html.Div(['All Ages'], style={'fontSize': 14}),
-                                                  "value": "All"
-                                              },
-                                              {
-                                                  "label": html.Div(['< 18 Yrs'], style={'fontSize': 14}),
-                                                  "value": "< 18 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['19-29 Yrs'], style={'fontSize': 14}),
-                                                  "value": "19-29 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['30-39 Yrs'], style={'fontSize': 14}),
-                                                  "value": "30-39 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['40-49 Yrs'], style={'fontSize': 14}),
-                                                  "value": "40-49 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['50-59 Yrs'], style={'fontSize': 14}),
-                                                  "value": "50-59 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['60-69 Yrs'], style={'fontSize': 14}),
-                                                  "value": "60-69 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['70-79 Yrs'], style={'fontSize': 14}),
-                                                  "value": "70-79 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['80-89 Yrs'], style={'fontSize': 14}),
-                                                  "value": "80-89 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['90-99 Yrs'], style={'fontSize': 14}),
-                                                  "value": "90-99 Yrs"
-                                              },
-                                              {
-                                                  "label": html.Div(['100 Yrs <'], style={'fontSize': 14}),
-                                                  "value": "100 Yrs <"
-                                              },
-                                          ],
+                                          options=[{"label": html.Div([option['label']], style={'fontSize': 14}),
+                                                    "value": option['value']} for option in age_options],
                                           value=['All'],
                                           labelStyle={"display": "flex"}
                                       )])])
@@ -200,8 +205,8 @@ def generate_control_card():
             html.P("Select General Morbidity Category"),
             dcc.Dropdown(
                 id="morbidity-select",
-                options=[{'label': value, 'value': value} for value in sorted_morbidity_list],
-                value=sorted_morbidity_list[:1],
+                options=[{'label': value, 'value': value} for value in data.morbidity_order],
+                value=data.morbidity_order[:1],
                 placeholder="No General Morbidity Selected",
                 searchable=True,
                 clearable=False,
@@ -212,349 +217,601 @@ def generate_control_card():
     )
 
 
-# Load Cook County Covid Mortality Data
-file_path = Path("assets/final_covid_2.csv")
+# Load Cook County Covid Mortality Data; COVID_DATA_PATH points the app at another
+# extract with the same columns, e.g. the synthetic data of benchmarks/synthetic_data.py
+file_path = Path(os.environ.get('COVID_DATA_PATH', "assets/final_covid_2.csv"))
 
 demo_path = Path("assets/demo.csv")
 
-df_covid = pd.read_csv(file_path, low_memory=False)
+# PARTITIONED_DATA_DIR switches to records of several counties and years, stored and
+# summarised per county and year (see partitions.py), with a county selector
+partitioned_data = PartitionedDataset.from_environ()
+
+if partitioned_data is None:
+    # Parsed once into a memory-mapped columnar snapshot, see dataset.py
+    df_covid = load_dataset(file_path)
+    data_version = df_covid.attrs['snapshot']
+
+    # Distinct-case counts per day and demographic/morbidity series (computed once so
+    # the callbacks never have to group the row-level data), the chart labels and the
+    # morbidity ordering; replaced as a whole when new records are ingested
+    initial_data = DashboardData.from_frame(df_covid, version=data_version,
+                                            population=PopulationTable.from_csv(df_covid.attrs['population']))
+
+    # POPULATION_PATH swaps in the populations of a census vintage (a CSV keyed by
+    # GENDER, RACE and AGE_GROUP like assets/demo2.csv) where it has them
+    if os.environ.get('POPULATION_PATH'):
+        initial_data = initial_data.with_population(initial_data.population.with_vintage(
+            PopulationTable.from_csv(os.environ['POPULATION_PATH'])))
+    live_data = LiveData(initial_data)
+
+    # Rows appended to the CSV, or CSV files moved into INGEST_DROP_DIR, are merged into
+    # live_data by a polling thread in each worker, without a restart. What is there
+    # already is merged here, once, so the workers inherit it and share its cube
+    ingestor = Ingestor.from_environ(live_data, file_path, df_covid.attrs['source_bytes'])
+    ingestor.poll()
+else:
+    # All counties and years; requests combine the partitions they select instead
+    live_data = LiveData(partitioned_data.data())
+    data_version = partitioned_data.version
+    ingestor = None
+
+# The browser-side charts always show every county
+county_select = partitioned_data is not None and not clientside_charts
+
+# With SHARED_DATA=1 gunicorn builds all of this in the master (see gunicorn.conf.py);
+# shared read-only buffers let every worker use the same physical pages
+if os.environ.get('SHARED_DATA', '1') == '1':
+    live_data.current.cube.share()
+
+
+@server.before_request
+def start_ingestor():
+    if ingestor is not None:
+        ingestor.ensure_started()
+
+
+# Rendered figures shared by all workers; a new snapshot or code change starts afresh
+figure_cache = FigureCache.from_environ(
+    default_cache_dir() / 'figures.sqlite',
+    version=f"{data_version}-{trend_max_points}-{webgl_threshold}-" + source_fingerprint(
+        *[Path(__file__).with_name(name)
+          for name in ('app.py', 'aggregates.py', 'rolling.py', 'figures.py', 'ingest.py', 'population.py',
+                       'partitions.py')]))
+
+
+@lru_cache(maxsize=1)
+def clientside_payload(data):
+    """
 
-df_no_covid = df_covid[df_covid['GENERAL_MORBIDITY'] != 'COVID-19']
+    :return: The case cube of data for the browser, encoded once per data version.
+    """
+    return cube_payload(data.cube, {
+        'age': [option['value'] for option in age_options],
+        'sex': [option['value'] for option in sex_options],
+        'race': [option['value'] for option in race_options],
+        'morbidity': data.morbidity_order,
+    }, webgl_threshold)
 
-# Create list of Morbidities
-morbidity_list = list(df_no_covid['GENERAL_MORBIDITY'])
 
-# Count the frequency of the morbidities
-morbidity_counts = Counter(morbidity_list)
+def serve_layout():
+    """
+    Built on every page load, so a new page picks up ingested records.
 
-# Extract unique values and count occurrences
-unique_values_counts = df_no_covid.groupby('GENERAL_MORBIDITY')['CASE_NUMBER'].nunique()
+    :return: Layout of the app.
+    """
+    data = live_data.current
+    return html.Div(
+        id="app-container",
+        children=[
+            html.Div([
+                # App Controls Section
+                html.Div(
+                    id="app-controls",
+                    children=[
+                        # Banner
+                        # html.Div(
+                        #     id="banner",
+                        #     className="banner",
+                        #     children=[html.Img(src=app.get_asset_url("plotly_logo.png"))],
+                        # ),
+                        # Left column
+                        html.Div(
+                            id="left-column",
+                            className="four columns",
+                            children=[description_card(), generate_control_card(
+                                data, partitioned_data.counties if county_select else None)]
+                        ),
+                        # Graphs Section
+                        html.Div(
+                            id="right-column",
+                            className="eight columns",
+                            children=[
+                                html.Div([
+                                    dcc.Tabs(
+                                        id='tabs-select',
+                                        value='Per Capita',
+                                        children=[
+                                            dcc.Tab(label='Per Capita', value='Per Capita',
+                                                    style={'borderBottom': '1px solid #d6d6d6',
+                                                           'padding': '5px',
+                                                           'fontWeight': 'bold'}),
+                                            dcc.Tab(label='Total', value='Total',
+                                                    style={'borderBottom': '1px solid #d6d6d6',
+                                                           'padding': '5px',
+                                                           'fontWeight': 'bold'}),
+                                        ], className="custom-tabs", style={'width': '300px', 'height': '50px'})
+                                ], className="dash-tab"),
+                                html.Div(id='output-container', style={'alignItems': 'center'},
+                                         children=[dcc.Graph(id='trend-graph')]),
+                                html.Div(id='output-container-2', children=[dcc.Graph(id='bar-graph')]),
+                                # The numbers behind the charts, see export_selection
+                                html.Div(id='export-links', children=[
+                                    html.A(f"Download {label}", id=f'export-{file_format}', className='button',
+                                           style={'marginRight': '10px'})
+                                    for file_format, (label, media_type, stream) in export_formats.items()]),
+                                # Where the links point, filled in by export.links in assets/export_links.js
+                                dcc.Store(id='export-target', data={'path': app.get_relative_path('/export'),
+                                                                    'formats': list(export_formats)}),
+                                # Identifies this tab's chart requests, see generations.py
+                                dcc.Store(id='session-id', data=uuid4().hex),
+                                # Cache keys of the figures the graphs show, see figure_update
+                                *([dcc.Store(id='case-cube-store', data=clientside_payload(data))]
+                                  if clientside_charts else [dcc.Store(id='chart-state')])],
+                            style={'alignItems': 'center'},
+                            # className='app-graphs'
+
+                        ),
+                    ])
+            ])
+        ])
 
-# Sort unique values by count (most occurrences to least)
-sorted_unique_values_counts = unique_values_counts.sort_values(ascending=False)
 
-# Create a list of tuples with (value, count)
-sorted_unique_values_and_counts = [(value, count) for value, count in
-                                   zip(sorted_unique_values_counts.index, sorted_unique_values_counts)]
+app.layout = serve_layout
 
-# Print the list of tuples
-# print(sorted_unique_values_and_counts)
 
-strings_list = [f"{value}" for value, count in zip(sorted_unique_values_counts.index, sorted_unique_values_counts)]
+def in_option_order(values, options):
+    """
 
-# Calculate the sum of counts for each unique value
+    :return: The distinct values in the order of options, unknown values last.
+    """
+    rank = {option: position for position, option in enumerate(options)}
+    return sorted(set(values or []), key=lambda value: (rank.get(value, len(rank)), str(value)))
 
-sorted_morbidity_list = sorted(unique_values_counts.keys(), key=lambda x: unique_values_counts[x], reverse=True)
 
-# Layout of the app
-app.layout = html.Div(
-    id="app-container",
-    children=[
-        html.Div([
-            # App Controls Section
-            html.Div(
-                id="app-controls",
-                children=[
-                    # Banner
-                    # html.Div(
-                    #     id="banner",
-                    #     className="banner",
-                    #     children=[html.Img(src=app.get_asset_url("plotly_logo.png"))],
-                    # ),
-                    # Left column
-                    html.Div(
-                        id="left-column",
-                        className="four columns",
-                        children=[description_card(), generate_control_card()]
-                    ),
-                    # Graphs Section
-                    html.Div(
-                        id="right-column",
-                        className="eight columns",
-                        children=[
-                            html.Div([
-                                dcc.Tabs(
-                                    id='tabs-select',
-                                    value='Per Capita',
-                                    children=[
-                                        dcc.Tab(label='Per Capita', value='Per Capita',
-                                                style={'borderBottom': '1px solid #d6d6d6',
-                                                       'padding': '5px',
-                                                       'fontWeight': 'bold'}),
-                                        dcc.Tab(label='Total', value='Total',
-                                                style={'borderBottom': '1px solid #d6d6d6',
-                                                       'padding': '5px',
-                                                       'fontWeight': 'bold'}),
-                                    ], className="custom-tabs", style={'width': '300px', 'height': '50px'})
-                            ], className="dash-tab"),
-                            html.Div(id='output-container', style={'alignItems': 'center'}),
-                            html.Div(id='output-container-2')],
-                        style={'alignItems': 'center'},
-                        # className='app-graphs'
-
-                    ),
-                ])
-        ])
-    ])
-
-
-def filter_data_by_date_range(df, start_date, end_date):
-    date_filter = (pd.to_datetime(df['DATE_OF_DEATH']) >= pd.to_datetime(start_date)) & (
-            pd.to_datetime(df['DATE_OF_DEATH']) <= pd.to_datetime(end_date))
-
-    return df_no_covid[date_filter]
-
-
-@app.callback(
-    [Output(component_id='output-container', component_property='children')],
-    [Input(component_id='morbidity-select', component_property='value'),
-     Input(component_id='trend-statistics', component_property='value'),
-     Input(component_id='date-picker-select', component_property='start_date'),
-     Input(component_id='date-picker-select', component_property='end_date'),
-     Input(component_id='age-selections', component_property='value'),
-     Input(component_id='sex-select', component_property='value'),
-     Input(component_id='race-select', component_property='value'),
-     Input(component_id='tabs-select', component_property='value'),
-     ])
-def rolling_trends(morbidity, time_span, start_date, end_date, age, sex, race, tabs):
-    filtered_df = filter_data_by_date_range(df_covid, start_date, end_date)
-
-    filtered_data = \
-        filtered_df.groupby(['DATE_OF_DEATH', 'AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY', 'TOTAL_POP'])[
-            'CASE_NUMBER'].nunique().reset_index()
-
-    filtered_data['PER_CAP'] = (filtered_data['CASE_NUMBER'] / filtered_data['TOTAL_POP']) * 100000
-
-    filtered_data_bar = filtered_df.groupby(['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY', 'TOTAL_POP'])[
-        'CASE_NUMBER'].nunique().reset_index()
-
-    filtered_data_bar['PER_CAP'] = (filtered_data_bar['CASE_NUMBER'] / filtered_data_bar['TOTAL_POP']) * 100000
-
-    fig = make_subplots(rows=1, cols=1, subplot_titles=(""))
-
-    if time_span == 1:
-        fig.update_layout(title_text="Daily Total Deaths")
-        for group in age:
-            age_data = filtered_data[filtered_data['AGE_GROUP'] == group]
-            for gender in sex:
-                sex_data = age_data[age_data['GENDER'] == gender]
-                for races in race:
-                    race_data = sex_data[sex_data['RACE'] == races]
-                    for morbid in morbidity:
-                        morbid_data = race_data[race_data['GENERAL_MORBIDITY'] == morbid]
-                        if tabs == 'Per Capita':
-                            if (morbid.title() == 'All Deaths') & (group == 'All') & (races == 'All') & (
-                                    gender == 'All'):
-                                x_label = f"Total Pop."
-                            elif (morbid.title() == 'All Deaths') & (group == 'All') & (gender == 'All'):
-                                x_label = f"{races} Pop."
-                            elif (morbid.title() == 'All Deaths') & (races == 'All') & (gender == 'All'):
-                                x_label = f"{group} Pop."
-                            elif (group == 'All') & (races == 'All') & (gender == 'All'):
-                                x_label = f"Pop. with {morbid.title()}"
-                            elif (morbid.title() == 'All Deaths') & (group == 'All') & (races == 'All'):
-                                x_label = f"{gender} Pop."
-                            elif (morbid.title() == 'All Deaths') & (group == 'All'):
-                                x_label = f"{gender}, {races} Pop."
-                            elif morbid.title() == 'All Deaths':
-                                x_label = f"Ages: {group} for {gender}, {races} Pop."
-                            else:
-                                x_label = f"Ages: {group} for {gender}, {races} Pop. with {morbid.title()}"
-                            trace = go.Scatter(x=morbid_data['DATE_OF_DEATH'], y=morbid_data['PER_CAP'],
-                                               mode='lines',
-                                               name=x_label)
-                            fig.update_yaxes(title_text='Deaths Per Capita (Deaths Per 100,000)')
-                            fig.update_layout(title_text="Total Daily Deaths per Capita")
-                        else:
-                            if (morbid.title() == 'All Deaths') & (group == 'All') & (races == 'All') & (
-                                    gender == 'All'):
-                                x_label = f"Total Pop."
-                            elif (morbid.title() == 'All Deaths') & (group == 'All') & (gender == 'All'):
-                                x_label = f"{races} Pop."
-                            elif (morbid.title() == 'All Deaths') & (races == 'All') & (gender == 'All'):
-                                x_label = f"{group} Pop."
-                            elif (group == 'All') & (races == 'All') & (gender == 'All'):
-                                x_label = f"Pop. with {morbid.title()}"
-                            elif (morbid.title() == 'All Deaths') & (group == 'All') & (races == 'All'):
-                                x_label = f"{gender} Pop."
-                            elif (morbid.title() == 'All Deaths') & (group == 'All'):
-                                x_label = f"{gender}, {races} Pop."
-                            elif morbid.title() == 'All Deaths':
-                                x_label = f"Ages: {group} for {gender}, {races} Pop."
-                            else:
-                                x_label = f"Ages: {group} for {gender}, {races} Pop. with {morbid.title()}"
-                            trace = go.Scatter(x=morbid_data['DATE_OF_DEATH'], y=morbid_data['CASE_NUMBER'],
-                                               mode='lines',
-                                               name=x_label)
-                            fig.update_layout(title_text="Total Deaths")
-                            fig.update_yaxes(title_text='Deaths')
-                        fig.add_trace(trace)
-    elif time_span == 7:
-        fig.update_layout(title_text="7 Day Rolling Average of Total Deaths")
-        for group in age:
-            age_data = filtered_data[filtered_data['AGE_GROUP'] == group]
-            for gender in sex:
-                sex_data = age_data[age_data['GENDER'] == gender]
-                for races in race:
-                    race_data = sex_data[sex_data['RACE'] == races]
-                    for morbid in morbidity:
-                        morbid_data = race_data[race_data['GENERAL_MORBIDITY'] == morbid]
-                        if tabs == 'Per Capita':
-                            morbid_data.loc[:, 'ROLLING_AVG'] = \
-                                morbid_data.groupby(['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY'])[
-                                    'PER_CAP'].transform(lambda x: x.rolling(window=7, min_periods=1).mean())
-                            fig.update_yaxes(title_text='Deaths Per Capita (Deaths Per 100,000)')
-                            fig.update_layout(title_text="7 Day Rolling Average of Total Deaths per Capita")
-                        else:
-                            morbid_data['ROLLING_AVG'] = \
-                                morbid_data.groupby(['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY'])[
-                                    'CASE_NUMBER'].transform(lambda x: x.rolling(window=7, min_periods=1).mean())
-                            fig.update_yaxes(title_text='Deaths')
-                            fig.update_layout(title_text="7 Day Rolling Average of Total Deaths")
-                        # morbid_data[:, 'ROLLING_AVG'] = morbid_data['ROLLING_AVG'].fillna(0)
-                        if (morbid.title() == 'All Deaths') & (group == 'All') & (races == 'All') & (gender == 'All'):
-                            x_label = f"Total Pop."
-                        elif (morbid.title() == 'All Deaths') & (group == 'All') & (gender == 'All'):
-                            x_label = f"{races} Pop."
-                        elif (morbid.title() == 'All Deaths') & (races == 'All') & (gender == 'All'):
-                            x_label = f"{group} Pop."
-                        elif (group == 'All') & (races == 'All') & (gender == 'All'):
-                            x_label = f"Pop. with {morbid.title()}"
-                        elif (morbid.title() == 'All Deaths') & (group == 'All') & (races == 'All'):
-                            x_label = f"{gender} Pop."
-                        elif (morbid.title() == 'All Deaths') & (group == 'All'):
-                            x_label = f"{gender}, {races} Pop."
-                        elif morbid.title() == 'All Deaths':
-                            x_label = f"Ages: {group} for {gender}, {races} Pop."
-                        else:
-                            x_label = f"Ages: {group} for {gender}, {races} Pop. with {morbid.title()}"
-                        trace = go.Scatter(x=morbid_data['DATE_OF_DEATH'], y=morbid_data['ROLLING_AVG'], mode='lines',
-                                           name=x_label)
-                        fig.add_trace(trace)
+def normalize_inputs(data, morbidity, start_date, end_date, age, sex, race):
+    """
+    Canonical form of the controls: the order boxes were ticked in and the time part
+    of the dates make no difference to the charts, so they must not split the cache.
+
+    :param data: DashboardData whose morbidity order is used.
+    :return: (morbidity, start_date, end_date, age, sex, race)
+    """
+    return (in_option_order(morbidity, data.morbidity_order),
+            pd.Timestamp(start_date).strftime('%Y-%m-%d'),
+            pd.Timestamp(end_date).strftime('%Y-%m-%d'),
+            in_option_order(age, [option['value'] for option in age_options]),
+            in_option_order(sex, [option['value'] for option in sex_options]),
+            in_option_order(race, [option['value'] for option in race_options]))
+
+
+def x_axis_change(relayout_data):
+    """
+
+    :param relayout_data: relayoutData of the trend chart.
+    :return: None if the x axis was not zoomed, panned or reset, otherwise the new
+        [start, end] of the axis, or [] when it was reset to the full range.
+    """
+    relayout_data = relayout_data or {}
+    if relayout_data.get('xaxis.autorange'):
+        return []
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return [relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']]
+    if 'xaxis.range' in relayout_data:
+        return list(relayout_data['xaxis.range'])
+    return None
+
+
+chart_inputs = [
+    Input(component_id='morbidity-select', component_property='value'),
+    Input(component_id='trend-statistics', component_property='value'),
+    Input(component_id='date-picker-select', component_property='start_date'),
+    Input(component_id='date-picker-select', component_property='end_date'),
+    Input(component_id='age-selections', component_property='value'),
+    Input(component_id='sex-select', component_property='value'),
+    Input(component_id='race-select', component_property='value'),
+    Input(component_id='tabs-select', component_property='value'),
+]
+
+chart_outputs = [
+    Output(component_id='trend-graph', component_property='figure'),
+    Output(component_id='bar-graph', component_property='figure'),
+]
+
+
+# Locks of the selections being filtered, with the number of threads holding or waiting for each
+filter_locks = {}
+filter_locks_guard = threading.Lock()
+
+
+def filtered_series(data, morbidity, start_date, end_date, age, sex, race):
+    """
+    selected_series, computed once when several threads ask for the same selection:
+    both charts of a request usually do at the same time, and the second waits for
+    the first's cached result instead of recomputing it. Other selections go ahead.
+    """
+    key = (data, tuple(morbidity), start_date, end_date, tuple(age), tuple(sex), tuple(race))
+    with filter_locks_guard:
+        entry = filter_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            return selected_series(*key)
+    finally:
+        with filter_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del filter_locks[key]
+
+
+@lru_cache(maxsize=8)
+def selected_series(data, morbidity, start_date, end_date, age, sex, race):
+    """
+    The filter stage shared by both charts: the selected series over the date range,
+    taken from the case cube once per distinct (normalised) selection.
+
+    :param data: DashboardData to read; a newer version is a new cache entry.
+    :param morbidity: Tuples of selected values, see normalize_inputs.
+    :return: (dates, counts, columns, labels); counts has one column per series in
+        age -> sex -> race -> morbidity order and is read-only as it is shared.
+    """
+    days = data.cube.day_slice(start_date, end_date)
+    columns = data.cube.select(age, race, sex, morbidity).transpose(0, 2, 1, 3).reshape(-1)
+    labels = data.labels.lookup(age, race, sex, morbidity).transpose(0, 2, 1, 3).reshape(-1)
+    dates, counts = data.cube.daily(days, columns)
+    for array in (dates, counts, columns, labels):
+        array.flags.writeable = False
+    return dates, counts, columns, labels
+
+
+def update_charts(morbidity, time_span, start_date, end_date, age, sex, race, tabs, relayout_data=None,
+                  session=None, counties=None, shown=None):
+    """
+    Both charts render from one callback, so every control change runs the shared
+    filter stage once. The rolling window only changes the trend chart, and zooming
+    or panning the trend chart redraws it for the visible date range, so a
+    downsampled chart gains detail (the full range comes back on reset). Both
+    charts are drawn from the same version of the data, even while records are
+    being ingested. With partitioned data, only the partitions of the selected
+    counties and the years in the date range are combined.
+
+    A request that changes something becomes the latest of its session (the tab),
+    and gives up with no update as soon as a newer one arrives. A graph whose figure
+    is still in the figure cache only gets the changes to it, see figure_update.
+
+    :param shown: Cache keys of the figures the graphs show, by graph id.
+    :return: [trend chart update, bar chart update or no_update, cache keys of the figures shown next]
+    """
+    x_range = None
+    if ctx.triggered_id == 'trend-graph':
+        x_range = x_axis_change(relayout_data)
+        if x_range is None:
+            raise PreventUpdate
+    with selection(*selection_shape(morbidity, start_date, end_date, age, sex, race)), \
+            slow_call_profiler.profile('update_charts'), stage('callback'), request_generations.request(session):
+        data = dashboard_data(counties, start_date, end_date)
+        return chart_updates(data, morbidity, time_span, start_date, end_date, age, sex, race, tabs, x_range,
+                             shown or {})
+
+
+def dashboard_data(counties, start_date, end_date):
+    """
+
+    :param counties: Selected counties with partitioned data, otherwise None.
+    :return: The DashboardData to draw a selection from.
+    """
+    if counties is None:
+        return live_data.current
+    with stage('filter'):
+        return partitioned_data.data(counties, start_date, end_date)
+
+
+def selection_shape(morbidity, start_date, end_date, age, sex, race):
+    """
+
+    :return: (number of selected series, number of days in the date range) for the metrics labels.
+    """
+    series = len(set(morbidity or [])) * len(set(age or [])) * len(set(sex or [])) * len(set(race or []))
+    days = (pd.Timestamp(end_date).normalize() - pd.Timestamp(start_date).normalize()).days + 1
+    return series, max(days, 0)
+
+
+def chart_updates(data, morbidity, time_span, start_date, end_date, age, sex, race, tabs, x_range, shown):
+    trend_args = trend_arguments(data, morbidity, time_span, start_date, end_date, age, sex, race, tabs,
+                                 x_range or None)
+    if ctx.triggered_id in ('trend-graph', 'trend-statistics'):
+        trend, trend_key = figure_update(trend_chart, trend_args, shown.get('trend-graph'))
+        return [trend, dash.no_update, dict(shown, **{'trend-graph': trend_key})]
+    # The bar chart is computed in the pool while this thread computes the trend chart
+    bar = in_background('bar_chart', figure_update, bar_chart,
+                        bar_arguments(data, morbidity, start_date, end_date, age, sex, race, tabs),
+                        shown.get('bar-graph'))
+    trend, trend_key = figure_update(trend_chart, trend_args, shown.get('trend-graph'))
+    bar, bar_key = bar.result()
+    return [trend, bar, {'trend-graph': trend_key, 'bar-graph': bar_key}]
+
+
+def figure_update(chart, args, shown_key):
+    """
+    Compute a chart and send it as the changes to the figure the graph shows, when
+    that figure is still in the figure cache (without the cache, the whole figure
+    is always sent).
+
+    :param chart: trend_chart or bar_chart.
+    :param args: Its arguments.
+    :param shown_key: Cache key of the figure the graph shows, if any.
+    :return: (whole figure, Patch or no_update, cache key of the new figure)
+    """
+    fig = chart(*args)
+    key = chart.cache_key(*args)
+    shown = figure_cache.get(shown_key) if shown_key and shown_key != key else None
+    if shown is None:
+        return (dash.no_update if shown_key == key else fig), key
+    with stage('patch'):
+        patch = figure_patch(json.loads(shown), fig)
+    return (fig if patch is None else patch), key
+
+
+# CHART_THREADS threads per process compute bar charts next to the request thread;
+# 0 computes both charts in the request thread
+chart_threads = int(os.environ.get('CHART_THREADS', 4))
+chart_pools = {}
+
+
+class _Immediate:
+    """
+    The result of a call made on the spot, with the interface of a Future.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.value = func(*args, **kwargs)
+
+    def result(self):
+        return self.value
+
+
+def in_background(name, func, *args, **kwargs):
+    """
+    Start func in this process's chart thread pool, in a copy of the caller's context
+    so its metrics labels and request generation go along. cProfile only sees the
+    thread it runs in, so a slow call in the pool is profiled on its own, as name.
+
+    :return: A Future of its result.
+    """
+    if chart_threads <= 0:
+        return _Immediate(func, *args, **kwargs)  # profiled with the request
+    # Threads do not survive a fork, so each process starts a pool of its own
+    pool = chart_pools.get(os.getpid())
+    if pool is None:
+        pool = chart_pools.setdefault(os.getpid(), ThreadPoolExecutor(chart_threads, thread_name_prefix='charts'))
+    return pool.submit(contextvars.copy_context().run, profiled, name, func, *args, **kwargs)
+
+
+def profiled(name, func, *args, **kwargs):
+    with slow_call_profiler.profile(name):
+        return func(*args, **kwargs)
+
+
+def rolling_trends(morbidity, time_span, start_date, end_date, age, sex, race, tabs, x_range=None, data=None):
+    return trend_chart(*trend_arguments(data or live_data.current, morbidity, time_span, start_date, end_date,
+                                        age, sex, race, tabs, x_range))
+
+
+def trend_arguments(data, morbidity, time_span, start_date, end_date, age, sex, race, tabs, x_range):
+    """
+
+    :return: The normalised arguments of trend_chart.
+    """
+    morbidity, start_date, end_date, age, sex, race = normalize_inputs(data, morbidity, start_date, end_date,
+                                                                       age, sex, race)
+    return data, morbidity, time_span, start_date, end_date, age, sex, race, tabs, x_range
+
+
+@figure_cache.memoize
+def trend_chart(data, morbidity, time_span, start_date, end_date, age, sex, race, tabs, x_range):
+    checkpoint()
+    with stage('filter'):
+        dates, counts, columns, labels = filtered_series(data, morbidity, start_date, end_date, age, sex, race)
+    checkpoint()
+    with stage('rolling'):
+        values = rolling_mean(counts, time_span)
+        if tabs == 'Per Capita':
+            values = data.cube.per_capita(values, columns)
+
+    if tabs == 'Per Capita':
+        if time_span == 1:
+            title = "Total Daily Deaths per Capita"
+        else:
+            title = f"{time_span} Day Rolling Average of Total Deaths per Capita"
+        yaxis_title = 'Deaths Per Capita (Deaths Per 100,000)'
     else:
-        for group in age:
-            age_data = filtered_data[filtered_data['AGE_GROUP'] == group]
-            for gender in sex:
-                sex_data = age_data[age_data['GENDER'] == gender]
-                for races in race:
-                    race_data = sex_data[sex_data['RACE'] == races]
-                    for morbid in morbidity:
-                        morbid_data = race_data[race_data['GENERAL_MORBIDITY'] == morbid]
-                        if tabs == 'Per Capita':
-                            morbid_data.loc[:, 'ROLLING_AVG'] = \
-                                morbid_data.groupby(['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY'])[
-                                    'PER_CAP'].transform(lambda x: x.rolling(window=30, min_periods=1).mean())
-                            fig.update_yaxes(title_text='Deaths Per Capita (Deaths Per 100,000)')
-                            fig.update_layout(title_text="30 Day Rolling Average of Total Deaths per Capita")
-                        else:
-                            morbid_data['ROLLING_AVG'] = \
-                                morbid_data.groupby(['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY'])[
-                                    'CASE_NUMBER'].transform(lambda x: x.rolling(window=30, min_periods=1).mean())
-                            fig.update_yaxes(title_text='Deaths')
-                            fig.update_layout(title_text="30 Day Rolling Average of Total Deaths")
-                        morbid_data.loc[:, 'ROLLING_AVG'] = morbid_data['ROLLING_AVG'].fillna(0)
-                        if (morbid.title() == 'All Deaths') & (group == 'All') & (races == 'All') & (gender == 'All'):
-                            x_label = f"Total Pop."
-                        elif (morbid.title() == 'All Deaths') & (group == 'All') & (gender == 'All'):
-                            x_label = f"{races} Pop."
-                        elif (morbid.title() == 'All Deaths') & (races == 'All') & (gender == 'All'):
-                            x_label = f"{group} Pop."
-                        elif (group == 'All') & (races == 'All') & (gender == 'All'):
-                            x_label = f"Pop. with {morbid.title()}"
-                        elif (morbid.title() == 'All Deaths') & (group == 'All') & (races == 'All'):
-                            x_label = f"{gender} Pop."
-                        elif (morbid.title() == 'All Deaths') & (group == 'All'):
-                            x_label = f"{gender}, {races} Pop."
-                        elif morbid.title() == 'All Deaths':
-                            x_label = f"Ages: {group} for {gender}, {races} Pop."
-                        else:
-                            x_label = f"Ages: {group} for {gender}, {races} Pop. with {morbid.title()}"
-                        trace = go.Scatter(x=morbid_data['DATE_OF_DEATH'], y=morbid_data['ROLLING_AVG'], mode='lines',
-                                           name=x_label)
-                        fig.add_trace(trace)
-
-    fig.update_xaxes(title_text='Date of Death')
-    fig.update_layout(showlegend=True)
-    fig.update_layout(width=1200, height=600)
-    fig.update_layout(legend=dict(x=1, y=1, xanchor='left', yanchor='top', traceorder='normal'))
-    fig.update_layout(legend={'title': 'Demographic Group'})
-
-    return [dcc.Graph(figure=fig)]
-
-
-@app.callback(
-    [Output(component_id='output-container-2', component_property='children')],
-    [Input(component_id='morbidity-select', component_property='value'),
-     Input(component_id='date-picker-select', component_property='start_date'),
-     Input(component_id='date-picker-select', component_property='end_date'),
-     Input(component_id='age-selections', component_property='value'),
-     Input(component_id='sex-select', component_property='value'),
-     Input(component_id='race-select', component_property='value'),
-     Input(component_id='tabs-select', component_property='value'),
-     ])
-def bar_functions(morbidity, start_date, end_date, age, sex, race, tabs):
-    filtered_df = filter_data_by_date_range(df_no_covid, start_date, end_date)
-
-    filtered_data_bar = filtered_df.groupby(['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY', 'TOTAL_POP'])[
-        'CASE_NUMBER'].nunique().reset_index()
-
-    filtered_data_bar['PER_CAP'] = (filtered_data_bar['CASE_NUMBER'] / filtered_data_bar['TOTAL_POP']) * 100000
-
-    fig = make_subplots(rows=1, cols=1, subplot_titles=(""))
-
-    for index, row in filtered_data_bar[
-        filtered_data_bar['AGE_GROUP'].isin(age) & filtered_data_bar['RACE'].isin(race) & filtered_data_bar[
-            'GENDER'].isin(sex) & filtered_data_bar['GENERAL_MORBIDITY'].isin(morbidity)].iterrows():
-        if (row['GENERAL_MORBIDITY'].title() == 'All Deaths') & (row['AGE_GROUP'] == 'All') & (row['RACE'] == 'All') & (
-                row['GENDER'] == 'All'):
-            x_label = f"Total Pop."
-        elif (row['GENERAL_MORBIDITY'].title() == 'All Deaths') & (row['AGE_GROUP'] == 'All') & (
-                row['GENDER'] == 'All'):
-            x_label = f"{row['RACE']} Pop."
-        elif (row['GENERAL_MORBIDITY'].title() == 'All Deaths') & (row['RACE'] == 'All') & (row['GENDER'] == 'All'):
-            x_label = f"{row['AGE_GROUP']} Pop."
-        elif (row['AGE_GROUP'] == 'All') & (row['RACE'] == 'All') & (row['GENDER'] == 'All'):
-            x_label = f"Pop. with {row['GENERAL_MORBIDITY'].title()}"
-        elif (row['GENERAL_MORBIDITY'].title() == 'All Deaths') & (row['AGE_GROUP'] == 'All') & (row['RACE'] == 'All'):
-            x_label = f"{row['GENDER']} Pop."
-        elif (row['GENERAL_MORBIDITY'].title() == 'All Deaths') & (row['AGE_GROUP'] == 'All'):
-            x_label = f"{row['GENDER']}, {row['RACE']} Pop."
-        elif row['GENERAL_MORBIDITY'].title() == 'All Deaths':
-            x_label = f"Ages: {row['AGE_GROUP']} for {row['GENDER']}, {row['RACE']} Pop."
+        if time_span == 1:
+            title = "Total Deaths"
         else:
-            x_label = f"Ages: {row['AGE_GROUP']} for {row['GENDER']}, {row['RACE']} Pop. with {row['GENERAL_MORBIDITY'].title()}"
+            title = f"{time_span} Day Rolling Average of Total Deaths"
+        yaxis_title = 'Deaths'
+
+    if x_range:
+        # Averages are taken over the whole range first, then only the visible days
+        # (plus a day either side) are drawn, with the full point budget
+        visible = date_slice(dates, pd.Timestamp(x_range[0]).floor('D') - pd.Timedelta(days=1),
+                             pd.Timestamp(x_range[1]).ceil('D') + pd.Timedelta(days=1))
+        dates, values = dates[visible], values[visible]
+
+    checkpoint()
+    with stage('build'):
+        return trend_figure(dates, values, labels, title, yaxis_title, max_points=trend_max_points,
+                            webgl_threshold=webgl_threshold, x_range=x_range)
+
+
+def bar_functions(morbidity, start_date, end_date, age, sex, race, tabs, data=None):
+    return bar_chart(*bar_arguments(data or live_data.current, morbidity, start_date, end_date, age, sex, race, tabs))
+
+
+def bar_arguments(data, morbidity, start_date, end_date, age, sex, race, tabs):
+    """
+
+    :return: The normalised arguments of bar_chart.
+    """
+    morbidity, start_date, end_date, age, sex, race = normalize_inputs(data, morbidity, start_date, end_date,
+                                                                       age, sex, race)
+    return data, morbidity, start_date, end_date, age, sex, race, tabs
+
+
+@figure_cache.memoize
+def bar_chart(data, morbidity, start_date, end_date, age, sex, race, tabs):
+    checkpoint()
+    with stage('filter'):
+        dates, counts, columns, labels = filtered_series(data, morbidity, start_date, end_date, age, sex, race)
+    checkpoint()
+
+    # One bar per distinct series with deaths in the range, in cube column order
+    with stage('aggregate'):
+        columns, first = np.unique(columns, return_index=True)
+        totals = counts.sum(axis=0)[first]
+        keep = (columns != data.cube.empty) & (totals > 0)
+        columns, totals = columns[keep], totals[keep]
+
+    with stage('build'):
         if tabs == 'Per Capita':
-            fig.add_trace(go.Bar(
-                x=[x_label],  # x-axis category for each row
-                y=[row['PER_CAP']],  # value for each row
-                alignmentgroup=True
-            ))
-            fig.update_layout(
-                title='Total Deaths per Capita',
-                xaxis_title='Demographic Group',
-                yaxis_title='Deaths per Capita (Deaths per 100,000)',
-                barmode='group',  # 'group' for grouped bars, 'stack' for stacked bars
-            )
+            # Series without a population have no bar
+            per_capita = data.cube.per_capita(totals, columns)
+            known = ~np.isnan(per_capita)
+            fig = bar_figure(data.column_labels[columns[known]], per_capita[known],
+                             'Total Deaths per Capita', 'Deaths per Capita (Deaths per 100,000)')
         else:
-            fig.add_trace(go.Bar(
-                x=[x_label],  # x-axis category for each row
-                y=[row['CASE_NUMBER']],  # value for each row
-                alignmentgroup=True
-            ))
-            fig.update_layout(
-                title='Total Deaths',
-                xaxis_title='Demographic Group',
-                yaxis_title='Deaths',
-                barmode='group',  # 'group' for grouped bars, 'stack' for stacked bars
-            )
+            fig = bar_figure(data.column_labels[columns], totals, 'Total Deaths', 'Deaths')
 
-    fig.update_layout(showlegend=False)
-    fig.update_layout(width=1200, height=600)
-    fig.update_layout(legend=dict(x=1, y=1, xanchor='left', yanchor='top', traceorder='normal'))
+    return fig
 
-    return [dcc.Graph(figure=fig)]
+
+def export_selection(args):
+    """
+    The aggregated series of a selection for /export, one row per day and series
+    with the daily deaths and the value the tab charts. The query arguments are
+    those of the controls: morbidity, age, sex, race (each repeated per value),
+    start_date, end_date, time_span, tabs and, with a county selector, county (all
+    counties when left out).
+
+    :param args: Query arguments of the request.
+    :return: (file name, iterator of DataFrames), see export.series_frames.
+    """
+    time_span = int(args.get('time_span', default_time_span))
+    tabs = args.get('tabs', 'Per Capita')
+    if time_span < 1 or tabs not in ('Per Capita', 'Total'):
+        raise ValueError("time_span must be at least 1 and tabs 'Per Capita' or 'Total'")
+    start_date = args.get('start_date') or live_data.current.first_death_date
+    end_date = args.get('end_date') or default_end_date
+    counties = args.getlist('county') if county_select and 'county' in args else None  # all without one
+    data = dashboard_data(counties, start_date, end_date)
+    morbidity, start_date, end_date, age, sex, race = normalize_inputs(
+        data, args.getlist('morbidity'), start_date, end_date, args.getlist('age'), args.getlist('sex'),
+        args.getlist('race'))
+
+    with selection(*selection_shape(morbidity, start_date, end_date, age, sex, race)):
+        with stage('filter'):
+            dates, counts, columns, labels = filtered_series(data, morbidity, start_date, end_date, age, sex, race)
+        with stage('rolling'):
+            values = rolling_mean(counts, time_span)
+            if tabs == 'Per Capita':
+                values = data.cube.per_capita(values, columns)
+    if tabs == 'Per Capita':
+        value_column = f'DEATHS_PER_100K_{time_span}_DAY_AVERAGE'
+    else:
+        value_column = f'DEATHS_{time_span}_DAY_AVERAGE'
+    # Series are in the order selected_series lays them out
+    keys = list(itertools.product(age, sex, race, morbidity))
+    return (f'covid_deaths_{start_date}_{end_date}',
+            series_frames(dates, counts, values, keys, labels, value_column))
+
+
+# Streamed downloads of the selected series, linked below the charts
+register_export(server, export_selection)
+
+
+def warmup_tasks():
+    """
+    The default state, each of the top WARMUP_TOP_MORBIDITIES morbidities on its own,
+    and the states in the JSON list of WARMUP_QUERIES, e.g.
+    [{"morbidity": ["DIABETES", "OBESITY"], "age": ["All", "80-89 Yrs"]}], where
+    controls left out keep their default. Each state is warmed on both tabs.
+
+    :return: List of (description, callable) pairs for CacheWarmer.
+    """
+    data = live_data.current
+    default = {'morbidity': data.morbidity_order[:1], 'time_span': default_time_span,
+               'start_date': data.first_death_date, 'end_date': default_end_date,
+               'age': ['All'], 'sex': ['All'], 'race': ['All'],
+               'counties': partitioned_data.counties if county_select else None}
+    states = [('default state', default)]
+    top_morbidities = int(os.environ.get('WARMUP_TOP_MORBIDITIES', 5))
+    states += [(morbidity, dict(default, morbidity=[morbidity]))
+               for morbidity in data.morbidity_order[1:top_morbidities]]
+    if os.environ.get('WARMUP_QUERIES'):
+        with open(os.environ['WARMUP_QUERIES']) as handle:
+            states += [(f"query {position}", dict(default, **query))
+                       for position, query in enumerate(json.load(handle), 1)]
+    return [(f"{name}, {tabs}", partial(warm_state, state, tabs))
+            for name, state in states for tabs in ('Per Capita', 'Total')]
+
+
+def warm_state(state, tabs):
+    """
+    Compute and cache both charts of one state, as the chart callback would on page load.
+    """
+    morbidity, start_date, end_date = state['morbidity'], state['start_date'], state['end_date']
+    age, sex, race = state['age'], state['sex'], state['race']
+    data = dashboard_data(state['counties'], start_date, end_date)
+    with selection(*selection_shape(morbidity, start_date, end_date, age, sex, race)):
+        rolling_trends(morbidity, state['time_span'], start_date, end_date, age, sex, race, tabs, data=data)
+        bar_functions(morbidity, start_date, end_date, age, sex, race, tabs, data=data)
+
+
+# Charts drawn in the browser, or an uncached server, have nothing to warm; gunicorn
+# starts the warm-up in each worker (see gunicorn.conf.py), WARMUP_THREADS=0 disables it
+if figure_cache.enabled and not clientside_charts:
+    server.extensions['cache_warmer'] = CacheWarmer.from_environ(
+        warmup_tasks, lock_path=figure_cache.path.with_name(figure_cache.path.name + '.warmup.lock'))
+
+
+if clientside_charts:
+    app.clientside_callback(
+        ClientsideFunction(namespace='charts', function_name='update_charts'),
+        chart_outputs,
+        chart_inputs + [Input(component_id='case-cube-store', component_property='data')])
+else:
+    chart_parameters = ['morbidity', 'time_span', 'start_date', 'end_date', 'age', 'sex', 'race', 'tabs']
+    app.callback(
+        output=chart_outputs + [Output(component_id='chart-state', component_property='data')],
+        # session-id never changes after the page loads, it only identifies the tab
+        inputs=dict(zip(chart_parameters, chart_inputs),
+                    relayout_data=Input(component_id='trend-graph', component_property='relayoutData'),
+                    session=Input(component_id='session-id', component_property='data'),
+                    **({'counties': Input(component_id='county-select', component_property='value')}
+                       if county_select else {})),
+        state=dict(shown=State(component_id='chart-state', component_property='data')))(update_charts)
+
+# The download links only encode the controls, so the browser builds them in either mode
+app.clientside_callback(
+    ClientsideFunction(namespace='export', function_name='links'),
+    [Output(component_id=f'export-{file_format}', component_property='href') for file_format in export_formats],
+    chart_inputs + ([Input(component_id='county-select', component_property='value')] if county_select else []),
+    State(component_id='export-target', component_property='data'))
 
 
 # Run the Dash app
 if __name__ == '__main__':
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+    if 'cache_warmer' in server.extensions:
+        server.extensions['cache_warmer'].start()
     app.run_server(debug=True)
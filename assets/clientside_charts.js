@@ -0,0 +1,252 @@
+/* client-side chart mode: filter, average and draw both charts from the cube payload in case-cube-store */
+
+if(!window.dash_clientside) {window.dash_clientside = {};}
+
+(function () {
+    var PER_CAPITA_SCALE = 100000;
+    var DAY_MS = 24 * 60 * 60 * 1000;
+    var BAR_COLORS = ['#636EFA', '#EF553B', '#00CC96', '#AB63FA', '#FFA15A',
+                      '#19D3F3', '#FF6692', '#B6E880', '#FF97FF', '#FECB52'];
+    var SERIES_COLUMNS = ['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY'];
+
+    var decoded = null;
+    var decodedFrom = null;
+
+    function gunzipBase64(text) {
+        var binary = atob(text);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+        return new Response(stream).arrayBuffer();
+    }
+
+    /* Decode the payload once per page load; later calls reuse the same promise */
+    function decodeCube(payload) {
+        if (decodedFrom === payload.counts) {
+            return decoded;
+        }
+        decodedFrom = payload.counts;
+        decoded = gunzipBase64(payload.counts).then(function (buffer) {
+            var ints = new Int32Array(buffer);
+            var n = payload.series;
+            var nnz = payload.nonzero;
+            var columns = new Map();
+            for (var c = 0; c < n; c++) {
+                var key = SERIES_COLUMNS.map(function (column, axis) {
+                    return payload.levels[column][payload.keys[c * 4 + axis]];
+                });
+                columns.set(JSON.stringify(key), c);
+            }
+            return {
+                start: payload.start ? Date.parse(payload.start + 'T00:00:00Z') : 0,
+                days: payload.days,
+                indptr: ints.subarray(0, n + 1),
+                rows: ints.subarray(n + 1, n + 1 + nnz),
+                values: ints.subarray(n + 1 + nnz, n + 1 + 2 * nnz),
+                population: payload.population,
+                columns: columns,
+                order: payload.order,
+                webglThreshold: payload.webgl_threshold
+            };
+        });
+        return decoded;
+    }
+
+    function dayIndex(cube, date) {
+        return Math.round((Date.parse(String(date).slice(0, 10) + 'T00:00:00Z') - cube.start) / DAY_MS);
+    }
+
+    /* Same ordering as in_option_order in app.py */
+    function inOptionOrder(values, options) {
+        var rank = new Map(options.map(function (option, position) { return [option, position]; }));
+        return Array.from(new Set(values || [])).sort(function (a, b) {
+            var ra = rank.has(a) ? rank.get(a) : options.length;
+            var rb = rank.has(b) ? rank.get(b) : options.length;
+            return ra !== rb ? ra - rb : (String(a) < String(b) ? -1 : String(a) > String(b) ? 1 : 0);
+        });
+    }
+
+    /* Python's str.title() for the ASCII morbidity names */
+    function title(text) {
+        return text.toLowerCase().replace(/(^|[^a-z])([a-z])/g, function (match, boundary, letter) {
+            return boundary + letter.toUpperCase();
+        });
+    }
+
+    /* Same ladder as figures.series_label */
+    function seriesLabel(group, races, gender, morbid) {
+        morbid = title(morbid);
+        var allDeaths = morbid === 'All Deaths';
+        if (allDeaths && group === 'All' && races === 'All' && gender === 'All') {
+            return 'Total Pop.';
+        } else if (allDeaths && group === 'All' && gender === 'All') {
+            return races + ' Pop.';
+        } else if (allDeaths && races === 'All' && gender === 'All') {
+            return group + ' Pop.';
+        } else if (group === 'All' && races === 'All' && gender === 'All') {
+            return 'Pop. with ' + morbid;
+        } else if (allDeaths && group === 'All' && races === 'All') {
+            return gender + ' Pop.';
+        } else if (allDeaths && group === 'All') {
+            return gender + ', ' + races + ' Pop.';
+        } else if (allDeaths) {
+            return 'Ages: ' + group + ' for ' + gender + ', ' + races + ' Pop.';
+        }
+        return 'Ages: ' + group + ' for ' + gender + ', ' + races + ' Pop. with ' + morbid;
+    }
+
+    /* Daily counts of one series for cube days lo..hi-1; column -1 is an absent series */
+    function dailyCounts(cube, column, lo, hi) {
+        var out = new Float64Array(hi - lo);
+        if (column >= 0) {
+            for (var k = cube.indptr[column]; k < cube.indptr[column + 1]; k++) {
+                var day = cube.rows[k];
+                if (day >= lo && day < hi) {
+                    out[day - lo] = cube.values[k];
+                }
+            }
+        }
+        return out;
+    }
+
+    /* Trailing calendar-window mean, see rolling.rolling_mean */
+    function rollingMean(counts, window) {
+        window = Math.max(window, 1);
+        var sums = new Float64Array(counts.length);
+        var running = 0;
+        for (var i = 0; i < counts.length; i++) {
+            running += counts[i];
+            if (i >= window) {
+                running -= counts[i - window];
+            }
+            sums[i] = running / Math.min(i + 1, window);
+        }
+        return sums;
+    }
+
+    function dateLabels(cube, lo, hi) {
+        var dates = new Array(hi - lo);
+        for (var i = lo; i < hi; i++) {
+            dates[i - lo] = new Date(cube.start + i * DAY_MS).toISOString().slice(0, 10);
+        }
+        return dates;
+    }
+
+    function trendFigure(series, dates, values, titleText, yaxisTitle, webglThreshold) {
+        var type = series.length * dates.length > webglThreshold ? 'scattergl' : 'scatter';
+        return {
+            data: series.map(function (s, i) {
+                return {type: type, x: dates, y: Array.from(values[i]), mode: 'lines', name: s.label};
+            }),
+            layout: {
+                title: {text: titleText},
+                xaxis: {title: {text: 'Date of Death'}},
+                yaxis: {title: {text: yaxisTitle}},
+                showlegend: true,
+                width: 1200,
+                height: 600,
+                legend: {x: 1, y: 1, xanchor: 'left', yanchor: 'top', traceorder: 'normal',
+                         title: {text: 'Demographic Group'}}
+            }
+        };
+    }
+
+    function barFigure(labels, values, titleText, yaxisTitle) {
+        return {
+            data: [{
+                type: 'bar',
+                x: labels,
+                y: values,
+                marker: {color: labels.map(function (label, i) { return BAR_COLORS[i % BAR_COLORS.length]; })}
+            }],
+            layout: {
+                title: {text: titleText},
+                xaxis: {title: {text: 'Demographic Group'}},
+                yaxis: {title: {text: yaxisTitle}},
+                barmode: 'group',
+                showlegend: false,
+                width: 1200,
+                height: 600
+            }
+        };
+    }
+
+    window.dash_clientside.charts = {
+        update_charts: function (morbidity, timeSpan, startDate, endDate, age, sex, race, tabs, payload) {
+            var context = window.dash_clientside.callback_context;
+            var triggered = (context && context.triggered || []).map(function (t) { return t.prop_id; });
+            var trendOnly = triggered.length === 1 && triggered[0] === 'trend-statistics.value';
+
+            return decodeCube(payload).then(function (cube) {
+                morbidity = inOptionOrder(morbidity, cube.order.morbidity);
+                age = inOptionOrder(age, cube.order.age);
+                sex = inOptionOrder(sex, cube.order.sex);
+                race = inOptionOrder(race, cube.order.race);
+
+                var lo = Math.max(dayIndex(cube, startDate), 0);
+                var hi = Math.max(Math.min(dayIndex(cube, endDate) + 1, cube.days), lo);
+                var perCapita = tabs === 'Per Capita';
+
+                var series = [];
+                age.forEach(function (group) {
+                    sex.forEach(function (gender) {
+                        race.forEach(function (races) {
+                            morbidity.forEach(function (morbid) {
+                                var key = JSON.stringify([group, races, gender, morbid]);
+                                var column = cube.columns.has(key) ? cube.columns.get(key) : -1;
+                                series.push({
+                                    column: column,
+                                    label: seriesLabel(group, races, gender, morbid),
+                                    // null (unknown) and 0 populations have no per-capita value
+                                    population: column >= 0 && cube.population[column] > 0 ?
+                                        cube.population[column] : NaN,
+                                    counts: dailyCounts(cube, column, lo, hi)
+                                });
+                            });
+                        });
+                    });
+                });
+
+                var scale = function (s, value) {
+                    return perCapita ? value / s.population * PER_CAPITA_SCALE : value;
+                };
+                var values = series.map(function (s) {
+                    return rollingMean(s.counts, timeSpan).map(function (value) { return scale(s, value); });
+                });
+                var titleText;
+                if (timeSpan === 1) {
+                    titleText = perCapita ? 'Total Daily Deaths per Capita' : 'Total Deaths';
+                } else {
+                    titleText = timeSpan + ' Day Rolling Average of Total Deaths' + (perCapita ? ' per Capita' : '');
+                }
+                var trend = trendFigure(series, dateLabels(cube, lo, hi), values, titleText,
+                                        perCapita ? 'Deaths Per Capita (Deaths Per 100,000)' : 'Deaths',
+                                        cube.webglThreshold);
+                if (trendOnly) {
+                    return [trend, window.dash_clientside.no_update];
+                }
+
+                // One bar per distinct series with deaths in the range (and a population on the
+                // per-capita tab), in cube column order
+                var seen = new Set();
+                var bars = series.filter(function (s) {
+                    if (s.column < 0 || seen.has(s.column) || (perCapita && isNaN(s.population))) {
+                        return false;
+                    }
+                    seen.add(s.column);
+                    s.total = s.counts.reduce(function (a, b) { return a + b; }, 0);
+                    return s.total > 0;
+                }).sort(function (a, b) { return a.column - b.column; });
+
+                var bar = barFigure(
+                    bars.map(function (s) { return s.label; }),
+                    bars.map(function (s) { return scale(s, s.total); }),
+                    perCapita ? 'Total Deaths per Capita' : 'Total Deaths',
+                    perCapita ? 'Deaths per Capita (Deaths per 100,000)' : 'Deaths');
+                return [trend, bar];
+            });
+        }
+    };
+})();
@@ -0,0 +1,37 @@
+/* download links of the current selection, see app.export_selection for the query arguments */
+
+if(!window.dash_clientside) {window.dash_clientside = {};}
+
+(function () {
+    /* Query string like urllib.parse.urlencode(query, doseq=True): a list repeats its key */
+    function queryString(query) {
+        var params = new URLSearchParams();
+        Object.keys(query).forEach(function (key) {
+            var value = query[key];
+            if (value === null || value === undefined) {
+                return;
+            }
+            (Array.isArray(value) ? value : [value]).forEach(function (item) {
+                params.append(key, item);
+            });
+        });
+        return params.toString();
+    }
+
+    window.dash_clientside.export = {
+        /* The chart controls, the county selection when there is one, then the export-target store */
+        links: function (morbidity, timeSpan, startDate, endDate, age, sex, race, tabs) {
+            var target = arguments[arguments.length - 1];
+            var query = {
+                morbidity: morbidity || [], age: age || [], sex: sex || [], race: race || [],
+                start_date: startDate, end_date: endDate, time_span: timeSpan, tabs: tabs
+            };
+            if (arguments.length > 9) {
+                query.county = arguments[8];
+            }
+            return target.formats.map(function (format) {
+                return target.path + '?' + queryString(Object.assign({}, query, {format: format}));
+            });
+        }
+    };
+})();
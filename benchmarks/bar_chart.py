@@ -0,0 +1,79 @@
+"""
+Time bar_functions against the old one-go.Bar-per-row construction and compare
+the size of the JSON sent to the browser, with every age, race and sex selected:
+
+    python benchmarks/bar_chart.py --morbidities 3
+"""
+import argparse
+import os
+import sys
+import timeit
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def legacy_bar_figure(filtered_data_bar, tabs):
+    """The pre-vectorisation loop: one single-point trace and layout update per row."""
+    import plotly.graph_objs as go
+    from plotly.subplots import make_subplots
+    from figures import series_label
+
+    fig = make_subplots(rows=1, cols=1, subplot_titles=(""))
+    for index, row in filtered_data_bar.iterrows():
+        x_label = series_label(row['AGE_GROUP'], row['RACE'], row['GENDER'], row['GENERAL_MORBIDITY'])
+        value = row['PER_CAP'] if tabs == 'Per Capita' else row['CASE_NUMBER']
+        fig.add_trace(go.Bar(x=[x_label], y=[value], alignmentgroup=True))
+        fig.update_layout(title='Total Deaths', xaxis_title='Demographic Group', yaxis_title='Deaths',
+                          barmode='group')
+    fig.update_layout(showlegend=False)
+    fig.update_layout(width=1200, height=600)
+    fig.update_layout(legend=dict(x=1, y=1, xanchor='left', yanchor='top', traceorder='normal'))
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--morbidities', type=int, default=1, help='Number of top morbidities to select.')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, str(REPO_ROOT))
+    from plotly.io.json import to_json_plotly
+    import app
+
+    data = app.live_data.current
+    cube = data.cube
+    age = list(cube.levels['AGE_GROUP'])
+    race = list(cube.levels['RACE'])
+    sex = list(cube.levels['GENDER'])
+    morbidity = data.morbidity_order[:args.morbidities]
+    start_date, end_date = cube.dates[0], cube.dates[-1]
+
+    def legacy(tabs):
+        days = cube.day_slice(start_date, end_date)
+        columns = cube.select(age, race, sex, morbidity).ravel()
+        totals = cube.totals(days, columns)
+        columns, totals = columns[totals > 0], totals[totals > 0]
+        frame = cube.keys.iloc[columns].assign(CASE_NUMBER=totals, PER_CAP=cube.per_capita(totals, columns))
+        return legacy_bar_figure(frame, tabs)
+
+    def current(tabs):
+        return app.bar_functions(morbidity, start_date, end_date, age, sex, race, tabs)
+
+    print(f"{len(age)} ages x {len(race)} races x {len(sex)} sexes x {len(morbidity)} morbidities")
+    print(f"{'path':<10}{'tab':<12}{'traces':>8}{'build ms':>10}{'encode ms':>11}{'JSON KB':>10}")
+    for tabs in ('Per Capita', 'Total'):
+        for name, build in (('legacy', legacy), ('current', current)):
+            fig = build(tabs)
+            build_s = min(timeit.repeat(lambda: build(tabs), number=1, repeat=args.repeat))
+            encode_s = min(timeit.repeat(lambda: to_json_plotly(fig), number=1, repeat=args.repeat))
+            payload = len(to_json_plotly(fig).encode())
+            traces = len(fig['data'] if isinstance(fig, dict) else fig.data)
+            print(f"{name:<10}{tabs:<12}{traces:>8}{build_s * 1000:>10.1f}{encode_s * 1000:>11.1f}"
+                  f"{payload / 1024:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Time building and JSON-encoding both charts as validated graph objects encoded with
+the built-in json engine (the old path) against the plain dict figures encoded the
+way Dash does with orjson, with every age, race and sex selected:
+
+    python benchmarks/figure_build.py --morbidities 3
+"""
+import argparse
+import os
+import sys
+import timeit
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def graph_object_figure(fig):
+    """The old path: the same figure rebuilt from validated go.Scatter/go.Bar traces."""
+    import plotly.graph_objs as go
+
+    traces = []
+    for trace in fig['data']:
+        trace = {key: value for key, value in trace.items() if key != 'type'}
+        traces.append(go.Bar(**trace) if fig['data'][0]['type'] == 'bar' else go.Scatter(**trace))
+    layout = {key: value for key, value in fig['layout'].items() if key != 'template'}
+    return go.Figure(data=traces, layout=layout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--morbidities', type=int, default=1, help='Number of top morbidities to select.')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ.setdefault('FIGURE_CACHE_MAX_BYTES', '0')
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, str(REPO_ROOT))
+    from plotly.io.json import to_json_plotly
+    import app
+
+    data = app.live_data.current
+    cube = data.cube
+    age = list(cube.levels['AGE_GROUP'])
+    race = list(cube.levels['RACE'])
+    sex = list(cube.levels['GENDER'])
+    morbidity = data.morbidity_order[:args.morbidities]
+    start_date, end_date = str(cube.dates[0]), str(cube.dates[-1])
+
+    charts = {
+        'trend': lambda: app.rolling_trends(morbidity, 7, start_date, end_date, age, sex, race, 'Per Capita'),
+        'bar': lambda: app.bar_functions(morbidity, start_date, end_date, age, sex, race, 'Per Capita'),
+    }
+    engines = ['json']
+    try:
+        import orjson  # noqa: F401
+        engines.append('orjson')
+    except ImportError:
+        print("orjson is not installed; only the json engine is timed")
+
+    print(f"{len(age)} ages x {len(race)} races x {len(sex)} sexes x {len(morbidity)} morbidities")
+    print(f"{'chart':<7}{'path':<15}{'engine':<8}{'traces':>8}{'build ms':>10}{'encode ms':>11}{'JSON KB':>10}")
+    for chart, build_dict in charts.items():
+        paths = {
+            'graph objects': lambda: graph_object_figure(build_dict()),
+            'dict': build_dict,
+        }
+        for path, build in paths.items():
+            fig = build()
+            build_s = min(timeit.repeat(build, number=1, repeat=args.repeat))
+            traces = len(fig['data'] if isinstance(fig, dict) else fig.data)
+            for engine in engines:
+                encode_s = min(timeit.repeat(lambda: to_json_plotly(fig, engine=engine), number=1,
+                                             repeat=args.repeat))
+                payload = len(to_json_plotly(fig, engine=engine).encode())
+                print(f"{chart:<7}{path:<15}{engine:<8}{traces:>8}{build_s * 1000:>10.1f}"
+                      f"{encode_s * 1000:>11.1f}{payload / 1024:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
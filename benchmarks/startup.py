@@ -0,0 +1,66 @@
+"""
+Compare worker start-up cost of parsing the CSV against mapping the snapshot.
+
+Each loader runs in a fresh interpreter so timings and memory are not shared:
+
+    python benchmarks/startup.py assets/final_covid_2.csv
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+CHILD = """
+import json, sys, time
+t0 = time.perf_counter()
+import pandas as pd
+sys.path.insert(0, {root!r})
+from dataset import load_dataset
+t_import = time.perf_counter()
+if {mode!r} == 'csv':
+    df = pd.read_csv({csv!r}, low_memory=False)
+else:
+    df = load_dataset({csv!r})
+t_load = time.perf_counter()
+df[df['GENERAL_MORBIDITY'] != 'COVID-19'].groupby('GENERAL_MORBIDITY', observed=True)['CASE_NUMBER'].nunique()
+t_ready = time.perf_counter()
+memory = {{}}
+with open('/proc/self/smaps_rollup') as handle:
+    for line in handle:
+        parts = line.split()
+        if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+            memory[parts[0][:-1]] = int(parts[1]) / 1024
+print(json.dumps({{'load_s': t_load - t_import, 'ready_s': t_ready - t_import,
+                  'rss_mb': memory['Rss'], 'pss_mb': memory['Pss'],
+                  'private_mb': memory['Private_Clean'] + memory['Private_Dirty']}}))
+"""
+
+
+def run(mode, csv_path):
+    code = CHILD.format(root=str(REPO_ROOT), mode=mode, csv=str(csv_path))
+    out = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('csv', nargs='?', default=REPO_ROOT / 'assets' / 'final_covid_2.csv', type=Path)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Make sure the snapshot exists so the comparison measures a warm worker boot.
+    run('snapshot', args.csv)
+
+    print(f"{'loader':<10}{'load s':>10}{'ready s':>10}{'RSS MB':>10}{'PSS MB':>10}{'private MB':>12}")
+    for mode in ('csv', 'snapshot'):
+        results = [run(mode, args.csv) for _ in range(args.repeat)]
+        best = min(results, key=lambda r: r['ready_s'])
+        print(f"{mode:<10}{best['load_s']:>10.3f}{best['ready_s']:>10.3f}{best['rss_mb']:>10.1f}"
+              f"{best['pss_mb']:>10.1f}{best['private_mb']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
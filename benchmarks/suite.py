@@ -0,0 +1,189 @@
+"""
+Benchmark the dashboard end to end on synthetic data at several multiples of the current volume:
+
+    python benchmarks/suite.py --scales 10 100 1000 --json results.json
+
+For each scale a synthetic extract is generated (see synthetic_data.py) and the app
+is started in a fresh interpreter twice: once with an empty cache directory (cold
+start, including the snapshot build) and once reusing it (warm start). The warm
+process then drives the chart callback through Dash's HTTP endpoint for every
+scenario, trend window and tab. The figure cache is disabled and the filter stage
+cache is cleared before every call, so each call pays for the full computation.
+Reported per scale: start-up time and memory, peak memory, and p50/p99 latency and
+response bytes per scenario. 1x is the number of distinct cases in
+assets/final_covid_2.csv when it exists, else --base-cases.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+TREND_WINDOWS = (1, 7, 30)
+TABS = ('Per Capita', 'Total')
+
+
+def scenarios(app):
+    """
+
+    :return: Dict of scenario name to (morbidity, age, sex, race) selections.
+    """
+    morbidities = app.live_data.current.morbidity_order
+    ages = [option['value'] for option in app.age_options]
+    sexes = [option['value'] for option in app.sex_options]
+    races = [option['value'] for option in app.race_options]
+    return {
+        'single-all': (morbidities[:1], ['All'], ['All'], ['All']),
+        'top-5-morbidities': (morbidities[:5], ['All'], ['All'], ['All']),
+        'all-demographics': (morbidities[:1], ages, sexes, races),
+        'full-cartesian': (morbidities, ages, sexes, races),
+    }
+
+
+def rss_mb(field='VmRSS'):
+    with open('/proc/self/status') as handle:
+        for line in handle:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+def run_child(startup_only, repeat):
+    """
+    Import the app, configured through the environment by the parent, and time the callbacks.
+
+    :return: Dict of results, printed as JSON for the parent.
+    """
+    start = time.perf_counter()
+    sys.path.insert(0, str(REPO_ROOT))
+    os.chdir(REPO_ROOT)
+    import app
+    cube = app.live_data.current.cube
+    result = {'startup_s': time.perf_counter() - start, 'startup_rss_mb': rss_mb(),
+              'days': len(cube.dates), 'series': int(cube.empty)}
+    if startup_only:
+        return result
+
+    import numpy as np
+
+    client = app.server.test_client()
+    callback = next(dependency for dependency in client.get('/_dash-dependencies').get_json()
+                    if 'trend-graph.figure' in dependency['output'])
+    start_date, end_date = str(cube.dates[0]), str(cube.dates[-1])
+
+    def post(morbidity, window, age, sex, race, tabs):
+        values = {'morbidity-select.value': morbidity, 'trend-statistics.value': window,
+                  'date-picker-select.start_date': start_date, 'date-picker-select.end_date': end_date,
+                  'age-selections.value': age, 'sex-select.value': sex, 'race-select.value': race,
+                  'tabs-select.value': tabs}
+        inputs = [dict(item, value=values.get(f"{item['id']}.{item['property']}")) for item in callback['inputs']]
+        outputs = [dict(zip(('id', 'property'), output.split('.')))
+                   for output in callback['output'].strip('.').split('...')]
+        body = {'output': callback['output'], 'outputs': outputs, 'inputs': inputs,
+                'changedPropIds': ['tabs-select.value'], 'state': callback.get('state', [])}
+        app.selected_series.cache_clear()
+        begin = time.perf_counter()
+        response = client.post('/_dash-update-component', json=body)
+        elapsed = time.perf_counter() - begin
+        if response.status_code != 200:
+            raise RuntimeError(f"callback failed with {response.status_code}: {response.data[:200]!r}")
+        return elapsed, len(response.data)
+
+    result['scenarios'] = {}
+    for name, (morbidity, age, sex, race) in scenarios(app).items():
+        latencies, sizes = [], []
+        for window in TREND_WINDOWS:
+            for tabs in TABS:
+                post(morbidity, window, age, sex, race, tabs)  # warm-up
+                for _ in range(repeat):
+                    elapsed, size = post(morbidity, window, age, sex, race, tabs)
+                    latencies.append(elapsed)
+                    sizes.append(size)
+        result['scenarios'][name] = {
+            'series': len(morbidity) * len(age) * len(sex) * len(race),
+            'calls': len(latencies),
+            'p50_ms': float(np.percentile(latencies, 50) * 1000),
+            'p99_ms': float(np.percentile(latencies, 99) * 1000),
+            'max_bytes': max(sizes),
+        }
+    result['peak_rss_mb'] = rss_mb('VmHWM')
+    return result
+
+
+def base_cases(args):
+    if args.base_cases:
+        return args.base_cases
+    source = REPO_ROOT / 'assets' / 'final_covid_2.csv'
+    if source.exists():
+        import pandas as pd
+        return int(pd.read_csv(source, usecols=['CASE_NUMBER'])['CASE_NUMBER'].nunique())
+    return 10_000
+
+
+def start_child(csv_path, cache_dir, startup_only, repeat):
+    env = dict(os.environ, COVID_DATA_PATH=str(csv_path), COVID_CACHE_DIR=str(cache_dir),
+               FIGURE_CACHE_MAX_BYTES='0', INGEST_POLL_SECONDS='0', PYTHONWARNINGS='ignore')
+    command = [sys.executable, __file__, '--child', '--repeat', str(repeat)]
+    if startup_only:
+        command.append('--startup-only')
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--base-cases', type=int, help='Cases at 1x; default from the real extract, else 10000.')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed calls per scenario, window and tab.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', type=Path, default=REPO_ROOT / '.cache' / 'benchmarks',
+                        help='Where generated data and snapshots are kept between runs.')
+    parser.add_argument('--json', type=Path, help='Also write the results to this file.')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--startup-only', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.startup_only, args.repeat)))
+        return
+
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from synthetic_data import generate
+
+    base = base_cases(args)
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    results = {'base_cases': base, 'scales': {}}
+    for scale in args.scales:
+        cases = base * scale
+        csv_path = args.work_dir / f"synthetic-{cases}-seed{args.seed}.csv"
+        if not csv_path.exists():
+            print(f"generating {cases} cases into {csv_path}", file=sys.stderr)
+            generate(csv_path, cases, seed=args.seed)
+        cache_dir = args.work_dir / f"cache-{cases}-seed{args.seed}"
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+        cold = start_child(csv_path, cache_dir, True, args.repeat)
+        warm = start_child(csv_path, cache_dir, False, args.repeat)
+        results['scales'][scale] = {'cases': cases, 'csv_mb': csv_path.stat().st_size / 2 ** 20,
+                                    'cold_startup_s': cold['startup_s'], **warm}
+
+        print(f"\n{scale}x: {cases} cases, {results['scales'][scale]['csv_mb']:.0f} MB CSV, "
+              f"{warm['days']} days x {warm['series']} series")
+        print(f"  startup: cold {cold['startup_s']:.2f} s, warm {warm['startup_s']:.2f} s, "
+              f"{warm['startup_rss_mb']:.0f} MB RSS; peak {warm['peak_rss_mb']:.0f} MB")
+        print(f"  {'scenario':<20}{'series':>8}{'p50 ms':>10}{'p99 ms':>10}{'KB':>10}")
+        for name, row in warm['scenarios'].items():
+            print(f"  {name:<20}{row['series']:>8}{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+                  f"{row['max_bytes'] / 1024:>10.1f}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Generate a synthetic medical examiner extract with the schema of assets/final_covid_2.csv:
+
+    python benchmarks/synthetic_data.py 100000 /tmp/synthetic-100k.csv --seed 1
+
+Like the real file, every case is repeated for each of its morbidities plus
+'All Deaths', and for each demographic rollup (every mix of its own age group, race
+and gender with 'All'). TOTAL_POP depends only on the (age, race, gender) row, and
+the 'All' populations are sums of the detailed ones. Ages skew old, dates follow
+a few waves, and morbidities follow a long-tailed frequency. Cases are generated
+and written in chunks, so memory stays flat at any volume.
+"""
+import argparse
+import itertools
+import sys
+
+import numpy as np
+import pandas as pd
+
+AGE_GROUPS = ['< 18 Yrs', '19-29 Yrs', '30-39 Yrs', '40-49 Yrs', '50-59 Yrs', '60-69 Yrs',
+              '70-79 Yrs', '80-89 Yrs', '90-99 Yrs', '100 Yrs <']
+AGE_WEIGHTS = [0.005, 0.01, 0.02, 0.05, 0.1, 0.18, 0.24, 0.24, 0.14, 0.015]
+RACES = ['White', 'Black', 'Asian', 'Other']
+RACE_WEIGHTS = [0.45, 0.33, 0.07, 0.15]
+GENDERS = ['Female', 'Male']
+GENDER_WEIGHTS = [0.45, 0.55]
+MORBIDITIES = ['COVID-19', 'HYPERTENSION', 'DIABETES', 'CARDIOVASCULAR DISEASE', 'OBESITY',
+               'CHRONIC KIDNEY DISEASE', 'COPD', 'DEMENTIA', 'CANCER', 'STROKE', 'ASTHMA',
+               'LIVER DISEASE', 'SUBSTANCE USE', 'PNEUMONIA', 'SEPSIS', 'HIV']
+
+COLUMNS = ['CASE_NUMBER', 'DATE_OF_DEATH', 'AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY', 'TOTAL_POP']
+
+# (centre, width) of the death waves as fractions of the date range, and their weights
+WAVES = [(0.08, 0.03), (0.3, 0.05), (0.45, 0.04), (0.7, 0.06), (0.9, 0.08)]
+WAVE_WEIGHTS = [0.3, 0.25, 0.15, 0.2, 0.1]
+
+
+def population_table(rng):
+    """
+
+    :return: Population per (age, race, gender) code, with the last code of each axis meaning 'All'.
+    """
+    detailed = rng.integers(2_000, 250_000, (len(AGE_GROUPS), len(RACES), len(GENDERS)))
+    table = np.zeros((len(AGE_GROUPS) + 1, len(RACES) + 1, len(GENDERS) + 1), dtype=np.int64)
+    table[:-1, :-1, :-1] = detailed
+    for axes in itertools.product((False, True), repeat=3):
+        summed = tuple(axis for axis, rolled_up in enumerate(axes) if rolled_up)
+        index = tuple(slice(-1, None) if rolled_up else slice(None, -1) for rolled_up in axes)
+        table[index] = detailed.sum(axis=summed, keepdims=True)
+    return table
+
+
+def death_days(rng, n, days):
+    """
+
+    :return: Day offsets in [0, days) drawn from the waves.
+    """
+    wave = rng.choice(len(WAVES), n, p=WAVE_WEIGHTS)
+    centres, widths = np.array(WAVES).T
+    offsets = rng.normal(centres[wave], widths[wave]) * days
+    return np.clip(offsets, 0, days - 1).astype(np.int64)
+
+
+def case_morbidities(rng, n):
+    """
+    Pick 1-3 distinct morbidities per case, weighted towards the head of MORBIDITIES.
+
+    :return: (case index, morbidity code) of every pair.
+    """
+    weights = 1.0 / np.arange(1, len(MORBIDITIES) + 1)
+    # Gumbel top-k: sorting perturbed log-weights samples without replacement in one go
+    ranks = np.argsort(-(np.log(weights) + rng.gumbel(size=(n, len(MORBIDITIES)))), axis=1)
+    counts = 1 + rng.binomial(2, 0.35, n)
+    keep = np.arange(len(MORBIDITIES)) < counts[:, None]
+    cases = np.repeat(np.arange(n), counts)
+    return cases, ranks[keep]
+
+
+def generate_chunk(rng, first_case, n, start, days, population):
+    """
+
+    :return: DataFrame with every row of cases first_case .. first_case + n - 1.
+    """
+    age = rng.choice(len(AGE_GROUPS), n, p=AGE_WEIGHTS)
+    race = rng.choice(len(RACES), n, p=RACE_WEIGHTS)
+    gender = rng.choice(len(GENDERS), n, p=GENDER_WEIGHTS)
+    dates = (np.datetime64(start, 'D') + death_days(rng, n, days)).astype(str)
+
+    cases, morbidity = case_morbidities(rng, n)
+    # 'All Deaths' is one more morbidity code, after the real ones
+    cases = np.concatenate([np.arange(n), cases])
+    morbidity = np.concatenate([np.full(n, len(MORBIDITIES)), morbidity])
+
+    frames = []
+    for age_all, race_all, gender_all in itertools.product((False, True), repeat=3):
+        a = np.full(len(cases), len(AGE_GROUPS)) if age_all else age[cases]
+        r = np.full(len(cases), len(RACES)) if race_all else race[cases]
+        g = np.full(len(cases), len(GENDERS)) if gender_all else gender[cases]
+        frames.append(pd.DataFrame({
+            'CASE_NUMBER': first_case + cases,
+            'DATE_OF_DEATH': dates[cases],
+            'AGE_GROUP': np.array(AGE_GROUPS + ['All'])[a],
+            'RACE': np.array(RACES + ['All'])[r],
+            'GENDER': np.array(GENDERS + ['All'])[g],
+            'GENERAL_MORBIDITY': np.array(MORBIDITIES + ['All Deaths'])[morbidity],
+            'TOTAL_POP': population[a, r, g],
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def generate(path, cases, seed=0, start='2020-03-01', days=900, chunk_cases=100_000):
+    """
+    Write a synthetic extract of the given number of cases to path.
+
+    :return: Number of rows written.
+    """
+    rng = np.random.default_rng(seed)
+    population = population_table(rng)
+    rows = 0
+    for first_case in range(0, cases, chunk_cases):
+        chunk = generate_chunk(rng, 100_000 + first_case, min(chunk_cases, cases - first_case), start, days,
+                               population)
+        chunk.to_csv(path, mode='w' if first_case == 0 else 'a', header=first_case == 0, index=False,
+                     columns=COLUMNS)
+        rows += len(chunk)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('cases', type=int, help='Number of distinct cases.')
+    parser.add_argument('path', help='CSV file to write.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--start', default='2020-03-01', help='First possible date of death.')
+    parser.add_argument('--days', type=int, default=900, help='Length of the date range.')
+    args = parser.parse_args()
+
+    rows = generate(args.path, args.cases, args.seed, args.start, args.days)
+    print(f"wrote {rows} rows for {args.cases} cases to {args.path}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Boot gunicorn with and without shared data and report the memory of each worker:
+
+    python benchmarks/worker_memory.py --workers 4
+
+RSS counts shared pages in every worker, PSS splits them between the processes
+sharing them and private is what each extra worker really costs.
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def smaps_rollup(pid):
+    memory = {}
+    with open(f'/proc/{pid}/smaps_rollup') as handle:
+        for line in handle:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                memory[parts[0][:-1]] = int(parts[1]) / 1024
+    return memory['Rss'], memory['Pss'], memory['Private_Clean'] + memory['Private_Dirty']
+
+
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as handle:
+        return [int(pid) for pid in handle.read().split()]
+
+
+def measure(shared, workers, timeout):
+    port = free_port()
+    env = dict(os.environ, SHARED_DATA='1' if shared else '0')
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                               '--workers', str(workers), '--bind', f'127.0.0.1:{port}', 'app:server'],
+                              cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + timeout
+        while True:
+            try:
+                # One page load per worker so each has served a request before measuring.
+                for _ in range(workers):
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=5).read()
+                if len(worker_pids(master.pid)) == workers:
+                    break
+            except OSError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError('gunicorn did not come up')
+            time.sleep(0.5)
+        time.sleep(1)
+        return [smaps_rollup(master.pid)] + [smaps_rollup(pid) for pid in worker_pids(master.pid)]
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--timeout', type=float, default=120)
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'process':<10}{'RSS MB':>10}{'PSS MB':>10}{'private MB':>12}")
+    for shared in (False, True):
+        mode = 'shared' if shared else 'private'
+        processes = measure(shared, args.workers, args.timeout)
+        for name, (rss, pss, private) in zip(['master'] + [f'worker {i}' for i in range(1, args.workers + 1)],
+                                             processes):
+            print(f"{mode:<10}{name:<10}{rss:>10.1f}{pss:>10.1f}{private:>12.1f}")
+        total_pss = sum(pss for _, pss, _ in processes)
+        print(f"{mode:<10}{'total':<10}{'':>10}{total_pss:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
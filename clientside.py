@@ -0,0 +1,51 @@
+"""
+Compact browser copy of the case cube for the client-side chart mode.
+
+The cube is sent once as a sparse, gzip-compressed block of int32 arrays, plus
+the population of each series and the option order of the controls. From that,
+assets/clientside_charts.js filters, averages and draws both charts in the
+browser without a server round trip.
+"""
+import base64
+import gzip
+
+import numpy as np
+
+from aggregates import SERIES_COLUMNS
+from figures import WEBGL_POINT_THRESHOLD
+
+
+def cube_payload(cube, option_order, webgl_threshold=WEBGL_POINT_THRESHOLD):
+    """
+    Encode a CaseCube for a dcc.Store.
+
+    Counts are stored column by column (CSC): ``indptr`` gives each series' range
+    in ``days``/``values``, which hold the day offset and distinct-case count of
+    every non-zero cell. The three arrays are concatenated as little-endian int32,
+    gzipped and base64-encoded.
+
+    :param cube: The CaseCube to ship.
+    :param option_order: Dict of 'age', 'sex', 'race' and 'morbidity' to the values
+        in the order the controls list them.
+    :return: A JSON-serialisable dict.
+    """
+    counts = cube.counts[:, :cube.empty].T
+    columns, days = np.nonzero(counts)
+    values = counts[columns, days]
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(columns, minlength=cube.empty))])
+
+    blob = np.concatenate([indptr, days, values]).astype('<i4').tobytes()
+    codes = np.column_stack([cube.levels[column].get_indexer(cube.keys[column]) for column in SERIES_COLUMNS])
+
+    return {
+        'start': str(cube.dates[0]) if len(cube.dates) else None,
+        'days': len(cube.dates),
+        'series': int(cube.empty),
+        'nonzero': len(values),
+        'levels': {column: list(cube.levels[column]) for column in SERIES_COLUMNS},
+        'keys': codes.reshape(-1).tolist(),
+        'population': cube.population.tolist(),
+        'order': option_order,
+        'webgl_threshold': webgl_threshold,
+        'counts': base64.b64encode(gzip.compress(blob, mtime=0)).decode('ascii'),
+    }
@@ -0,0 +1,368 @@
+"""
+Loading of the Cook County medical examiner data.
+
+The source CSV is parsed once into a columnar snapshot: one ``.npy`` file per
+column plus a JSON manifest. Text columns are stored as categorical codes,
+DATE_OF_DEATH as datetime64 and CASE_NUMBER as an integer when it is numeric.
+Rows are sorted by DATE_OF_DEATH, so a date range is always a contiguous slice.
+An extra CASE_ID column numbers the cases densely from 0, so distinct cases can
+be counted by sorting small integers instead of hashing case numbers. TOTAL_POP
+is not stored per row; the snapshot keeps it as a population.csv dimension table
+with one row per demographic, see population.py.
+Workers memory-map the snapshot instead of re-parsing the CSV, so every process
+on a box shares the same page-cache copy of the data.
+
+A snapshot records how many bytes of the CSV it was built from. Rows appended to
+the CSV later leave it valid for that prefix; they are read separately with
+read_rows (see ingest.py) instead of forcing a rebuild, until they grow past
+MAX_TAIL_FRACTION of the snapshot and are folded into a new one.
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from population import POPULATION_COLUMN, PopulationTable
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - gunicorn only runs on POSIX anyway
+    fcntl = None
+
+SNAPSHOT_FORMAT = 4
+
+CATEGORICAL_COLUMNS = ['AGE_GROUP', 'RACE', 'GENDER', 'GENERAL_MORBIDITY']
+DATE_COLUMN = 'DATE_OF_DEATH'
+CASE_COLUMN = 'CASE_NUMBER'
+CASE_ID_COLUMN = 'CASE_ID'
+
+# Appended rows are parsed on every start until they exceed this fraction of the
+# snapshot's bytes; then the snapshot is rebuilt with them
+MAX_TAIL_FRACTION = 0.1
+
+
+def default_cache_dir():
+    """
+    Kept out of assets/, which Dash serves and watches for hot reloading.
+
+    :return: Directory for snapshots and other derived files, COVID_CACHE_DIR or ./.cache.
+    """
+    return Path(os.environ.get('COVID_CACHE_DIR', '.cache'))
+
+
+def file_digest(path, limit=None, chunk_size=1 << 20):
+    """
+
+    :param path: File to hash.
+    :param limit: Only hash the first limit bytes.
+    :return: Hex SHA-256 digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            if limit is not None:
+                chunk = chunk[:max(limit, 0)]
+                limit -= len(chunk)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def complete_bytes(path, size, block_size=1 << 16):
+    """
+    A writer may be half-way through appending a line; only whole lines are read.
+
+    :return: Offset just after the last newline within the first size bytes of path.
+    """
+    with open(path, 'rb') as handle:
+        end = size
+        while end > 0:
+            start = max(end - block_size, 0)
+            handle.seek(start)
+            newline = handle.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+class _PrefixReader:
+    """
+    File-like view of the first bytes of an open file, for read_csv.
+    """
+
+    def __init__(self, handle, size):
+        self.handle = handle
+        self.left = size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.left:
+            size = self.left
+        data = self.handle.read(size)
+        self.left -= len(data)
+        return data
+
+
+def read_rows(csv_path, start, end, names=None):
+    """
+    Parse the CSV lines between two byte offsets.
+
+    :param start: Offset of the first line; 0 reads the header from the file.
+    :param end: Offset just after the last line, see complete_bytes.
+    :param names: Column names when start is past the header.
+    :return: DataFrame with DATE_OF_DEATH parsed, not sorted.
+    """
+    with open(csv_path, 'rb') as handle:
+        handle.seek(start)
+        reader = _PrefixReader(handle, end - start)
+        if start:
+            df = pd.read_csv(reader, header=None, names=names, low_memory=False)
+        else:
+            df = pd.read_csv(reader, low_memory=False)
+    df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN])
+    return df
+
+
+def case_ids(df):
+    """
+
+    :return: Dense int32 case IDs of df's rows: its CASE_ID column, or codes numbered
+        in order of first appearance when it has none.
+    """
+    if CASE_ID_COLUMN in df:
+        return df[CASE_ID_COLUMN].to_numpy()
+    return pd.factorize(df[CASE_COLUMN])[0].astype(np.int32)
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def _read_pointer(pointer_path):
+    try:
+        with open(pointer_path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path, payload):
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    with os.fdopen(fd, 'w') as handle:
+        json.dump(payload, handle)
+    os.replace(tmp_path, path)
+
+
+def _encode_column(series):
+    """
+    Turn one parsed CSV column into an ndarray plus the metadata needed to rebuild it.
+
+    :param series: Column as returned by read_csv.
+    :return: (array, meta) tuple.
+    """
+    name = series.name
+    if name == DATE_COLUMN:
+        return series.to_numpy(dtype='datetime64[ns]'), {'kind': 'datetime'}
+    if name == CASE_COLUMN:
+        as_int = pd.to_numeric(series, errors='coerce')
+        if not as_int.isna().any():
+            return as_int.to_numpy(dtype=np.int64), {'kind': 'numeric'}
+    if name in CATEGORICAL_COLUMNS or series.dtype == object:
+        categorical = pd.Categorical(series)
+        return categorical.codes, {'kind': 'categorical', 'categories': categorical.categories.tolist()}
+    return series.to_numpy(), {'kind': 'numeric'}
+
+
+def build_snapshot(csv_path, snapshot_path, source_bytes=None):
+    """
+    Parse the CSV once and write it as a directory of memory-mappable columns.
+
+    :param csv_path: Source CSV.
+    :param snapshot_path: Directory to create; must not exist yet.
+    :param source_bytes: Only parse this many bytes of the CSV; by default all of it.
+    :return: The column metadata written to the manifest.
+    """
+    if source_bytes is None:
+        source_bytes = os.stat(csv_path).st_size
+    return write_snapshot(read_rows(csv_path, 0, source_bytes), snapshot_path)
+
+
+def write_snapshot(df, snapshot_path):
+    """
+    Write parsed records as a directory of memory-mappable columns.
+
+    :param df: Records as returned by read_rows.
+    :param snapshot_path: Directory to create; must not exist yet.
+    :return: The column metadata written to the manifest.
+    """
+    df = df.sort_values(DATE_COLUMN, kind='stable', ignore_index=True)
+    df[CASE_ID_COLUMN] = case_ids(df)
+
+    tmp_dir = Path(tempfile.mkdtemp(dir=snapshot_path.parent, prefix=snapshot_path.name, suffix='.tmp'))
+    if POPULATION_COLUMN in df:
+        PopulationTable.from_frame(df).to_csv(tmp_dir / 'population.csv')
+        df = df.drop(columns=POPULATION_COLUMN)
+    columns = []
+    for position, name in enumerate(df.columns):
+        values, meta = _encode_column(df[name])
+        file_name = f"{position:03d}.npy"
+        np.save(tmp_dir / file_name, np.ascontiguousarray(values))
+        columns.append(dict(meta, name=name, file=file_name))
+
+    _write_json_atomic(tmp_dir / 'manifest.json', {'format': SNAPSHOT_FORMAT, 'rows': len(df), 'columns': columns})
+    os.rename(tmp_dir, snapshot_path)
+    return columns
+
+
+def load_snapshot(snapshot_path):
+    """
+    Memory-map a snapshot directory as a DataFrame without copying the columns.
+
+    :param snapshot_path: Directory written by build_snapshot.
+    :return: A DataFrame whose column buffers are read-only file mappings; its
+        attrs['snapshot'] names the snapshot, which changes with the CSV contents,
+        and attrs['population'] is the path of its population table, if any.
+    """
+    with open(snapshot_path / 'manifest.json') as handle:
+        manifest = json.load(handle)
+
+    data = {}
+    for meta in manifest['columns']:
+        values = np.load(snapshot_path / meta['file'], mmap_mode='r')
+        if meta['kind'] == 'categorical':
+            values = pd.Categorical.from_codes(values, categories=meta['categories'], validate=False)
+        data[meta['name']] = values
+    df = pd.DataFrame(data, copy=False)
+    df.attrs['snapshot'] = snapshot_path.name
+    if (snapshot_path / 'population.csv').exists():
+        df.attrs['population'] = str(snapshot_path / 'population.csv')
+    return df
+
+
+def share_array(array):
+    """
+    Copy an array into anonymous shared memory.
+
+    Processes forked afterwards (gunicorn workers with preload_app) map the same
+    physical pages instead of getting copy-on-write private copies, and the result
+    is read-only so no worker can write into memory the others see.
+
+    :param array: Numeric ndarray.
+    :return: A read-only ndarray with the same contents.
+    """
+    if array.nbytes == 0:
+        shared = array.copy()
+    else:
+        shared = np.frombuffer(mmap.mmap(-1, array.nbytes), dtype=array.dtype, count=array.size)
+        shared = shared.reshape(array.shape)
+        shared[...] = array
+    shared.flags.writeable = False
+    return shared
+
+
+def date_slice(dates, start_date, end_date):
+    """
+    Binary-search a sorted date column for an inclusive date range.
+
+    :param dates: Sorted datetime64 array, e.g. a snapshot's DATE_OF_DEATH column.
+    :param start_date: First date to keep; anything pd.Timestamp accepts.
+    :param end_date: Last date to keep (inclusive).
+    :return: A slice selecting the rows inside the range.
+    """
+    start = pd.Timestamp(start_date).to_datetime64()
+    end = pd.Timestamp(end_date).to_datetime64()
+    lo = int(np.searchsorted(dates, start, side='left'))
+    hi = int(np.searchsorted(dates, end, side='right'))
+    return slice(lo, max(lo, hi))
+
+
+def _remove_stale_snapshots(root, stem, keep):
+    for path in root.glob(f"{stem}-*"):
+        if path.is_dir() and path.name != keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def _snapshot_lock(root, stem):
+    with open(root / f"{stem}.lock", 'w') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def _ensure_snapshot_locked(csv_path, root):
+    pointer_path = root / f"{csv_path.stem}.json"
+    stamp = _source_stamp(csv_path)
+    pointer = _read_pointer(pointer_path)
+    if (pointer and pointer.get('format') == SNAPSHOT_FORMAT and 'bytes' in pointer
+            and (root / pointer['snapshot']).is_dir()):
+        if pointer['source'] == stamp:
+            return root / pointer['snapshot'], pointer
+        # Still valid if the CSV only had a few rows appended since the snapshot was built
+        tail = stamp['size'] - pointer['bytes']
+        if (0 <= tail <= MAX_TAIL_FRACTION * pointer['bytes']
+                and pointer['digest'] == file_digest(csv_path, pointer['bytes'])):
+            pointer['source'] = stamp
+            _write_json_atomic(pointer_path, pointer)
+            return root / pointer['snapshot'], pointer
+
+    source_bytes = complete_bytes(csv_path, stamp['size'])
+    digest = file_digest(csv_path, source_bytes)
+    name = f"{csv_path.stem}-{digest[:16]}-v{SNAPSHOT_FORMAT}"
+    if not (root / name).is_dir():
+        build_snapshot(csv_path, root / name, source_bytes)
+    pointer = {'format': SNAPSHOT_FORMAT, 'source': stamp, 'digest': digest, 'bytes': source_bytes,
+               'snapshot': name}
+    _write_json_atomic(pointer_path, pointer)
+    _remove_stale_snapshots(root, csv_path.stem, keep=name)
+    return root / name, pointer
+
+
+def ensure_snapshot(csv_path, snapshot_root=None):
+    """
+    Return the snapshot for csv_path, rebuilding it only when the CSV changed.
+
+    A matching mtime and size reuse the snapshot straight away. Otherwise the part
+    of the CSV the snapshot was built from is hashed, and the snapshot is only
+    rebuilt when that part changed, or when the rows appended after it exceed
+    MAX_TAIL_FRACTION of its size.
+
+    :param csv_path: Source CSV.
+    :param snapshot_root: Directory holding snapshots, see default_cache_dir.
+    :return: (snapshot directory, pointer dict with the source digest and the
+        number of CSV bytes in the snapshot).
+    """
+    csv_path = Path(csv_path)
+    root = Path(snapshot_root) if snapshot_root else default_cache_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    with _snapshot_lock(root, csv_path.stem):
+        return _ensure_snapshot_locked(csv_path, root)
+
+
+def load_dataset(csv_path, snapshot_root=None):
+    """
+
+    :param csv_path: Source CSV of medical examiner records.
+    :param snapshot_root: Optional snapshot directory override.
+    :return: The records as a memory-mapped DataFrame; attrs['source_bytes'] is the
+        length of the CSV prefix they were parsed from.
+    """
+    csv_path = Path(csv_path)
+    root = Path(snapshot_root) if snapshot_root else default_cache_dir()
+    root.mkdir(parents=True, exist_ok=True)
+    # Map the columns while still holding the lock so a concurrent rebuild
+    # cannot remove the snapshot between resolving and opening it.
+    with _snapshot_lock(root, csv_path.stem):
+        snapshot_path, pointer = _ensure_snapshot_locked(csv_path, root)
+        df = load_snapshot(snapshot_path)
+    df.attrs['source_bytes'] = pointer['bytes']
+    return df
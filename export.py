@@ -0,0 +1,148 @@
+"""
+Download of the aggregated series behind the current chart selection.
+
+An export is the long form of what the trend chart draws: one row per day and
+selected series, with the series' demographic and morbidity, its daily distinct
+deaths and the value the current tab charts (the rolling average, in total or per
+100,000). It is computed from the case cube like the charts, then written out a
+block of days at a time and streamed as a chunked response, so even a multi-year
+export of many series is never held in memory as a whole file. Parquet needs
+pyarrow; without it only CSV is offered.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # CSV only
+    pyarrow = None
+
+# Rows per streamed block
+CHUNK_ROWS = 50000
+
+SERIES_KEY_COLUMNS = ['AGE_GROUP', 'GENDER', 'RACE', 'GENERAL_MORBIDITY']
+
+
+def series_frames(dates, counts, values, keys, labels, value_column, chunk_rows=CHUNK_ROWS):
+    """
+    The series of a selection in long form, a block of days at a time.
+
+    :param dates: datetime64 dates of the rows of counts and values.
+    :param counts: Daily deaths, shape (days, series).
+    :param values: Charted value of each day and series, same shape.
+    :param keys: (age group, gender, race, morbidity) tuple of each series.
+    :param labels: Chart label of each series.
+    :param value_column: Name of the values column.
+    :return: Iterator of DataFrames with DATE, the SERIES_KEY_COLUMNS, SERIES,
+        DEATHS and value_column, ordered by date then series; at least one, even
+        for an empty selection.
+    """
+    series = len(labels)
+    key_columns = {column: np.array([key[position] for key in keys], dtype=object)
+                   for position, column in enumerate(SERIES_KEY_COLUMNS)}
+    labels = np.asarray(labels, dtype=object)
+    days_per_chunk = max(1, chunk_rows // max(series, 1))
+    for start in range(0, max(len(dates), 1), days_per_chunk):
+        block = slice(start, start + days_per_chunk)
+        days = len(dates[block])
+        frame = {'DATE': np.repeat(dates[block], series)}
+        frame.update({column: np.tile(column_keys, days) for column, column_keys in key_columns.items()})
+        frame['SERIES'] = np.tile(labels, days)
+        frame['DEATHS'] = np.asarray(counts[block], dtype=np.int64).reshape(-1)
+        frame[value_column] = np.asarray(values[block], dtype=np.float64).reshape(-1)
+        yield pd.DataFrame(frame)
+
+
+def csv_stream(frames):
+    """
+
+    :return: Iterator of the bytes of frames as one CSV file.
+    """
+    header = True
+    for frame in frames:
+        yield frame.to_csv(index=False, header=header, date_format='%Y-%m-%d').encode()
+        header = False
+
+
+class _Chunks:
+    """
+    Write-only file for pyarrow that keeps what was written until it is taken.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_stream(frames):
+    """
+
+    :return: Iterator of the bytes of frames as one Parquet file, a row group per frame.
+    """
+    sink = _Chunks()
+    writer = None
+    for frame in frames:
+        table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+    yield sink.take()
+
+
+# Format name to (link label, media type, streaming writer)
+FORMATS = {'csv': ('CSV', 'text/csv', csv_stream)}
+if pyarrow is not None:
+    FORMATS['parquet'] = ('Parquet', 'application/vnd.apache.parquet', parquet_stream)
+
+
+def register_export(server, export, path='/export'):
+    """
+    Serve exports at path on a Flask server, e.g. /export?format=csv&morbidity=DIABETES&age=All.
+
+    :param export: Callable taking the request's query arguments (a MultiDict) and
+        returning (file name without extension, iterator of DataFrames); a
+        ValueError or KeyError is answered with 400 Bad Request.
+    """
+    from flask import Response, abort, request, stream_with_context
+
+    @server.route(path)
+    def export_series():
+        file_format = request.args.get('format', 'csv')
+        if file_format not in FORMATS:
+            abort(400, f"format must be one of {', '.join(FORMATS)}")
+        try:
+            name, frames = export(request.args)
+        except (KeyError, ValueError) as error:
+            abort(400, str(error))
+        label, media_type, stream = FORMATS[file_format]
+        name = re.sub(r'[^\w.-]+', '_', name)
+        return Response(stream_with_context(stream(frames)), content_type=media_type,
+                        headers={'Content-Disposition': f'attachment; filename="{name}.{file_format}"'})
+
+    return server
@@ -0,0 +1,180 @@
+"""
+Rendered-figure cache shared by every worker process on a box.
+
+Figures are stored as plotly JSON in a local SQLite database, keyed by the name of
+the function that built them and its (already normalised) arguments. Entries are
+evicted least-recently-used first once their total size exceeds a byte budget.
+Each entry is tagged with a version string built from the dataset snapshot and
+the dashboard source, so a new snapshot or deploy never serves stale figures.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import plotly.io as pio
+
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS figures (
+    key TEXT PRIMARY KEY,
+    version TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS figures_last_used ON figures (last_used);
+"""
+
+
+def source_fingerprint(*paths):
+    """
+
+    :param paths: Source files whose changes must invalidate cached figures.
+    :return: Short hex digest of their contents.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(Path(path).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+class FigureCache:
+    """
+    Byte-bounded LRU store of figure JSON in SQLite, safe to share between processes.
+    """
+
+    def __init__(self, path, version, max_bytes=DEFAULT_MAX_BYTES):
+        """
+
+        :param path: SQLite database file, created if missing.
+        :param version: Entries written under any other version are dropped.
+        :param max_bytes: Budget for the stored JSON; 0 disables the cache.
+        """
+        self.path = Path(path)
+        self.version = version
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        if self.enabled:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._execute(lambda db: db.execute('DELETE FROM figures WHERE version != ?', (version,)))
+
+    @classmethod
+    def from_environ(cls, default_path, version):
+        """
+        Configure the cache from FIGURE_CACHE_PATH and FIGURE_CACHE_MAX_BYTES.
+
+        :return: A FigureCache.
+        """
+        path = os.environ.get('FIGURE_CACHE_PATH', default_path)
+        max_bytes = int(os.environ.get('FIGURE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        return cls(path, version, max_bytes)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _connection(self):
+        # One connection per thread and process; a connection must not cross a fork.
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.executescript(SCHEMA)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _execute(self, operation):
+        try:
+            return operation(self._connection())
+        except sqlite3.Error:
+            logger.exception("figure cache at %s unavailable", self.path)
+            return None
+
+    @staticmethod
+    def key(name, args):
+        """
+
+        :return: Cache key of a call to the function called name with args.
+        """
+        payload = json.dumps([name, args], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        """
+
+        :return: The stored figure JSON, or None on a miss.
+        """
+        def read(db):
+            row = db.execute('SELECT value FROM figures WHERE key = ? AND version = ?',
+                             (key, self.version)).fetchone()
+            if row is not None:
+                db.execute('UPDATE figures SET last_used = ? WHERE key = ?', (time.time(), key))
+            return row
+
+        row = self._execute(read) if self.enabled else None
+        return None if row is None else row[0]
+
+    def put(self, key, value):
+        """
+        Store figure JSON and evict least-recently-used entries beyond the budget.
+        """
+        if not self.enabled:
+            return
+        value = value.encode() if isinstance(value, str) else value
+        if len(value) > self.max_bytes:
+            return
+
+        def write(db):
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.execute('INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?, ?)',
+                           (key, self.version, value, len(value), time.time()))
+                db.execute("""
+                    DELETE FROM figures WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY last_used DESC, key) AS running FROM figures
+                        ) WHERE running > ?
+                    )""", (self.max_bytes,))
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+        self._execute(write)
+
+    def clear(self):
+        self._execute(lambda db: db.execute('DELETE FROM figures'))
+
+    def memoize(self, func):
+        """
+        Cache the figure returned by func. Arguments must be JSON-serialisable and
+        already normalised; cache hits are returned as plain figure dicts. The key
+        of a call is available as wrapper.cache_key(*args).
+        """
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = self.key(func.__name__, args)
+            with stage('cache_lookup'):
+                cached = self.get(key)
+                if cached is not None:
+                    return json.loads(cached)
+            fig = func(*args)
+            if self.enabled:  # a disabled cache must not pay for the encoding
+                with stage('cache_store'):
+                    self.put(key, pio.to_json(fig, validate=False))
+            return fig
+
+        wrapper.cache_key = lambda *args: self.key(func.__name__, args)
+        return wrapper
@@ -0,0 +1,284 @@
+"""
+Figure building for the dashboard charts.
+
+Series labels are precomputed for every combination of the case cube's levels,
+and each figure is assembled in one go from the arrays of the selected series.
+Long trend series are downsampled with LTTB to about one point per pixel of the
+plot width, and large trend charts switch to WebGL traces.
+
+Figures are plain dicts rather than graph objects: plotly's per-property validation
+is skipped, and with dates pre-formatted and every array contiguous, the orjson
+engine of plotly.io (used by Dash when orjson is installed) encodes them in one
+pass without its slow object-cleaning fallback.
+
+Incremental changes, such as switching tabs or adding a morbidity, are sent to the
+browser as a Patch of the figure it shows instead of the whole figure.
+"""
+import itertools
+
+import numpy as np
+import plotly.colors
+import plotly.io as pio
+from dash import Patch, no_update
+
+from aggregates import SERIES_COLUMNS
+from metrics import stage
+
+try:
+    # plotly.io imports it on first use, where threads encoding their first figures at
+    # once (the warm-up, the chart pool) could see it half-initialised
+    import orjson  # noqa: F401
+except ImportError:  # plotly's slower json engine
+    orjson = None
+
+# Width of both charts in pixels
+PLOT_WIDTH = 1200
+
+# Trend charts with more points than this are drawn with WebGL (Scattergl)
+WEBGL_POINT_THRESHOLD = 20000
+
+# The default template, which go.Figure would attach to every figure
+TEMPLATE = pio.templates[pio.templates.default].to_plotly_json()
+
+
+def series_label(group, races, gender, morbid):
+    """
+
+    :return: The legend/axis label of one demographic and morbidity series.
+    """
+    morbid = morbid.title()
+    if (morbid == 'All Deaths') & (group == 'All') & (races == 'All') & (gender == 'All'):
+        return "Total Pop."
+    elif (morbid == 'All Deaths') & (group == 'All') & (gender == 'All'):
+        return f"{races} Pop."
+    elif (morbid == 'All Deaths') & (races == 'All') & (gender == 'All'):
+        return f"{group} Pop."
+    elif (group == 'All') & (races == 'All') & (gender == 'All'):
+        return f"Pop. with {morbid}"
+    elif (morbid == 'All Deaths') & (group == 'All') & (races == 'All'):
+        return f"{gender} Pop."
+    elif (morbid == 'All Deaths') & (group == 'All'):
+        return f"{gender}, {races} Pop."
+    elif morbid == 'All Deaths':
+        return f"Ages: {group} for {gender}, {races} Pop."
+    else:
+        return f"Ages: {group} for {gender}, {races} Pop. with {morbid}"
+
+
+class LabelTable:
+    """
+    Labels of every (age group, race, gender, morbidity) combination, laid out like
+    the case cube grid so a selection is looked up with the same indexing.
+    """
+
+    def __init__(self, levels):
+        """
+
+        :param levels: Dict of SERIES_COLUMNS to the sorted values of that dimension, e.g. CaseCube.levels.
+        """
+        self.levels = levels
+        values = [list(levels[column]) for column in SERIES_COLUMNS]
+        self.table = np.empty([len(v) for v in values], dtype=object)
+        for codes in itertools.product(*[range(len(v)) for v in values]):
+            self.table[codes] = series_label(*[v[c] for v, c in zip(values, codes)])
+
+    def lookup(self, age, race, sex, morbidity):
+        """
+
+        :return: Labels shaped (len(age), len(race), len(sex), len(morbidity)).
+        """
+        selection = (age, race, sex, morbidity)
+        codes = [self.levels[column].get_indexer(list(values)) for column, values in zip(SERIES_COLUMNS, selection)]
+        if all((c >= 0).all() for c in codes):
+            return self.table[np.ix_(*codes)]
+        # A value the data has never seen; label the selection directly.
+        labels = np.empty([len(v) for v in selection], dtype=object)
+        for index in itertools.product(*[range(len(v)) for v in selection]):
+            labels[index] = series_label(*[v[i] for v, i in zip(selection, index)])
+        return labels
+
+    def column_labels(self, keys):
+        """
+
+        :param keys: DataFrame of SERIES_COLUMNS values, e.g. CaseCube.keys.
+        :return: Object array with the label of each row of keys plus a trailing '' for the empty column.
+        """
+        codes = tuple(self.levels[column].get_indexer(keys[column]) for column in SERIES_COLUMNS)
+        return np.append(self.table[codes], '')
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling of many series sharing one x axis.
+
+    The first and last points are kept; every other bucket keeps the point forming
+    the largest triangle with the point kept before it and the next bucket's mean,
+    which preserves peaks and troughs far better than striding. Buckets are walked
+    once and all series are handled together in each step.
+
+    :param x: Ascending float array of shape (n,).
+    :param y: Array of shape (n, series).
+    :param n_out: Points to keep per series.
+    :return: int array of shape (min(n, n_out), series) with the kept row of each series.
+    """
+    n, k = y.shape
+    if n <= n_out or n_out < 3:
+        return np.repeat(np.arange(n)[:, None], k, axis=1)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    series = np.arange(k)
+    kept = np.empty((n_out, k), dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    for bucket in range(n_out - 2):
+        lo, hi = edges[bucket], edges[bucket + 1]
+        next_hi = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        x_next, y_next = x[hi:next_hi].mean(), y[hi:next_hi].mean(axis=0)
+        x_prev, y_prev = x[kept[bucket]], y[kept[bucket], series]
+        area = np.abs((x_prev - x_next) * (y[lo:hi] - y_prev) - (x_prev - x[lo:hi, None]) * (y_next - y_prev))
+        kept[bucket + 1] = lo + np.argmax(area, axis=0)
+    return kept
+
+
+def trend_figure(dates, values, labels, title, yaxis_title, max_points=PLOT_WIDTH,
+                 webgl_threshold=WEBGL_POINT_THRESHOLD, x_range=None):
+    """
+    Line chart with one trace per series column.
+
+    :param dates: Shared datetime64 x values of all series.
+    :param values: Array of shape (len(dates), len(labels)).
+    :param labels: Trace names, one per column of values.
+    :param max_points: Series longer than this are downsampled with LTTB.
+    :param webgl_threshold: Above this many points in total the traces use scattergl.
+    :param x_range: Optional [start, end] of a zoomed x axis to keep.
+    :return: A plotly figure dict.
+    """
+    days = np.datetime_as_string(dates, unit='D')
+    if len(dates) > max_points:
+        with stage('downsample'):
+            kept = lttb_indices(dates.astype('datetime64[D]').astype(np.float64), values, max_points)
+        xs = [days[kept[:, series]].tolist() for series in range(len(labels))]
+        ys = [values[kept[:, series], series] for series in range(len(labels))]
+    else:
+        xs = [days.tolist()] * len(labels)
+        ys = list(np.ascontiguousarray(np.transpose(values), dtype=np.float64))
+
+    trace_type = 'scattergl' if len(labels) * min(len(dates), max_points) > webgl_threshold else 'scatter'
+    layout = {
+        'title': {'text': title},
+        'xaxis': {'title': {'text': 'Date of Death'}},
+        'yaxis': {'title': {'text': yaxis_title}},
+        'showlegend': True,
+        'width': PLOT_WIDTH,
+        'height': 600,
+        'legend': {'x': 1, 'y': 1, 'xanchor': 'left', 'yanchor': 'top', 'traceorder': 'normal',
+                   'title': {'text': 'Demographic Group'}},
+        'template': TEMPLATE,
+    }
+    if x_range:
+        layout['xaxis']['range'] = list(x_range)
+    return {
+        'data': [{'type': trace_type, 'x': x, 'y': y, 'mode': 'lines', 'name': label}
+                 for x, y, label in zip(xs, ys, labels)],
+        'layout': layout,
+    }
+
+
+# Colours the old one-trace-per-bar chart got from the default template, kept per bar
+BAR_COLORS = np.array(plotly.colors.qualitative.Plotly, dtype=object)
+
+
+def bar_figure(labels, values, title, yaxis_title):
+    """
+    Bar chart of one value per series, drawn as a single array-backed trace.
+
+    :param labels: x-axis category of each bar.
+    :param values: Height of each bar.
+    :return: A plotly figure dict.
+    """
+    trace = {
+        'type': 'bar',
+        'x': list(labels),
+        'y': np.ascontiguousarray(values),
+        'marker': {'color': BAR_COLORS[np.arange(len(labels)) % len(BAR_COLORS)].tolist()},
+    }
+    layout = {
+        'title': {'text': title},
+        'xaxis': {'title': {'text': 'Demographic Group'}},
+        'yaxis': {'title': {'text': yaxis_title}},
+        'barmode': 'group',
+        'showlegend': False,
+        'width': PLOT_WIDTH,
+        'height': 600,
+        'template': TEMPLATE,
+    }
+    return {'data': [trace], 'layout': layout}
+
+
+def _same(old, new):
+    # old is decoded JSON, new may still hold numpy arrays
+    if isinstance(new, np.ndarray):
+        try:
+            return len(old) == len(new) and np.array_equal(np.asarray(old, dtype=np.float64),
+                                                           new.astype(np.float64), equal_nan=True)
+        except (TypeError, ValueError):
+            return False
+    if isinstance(new, dict):
+        return isinstance(old, dict) and old.keys() == new.keys() and all(_same(old[k], new[k]) for k in new)
+    if isinstance(new, (list, tuple)):
+        return isinstance(old, list) and len(old) == len(new) and all(_same(o, n) for o, n in zip(old, new))
+    return old == new
+
+
+def _patch_dict(patch, old, new):
+    """
+    Assign the values of new that differ from old, key by key down nested dicts.
+
+    :return: Whether anything was assigned or deleted.
+    """
+    changed = False
+    for key in old.keys() - new.keys():
+        del patch[key]
+        changed = True
+    for key, value in new.items():
+        if key in old and isinstance(value, dict) and isinstance(old[key], dict):
+            changed |= _patch_dict(patch[key], old[key], value)
+        elif key not in old or not _same(old[key], value):
+            patch[key] = value
+            changed = True
+    return changed
+
+
+def figure_patch(old, new):
+    """
+    The changes turning one figure into another, as a Dash partial property update:
+    traces are matched by name, traces no longer shown are deleted, new ones are
+    inserted where they belong, and of the others only the properties that changed
+    (e.g. the y values on another tab) are sent, as are the changed layout values.
+
+    :param old: Figure the browser shows, as decoded JSON.
+    :param new: Figure to show.
+    :return: A Patch, no_update if nothing changed, or None if the traces were
+        reordered and the whole figure has to be sent.
+    """
+    old_names = [trace.get('name', position) for position, trace in enumerate(old['data'])]
+    new_names = [trace.get('name', position) for position, trace in enumerate(new['data'])]
+    old_traces, new_traces = dict(zip(old_names, old['data'])), dict(zip(new_names, new['data']))
+    if len(old_traces) != len(old_names) or len(new_traces) != len(new_names):
+        return None
+    if [name for name in old_names if name in new_traces] != [name for name in new_names if name in old_traces]:
+        return None
+
+    patch = Patch()
+    changed = False
+    for position in reversed(range(len(old_names))):
+        if old_names[position] not in new_traces:
+            del patch['data'][position]
+            changed = True
+    for position, name in enumerate(new_names):
+        if name in old_traces:
+            changed |= _patch_dict(patch['data'][position], old_traces[name], new_traces[name])
+        else:
+            patch['data'].insert(position, new_traces[name])
+            changed = True
+    changed |= _patch_dict(patch['layout'], old['layout'], new['layout'])
+    return patch if changed else no_update
@@ -0,0 +1,164 @@
+"""
+Abandoning chart computations that a newer request from the same tab has superseded.
+
+Clicking through several checkboxes sends one chart request per click, and the
+browser only shows the answer to the last. Every page load gets a random session
+id; each request registers as the next generation of its session, and the chart
+stages call ``checkpoint()`` between steps, which raises Superseded once a newer
+generation of the same session has arrived. The request then ends with no update,
+freeing the worker, and nothing half-computed is cached.
+
+The generations live in a small memory-mapped file, so a request on one gunicorn
+worker can see that the next one reached another; registering takes an exclusive
+lock on the file, so two workers never hand out the same generation. Sessions
+hash to a fixed number of slots; a session whose slot was taken over by another
+is simply never cancelled, so collisions cost wasted work but never a lost update.
+"""
+import contextvars
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from dash.exceptions import PreventUpdate
+
+from dataset import default_cache_dir
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - without it concurrent workers may race
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SLOTS = 4096
+
+
+class Superseded(PreventUpdate):
+    """
+    A newer request of the same session arrived; the browser would discard this answer.
+    """
+
+
+class RequestGenerations:
+    """
+    Latest request generation per session, shared by the processes using the same file.
+    """
+
+    def __init__(self, path, slots=DEFAULT_SLOTS):
+        """
+
+        :param path: .npy file of (session key, generation) rows, created if missing.
+        :param slots: Rows of a newly created file.
+        """
+        self.path = Path(path)
+        self.slots = slots
+        self._table = None
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._current = contextvars.ContextVar('request_generation', default=None)
+
+    @classmethod
+    def from_environ(cls):
+        """
+
+        :return: RequestGenerations in REQUEST_GENERATIONS_PATH, or generations.npy in the cache dir.
+        """
+        return cls(os.environ.get('REQUEST_GENERATIONS_PATH', default_cache_dir() / 'generations.npy'))
+
+    def _generations(self):
+        # Mapped on first use in each process, like the metrics histograms
+        if self._pid != os.getpid():
+            try:
+                if not self.path.exists():
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    fd, temporary = tempfile.mkstemp(dir=self.path.parent, suffix='.npy')
+                    os.close(fd)
+                    np.save(temporary, np.zeros((self.slots, 2), dtype=np.int64))
+                    try:
+                        os.link(temporary, self.path)  # never replaces a file another process mapped
+                    except FileExistsError:
+                        pass
+                    finally:
+                        os.unlink(temporary)
+                self._table = np.load(self.path, mmap_mode='r+')
+                self._file = open(self.path, 'rb')  # locked while registering, see begin
+            except (OSError, ValueError):
+                logger.exception("request generations at %s unavailable, tracking this process only", self.path)
+                self._table, self._file = np.zeros((self.slots, 2), dtype=np.int64), None
+            self._pid = os.getpid()
+        return self._table
+
+    @contextmanager
+    def _locked(self):
+        # The thread lock orders this process's threads, the file lock the processes
+        with self._lock:
+            table = self._generations()
+            if self._file is None or fcntl is None:
+                yield table
+                return
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield table
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _key(session):
+        return int.from_bytes(hashlib.blake2b(str(session).encode(), digest_size=8).digest(), 'little') >> 1
+
+    def begin(self, session):
+        """
+        Register a new request of session as its latest.
+
+        :return: (slot, key, generation) token of the request.
+        """
+        key = self._key(session)
+        with self._locked() as table:
+            slot = key % len(table)
+            generation = int(table[slot, 1]) + 1 if table[slot, 0] == key else 1
+            table[slot] = (key, generation)
+        return slot, key, generation
+
+    def superseded(self, token):
+        """
+
+        :return: Whether a newer request of the token's session has begun.
+        """
+        slot, key, generation = token
+        table = self._generations()
+        return table[slot, 0] == key and table[slot, 1] != generation
+
+    @contextmanager
+    def request(self, session):
+        """
+        Make the block the latest request of session, for the checkpoints inside it
+        and in any work started from it with contextvars.copy_context. No session
+        (e.g. the cache warm-up) is never cancelled.
+        """
+        if session is None:
+            yield
+            return
+        token = self._current.set(self.begin(session))
+        try:
+            yield
+        finally:
+            self._current.reset(token)
+
+    def checkpoint(self):
+        """
+        Raise Superseded if the current request has been superseded.
+        """
+        token = self._current.get()
+        if token is not None and self.superseded(token):
+            raise Superseded
+
+
+# Generations of this box, shared by the chart callbacks of all workers
+registry = RequestGenerations.from_environ()
+checkpoint = registry.checkpoint
@@ -0,0 +1,52 @@
+"""
+Gunicorn settings for the dashboard, used by the Procfile.
+
+With SHARED_DATA=1 (the default) the master imports app.py once before forking, so
+the memory-mapped dataset, the case cube and the label tables are built a single
+time and every worker attaches to the same read-only pages. SHARED_DATA=0 loads
+everything separately in each worker, as before.
+"""
+import gc
+import logging
+import os
+
+shared_data = os.environ.get('SHARED_DATA', '1') == '1'
+
+preload_app = shared_data
+
+# The app logs warm-up progress, merged records and slow calls at INFO (LOG_LEVEL);
+# without a root handler gunicorn, which only configures its own loggers, would
+# drop them. Set here because the master imports the app before any server hook runs
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'),
+                    format='[%(asctime)s] [%(process)d] [%(levelname)s] %(name)s: %(message)s',
+                    datefmt='%Y-%m-%d %H:%M:%S %z')
+
+
+def process_memory():
+    """
+
+    :return: Resident, proportional and private memory of this process in MB.
+    """
+    memory = {}
+    with open('/proc/self/smaps_rollup') as handle:
+        for line in handle:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                memory[parts[0][:-1]] = int(parts[1]) / 1024
+    return (f"rss={memory['Rss']:.1f}MB pss={memory['Pss']:.1f}MB "
+            f"private={memory['Private_Clean'] + memory['Private_Dirty']:.1f}MB")
+
+
+def when_ready(server):
+    if shared_data:
+        # Keep the collector from touching, and so un-sharing, objects built before the fork.
+        gc.freeze()
+        server.log.info("dataset preloaded in master: %s", process_memory())
+
+
+def post_worker_init(worker):
+    worker.log.info("worker %s ready (shared_data=%s): %s", worker.pid, shared_data, process_memory())
+    # Threads do not survive the fork, so the figure cache is warmed from a worker (see warmup.py)
+    cache_warmer = getattr(worker.wsgi, 'extensions', {}).get('cache_warmer')
+    if cache_warmer is not None:
+        cache_warmer.start()
@@ -0,0 +1,316 @@
+"""
+Live dashboard data and incremental ingestion of new medical examiner records.
+
+DashboardData bundles everything the callbacks derive from the records: the case
+cube, the series labels and the morbidity ordering. It is never modified; LiveData
+holds the current one and swaps in a successor with a single assignment, so a
+request that reads ``current`` once works on one consistent version while new
+records are merged.
+
+An Ingestor polls for rows appended to the source CSV after the part held in the
+snapshot, and for new CSV files in a drop directory. Only those rows are merged:
+the cases they mention are looked up among the records already loaded, so the
+distinct-case counts stay exact even when a case is split across batches.
+Whatever arrived before start-up is merged once by the process that loads the
+data (the gunicorn master with preload_app), so the workers inherit it with the
+shared cube. After the fork every worker polls on its own, since gunicorn
+workers do not share Python objects: a worker's first merge replaces the shared,
+read-only cube with a private one of the same size (logged once), while the
+records themselves stay shared. Restarting gunicorn folds everything merged so
+far back into one shared cube; INGEST_POLL_SECONDS=0 keeps the cube shared by
+not merging after start-up at all.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from aggregates import SERIES_COLUMNS, CaseCube, count_distinct
+from dataset import CASE_COLUMN, CASE_ID_COLUMN, DATE_COLUMN, case_ids, complete_bytes, read_rows
+from figures import LabelTable
+from population import POPULATION_COLUMN, PopulationTable
+
+logger = logging.getLogger(__name__)
+
+COVID_MORBIDITY = 'COVID-19'
+
+
+def morbidity_case_counts(df):
+    """
+    The morbidity list is ordered by how many distinct cases list each morbidity,
+    leaving out the COVID-19 rows themselves.
+
+    :return: Series of distinct cases per GENERAL_MORBIDITY.
+    """
+    rows = (df['GENERAL_MORBIDITY'] != COVID_MORBIDITY).to_numpy()
+    codes, morbidities = pd.factorize(df['GENERAL_MORBIDITY'][rows])
+    known = codes >= 0
+    groups, counts = count_distinct(codes[known], case_ids(df)[rows][known])
+    return pd.Series(counts, index=pd.Index(np.asarray(morbidities)[groups], dtype=object)).sort_index()
+
+
+def first_death_date(df):
+    """
+
+    :return: Earliest non-COVID-19 DATE_OF_DEATH in df, or NaT.
+    """
+    dates = df[DATE_COLUMN].to_numpy()[(df['GENERAL_MORBIDITY'] != COVID_MORBIDITY).to_numpy()]
+    return pd.Timestamp(dates.min()) if len(dates) else pd.NaT
+
+
+class DashboardData:
+    """
+    One consistent version of the records and everything derived from them.
+
+    Passed to the memoised chart builders as an argument; its str() identifies the
+    records and the population table, so cached figures of an older version are
+    never served for a newer one.
+    """
+
+    def __init__(self, frames, case_numbers, cube, population, labels, morbidity_cases, first_death_date, version):
+        """
+
+        :param frames: Tuple of record DataFrames: the snapshot, then each ingested batch.
+        :param case_numbers: Index of the CASE_NUMBER of every CASE_ID, in ID order.
+        :param cube: CaseCube of all the records.
+        :param population: PopulationTable the cube's per-capita values are based on.
+        :param labels: LabelTable of the cube's levels.
+        :param morbidity_cases: Distinct non-COVID-19 cases per morbidity, see morbidity_case_counts.
+        :param first_death_date: Earliest non-COVID-19 date of death.
+        :param version: Identifies the records; changes with every ingested batch.
+        """
+        self.frames = frames
+        self.case_numbers = case_numbers
+        self.cube = cube
+        self.population = population
+        self.labels = labels
+        self.column_labels = labels.column_labels(cube.keys)
+        self.morbidity_cases = morbidity_cases
+        self.first_death_date = first_death_date
+        self.version = version
+        # Most distinct cases first, as listed in the morbidity dropdown
+        self.morbidity_order = sorted(morbidity_cases.keys(), key=lambda x: morbidity_cases[x], reverse=True)
+
+    def __str__(self):
+        return f"{self.version}-{self.population.version}"
+
+    @classmethod
+    def from_frame(cls, df, version, population=None):
+        """
+
+        :param df: All records, e.g. from dataset.load_dataset.
+        :param population: PopulationTable of df's demographics; by default taken from
+            its TOTAL_POP column.
+        :return: A DashboardData.
+        """
+        if population is None:
+            population = PopulationTable.from_frame(df)
+        if CASE_ID_COLUMN not in df:
+            df = df.assign(**{CASE_ID_COLUMN: case_ids(df)})
+        ids = df[CASE_ID_COLUMN].to_numpy()
+        numbers = df[CASE_COLUMN].to_numpy()
+        case_numbers = np.empty(int(ids.max()) + 1 if len(ids) else 0, dtype=numbers.dtype)
+        case_numbers[ids] = numbers
+        cube = CaseCube.from_frame(df, population)
+        return cls((df,), pd.Index(case_numbers), cube, population, LabelTable(cube.levels),
+                   morbidity_case_counts(df), first_death_date(df), version)
+
+    def with_population(self, population):
+        """
+        Swap in other population denominators, e.g. a census vintage; the records and
+        their counts are shared.
+
+        :param population: PopulationTable.
+        :return: A new DashboardData.
+        """
+        return type(self)(self.frames, self.case_numbers, self.cube.with_population(population), population,
+                          self.labels, self.morbidity_cases, self.first_death_date, self.version)
+
+    def extend(self, delta, source):
+        """
+        Merge a batch of new records.
+
+        The records already loaded for the batch's cases are counted with and without
+        the batch; only the difference is added, so a case is never counted twice.
+
+        :param delta: New records with the columns of the source CSV.
+        :param source: Identifies the batch; folded into the new version.
+        :return: A new DashboardData; this one is unchanged.
+        """
+        # Demographics new to the table take their population from the batch
+        population = self.population
+        if POPULATION_COLUMN in delta:
+            population = PopulationTable.from_frame(delta).overlay(population)
+            delta = delta.drop(columns=POPULATION_COLUMN)
+        delta, case_numbers = self._conform(delta)
+        batch_cases = np.unique(delta[CASE_ID_COLUMN].to_numpy())
+        earlier = pd.concat([frame[np.isin(frame[CASE_ID_COLUMN].to_numpy(), batch_cases)] for frame in self.frames])
+        earlier = earlier.astype({column: object for column in SERIES_COLUMNS})
+        combined = pd.concat([earlier, delta], ignore_index=True)
+
+        daily = CaseCube.daily_counts(combined).sub(CaseCube.daily_counts(earlier), fill_value=0)
+        daily = daily[daily != 0].astype(np.int64)
+        cube = self.cube.add(daily, population)
+
+        case_counts = morbidity_case_counts(combined).sub(morbidity_case_counts(earlier), fill_value=0)
+        morbidity_cases = self.morbidity_cases.add(case_counts, fill_value=0).astype(np.int64)
+
+        same_levels = all(cube.levels[column].equals(self.cube.levels[column]) for column in SERIES_COLUMNS)
+        labels = self.labels if same_levels else LabelTable(cube.levels)
+        first_date = min([date for date in (self.first_death_date, first_death_date(delta)) if not pd.isna(date)],
+                         default=pd.NaT)
+        base, _, chain = self.version.partition('+')
+        version = f"{base}+{hashlib.sha256(f'{chain}|{source}'.encode()).hexdigest()[:12]}"
+        return type(self)(self.frames + (delta,), case_numbers, cube, population, labels, morbidity_cases,
+                          first_date, version)
+
+    def _conform(self, delta):
+        """
+
+        :return: (delta sorted by date, with column types comparable to the loaded records
+            and CASE_IDs continuing this version's numbering; the extended case_numbers).
+        """
+        delta = delta.copy()
+        delta[DATE_COLUMN] = pd.to_datetime(delta[DATE_COLUMN])
+        if pd.api.types.is_numeric_dtype(self.frames[0][CASE_COLUMN]):
+            delta[CASE_COLUMN] = pd.to_numeric(delta[CASE_COLUMN]).astype(self.frames[0][CASE_COLUMN].dtype)
+        else:
+            delta[CASE_COLUMN] = delta[CASE_COLUMN].astype(str)
+        delta = delta.astype({column: object for column in SERIES_COLUMNS})
+
+        # Cases seen before keep their ID, new ones are numbered after the last
+        ids = self.case_numbers.get_indexer(delta[CASE_COLUMN])
+        new = ids < 0
+        codes, new_numbers = pd.factorize(delta[CASE_COLUMN][new])
+        ids[new] = len(self.case_numbers) + codes
+        delta[CASE_ID_COLUMN] = ids.astype(np.int32)
+        case_numbers = self.case_numbers.append(pd.Index(new_numbers))
+        return delta.sort_values(DATE_COLUMN, kind='stable', ignore_index=True), case_numbers
+
+
+class LiveData:
+    """
+    The current DashboardData of this process. Readers take ``current`` once per
+    request; writers replace it under ``lock``.
+    """
+
+    def __init__(self, data):
+        self.current = data
+        self.lock = threading.Lock()
+
+    def extend(self, delta, source):
+        """
+        Merge a batch and publish the result.
+
+        :return: The new DashboardData.
+        """
+        with self.lock:
+            self.current = self.current.extend(delta, source)
+            return self.current
+
+
+class Ingestor:
+    """
+    Polls the source CSV and a drop directory for new records and merges them into a LiveData.
+    """
+
+    def __init__(self, live, csv_path, source_bytes, drop_dir=None, poll_seconds=30):
+        """
+
+        :param live: LiveData to merge into.
+        :param csv_path: Source CSV; lines past source_bytes are new.
+        :param source_bytes: Length of the CSV prefix already loaded.
+        :param drop_dir: Directory where complete CSV files of new records are moved in; optional.
+        :param poll_seconds: Interval between polls; 0 disables the background thread.
+        """
+        self.live = live
+        self.csv_path = Path(csv_path)
+        self.offset = source_bytes
+        self.drop_dir = Path(drop_dir) if drop_dir else None
+        self.poll_seconds = poll_seconds
+        self.ingested_files = set()
+        self._columns = None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, live, csv_path, source_bytes):
+        """
+        Configure from INGEST_POLL_SECONDS (default 30, 0 disables) and INGEST_DROP_DIR.
+
+        :return: An Ingestor.
+        """
+        return cls(live, csv_path, source_bytes, drop_dir=os.environ.get('INGEST_DROP_DIR'),
+                   poll_seconds=float(os.environ.get('INGEST_POLL_SECONDS', 30)))
+
+    def poll(self):
+        """
+        Merge whatever arrived since the last poll.
+
+        :return: Number of rows merged.
+        """
+        merged = self._poll_csv()
+        if self.drop_dir is not None and self.drop_dir.is_dir():
+            for path in sorted(self.drop_dir.glob('*.csv')):
+                if path.name in self.ingested_files:
+                    continue
+                try:
+                    size = path.stat().st_size
+                    merged += self._merge(read_rows(path, 0, size), f"file:{path.name}:{size}")
+                except Exception:
+                    logger.exception("ingesting %s failed; it is retried on the next poll", path)
+                    continue
+                self.ingested_files.add(path.name)
+        return merged
+
+    def _poll_csv(self):
+        size = self.csv_path.stat().st_size
+        if size < self.offset:
+            logger.warning("%s is shorter than the %d bytes already loaded; restart to reload it",
+                           self.csv_path, self.offset)
+            return 0
+        end = complete_bytes(self.csv_path, size)
+        if end <= self.offset:
+            return 0
+        if self._columns is None:
+            self._columns = pd.read_csv(self.csv_path, nrows=0).columns.tolist()
+        merged = self._merge(read_rows(self.csv_path, self.offset, end, names=self._columns),
+                             f"csv:{self.offset}-{end}")
+        self.offset = end
+        return merged
+
+    def _merge(self, delta, source):
+        if not len(delta):
+            return 0
+        was_shared = not self.live.current.cube.counts.flags.writeable  # see CaseCube.share
+        data = self.live.extend(delta, source)
+        logger.info("merged %d new rows from %s; data version %s", len(delta), source, data.version)
+        if was_shared:
+            logger.info("process %d now holds a private %.1f MB case cube instead of the shared one; "
+                        "restart to share it again", os.getpid(), data.cube.counts.nbytes / 2 ** 20)
+        return len(delta)
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("ingesting new records failed")
+            time.sleep(self.poll_seconds)
+
+    def ensure_started(self):
+        """
+        Start the polling thread of this process if it is not running yet. Threads do
+        not survive a fork, so this is called from each worker, not at import time.
+        """
+        if self.poll_seconds <= 0 or self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread_pid != os.getpid():
+                threading.Thread(target=self._run, name='ingestor', daemon=True).start()
+                self._thread_pid = os.getpid()
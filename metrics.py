@@ -0,0 +1,333 @@
+"""
+Per-stage latency histograms of the chart callbacks, served in the Prometheus text format.
+
+Each stage of a chart update is timed under labels for the size of the selection:
+the number of series and the number of days in the date range, both bucketed.
+Stages nest (``callback`` contains ``filter``, ``rolling``, ``build`` and so on),
+so each histogram stands on its own rather than summing to the total.
+
+Every process keeps its histograms in a small memory-mapped file of its own under
+METRICS_DIR, written by that process only, so /metrics on any gunicorn worker
+reports the sum over all workers. A few counters, such as the progress of the
+cache warm-up, are kept the same way. Slow calls can also be profiled with
+cProfile, see SlowCallProfiler.
+"""
+import cProfile
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from dataset import default_cache_dir
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('request', 'callback', 'cache_lookup', 'filter', 'rolling', 'aggregate',
+          'downsample', 'build', 'cache_store', 'patch', 'warmup')
+
+# Upper bounds in seconds of the histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the selection shape buckets
+SERIES_BUCKETS = (1, 4, 16, 64, 256)
+DAY_BUCKETS = (31, 92, 366, 1096)
+
+
+def _range_labels(bounds):
+    """
+
+    :return: Labels of none, the ranges up to each bound, one more for above the last, and 'unknown'.
+    """
+    labels, low = ['0'], 1
+    for bound in bounds:
+        labels.append(str(bound) if bound == low else f"{low}-{bound}")
+        low = bound + 1
+    return labels + [f"{low}+", 'unknown']
+
+
+SERIES_LABELS = _range_labels(SERIES_BUCKETS)
+DAY_LABELS = _range_labels(DAY_BUCKETS)
+
+
+def _range_index(bounds, value):
+    """
+
+    :return: Position of value's label in _range_labels(bounds); an empty selection has its own.
+    """
+    return 0 if value <= 0 else 1 + min(bisect_left(bounds, value), len(bounds))
+
+# Per stage and shape: a count per latency bucket, one above the last bucket, the sum and the count
+HISTOGRAM_SHAPE = (len(STAGES), len(SERIES_LABELS), len(DAY_LABELS), len(LATENCY_BUCKETS) + 3)
+
+# Counter name to its help text
+COUNTERS = {
+    'warmup_states': 'Dashboard states queued for the figure cache warm-up.',
+    'warmup_states_warmed': 'Dashboard states the warm-up has cached.',
+    'warmup_states_failed': 'Dashboard states the warm-up failed to cache.',
+}
+
+
+class StageMetrics:
+    """
+    Latency histograms of this process, kept in DIRECTORY/<pid>.npy, and its
+    counters, kept in DIRECTORY/<pid>.counters.npy.
+    """
+
+    def __init__(self, directory):
+        """
+
+        :param directory: Directory shared by all processes reporting together.
+        """
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # A context variable rather than thread-local, so work handed to a thread pool
+        # with contextvars.copy_context keeps the labels of its selection
+        self._shape = contextvars.ContextVar('selection_shape', default=None)
+        self._arrays = {}
+        self._pid = None
+
+    @classmethod
+    def from_environ(cls):
+        """
+
+        :return: A StageMetrics in METRICS_DIR, or the metrics directory of the cache dir.
+        """
+        return cls(os.environ.get('METRICS_DIR', default_cache_dir() / 'metrics'))
+
+    def _histograms(self):
+        return self._array('', HISTOGRAM_SHAPE)
+
+    def _counters(self):
+        return self._array('.counters', (len(COUNTERS),))
+
+    def _array(self, suffix, shape):
+        # Created on first use in each process, so a forked worker never writes the master's files
+        if self._pid != os.getpid():
+            self._arrays, self._pid = {}, os.getpid()
+        if suffix not in self._arrays:
+            path = self.directory / f"{os.getpid()}{suffix}.npy"
+            temporary = self.directory / f"{os.getpid()}{suffix}.tmp.npy"
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                np.save(temporary, np.zeros(shape))
+                os.replace(temporary, path)
+                self._arrays[suffix] = np.load(path, mmap_mode='r+')
+            except OSError:
+                logger.exception("metrics directory %s unavailable, keeping this process's metrics in memory",
+                                 self.directory)
+                self._arrays[suffix] = np.zeros(shape)
+        return self._arrays[suffix]
+
+    @contextmanager
+    def selection(self, series, days):
+        """
+        Label the stages timed inside the block with the shape of the selection.
+
+        :param series: Number of selected series.
+        :param days: Number of days in the date range.
+        """
+        shape = (_range_index(SERIES_BUCKETS, series), _range_index(DAY_BUCKETS, days))
+        token = self._shape.set(shape)
+        self._local.last_shape = shape
+        try:
+            yield
+        finally:
+            self._shape.reset(token)
+
+    def last_selection(self):
+        """
+
+        :return: Shape indices of the last selection labelled in this thread, if any.
+        """
+        return getattr(self._local, 'last_shape', None)
+
+    def reset_last_selection(self):
+        self._local.last_shape = None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the block as one observation of the stage called name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds, shape=None):
+        """
+        Record one duration of a stage.
+
+        :param shape: Shape indices, by default those of the enclosing selection.
+        """
+        series, days = shape or self._shape.get() or (len(SERIES_LABELS) - 1, len(DAY_LABELS) - 1)
+        bucket = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms()[STAGES.index(name), series, days]
+            histogram[bucket] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def count(self, name, increment=1):
+        """
+        Add to one of the COUNTERS.
+        """
+        with self._lock:
+            self._counters()[list(COUNTERS).index(name)] += increment
+
+    def collect(self, suffix='', shape=HISTOGRAM_SHAPE):
+        """
+
+        :return: Histograms (or with suffix='.counters', counters) summed over every
+            process that wrote to the directory.
+        """
+        total = np.zeros(shape)
+        for path in self.directory.glob(f'*{suffix}.npy'):
+            if not path.name[:-len(f'{suffix}.npy')].isdigit():
+                continue  # another kind of file, or one being written
+            try:
+                values = np.load(path)
+            except (OSError, ValueError):
+                continue  # being replaced by a restarting worker
+            if values.shape == shape:
+                total += values
+        return total
+
+    def remove_stale(self):
+        """
+        Delete the files of processes that no longer exist; their counts are dropped,
+        which Prometheus treats as a counter reset.
+        """
+        for path in self.directory.glob('*.npy'):
+            pid = path.name.split('.')[0]
+            if not pid.isdigit():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                path.unlink(missing_ok=True)
+            except PermissionError:
+                pass
+
+    def render(self):
+        """
+
+        :return: All histograms in the Prometheus text exposition format.
+        """
+        values = self.collect()
+        lines = ['# HELP dashboard_stage_seconds Time spent in each stage of a chart update.',
+                 '# TYPE dashboard_stage_seconds histogram']
+        for stage_index, series, days in np.ndindex(*HISTOGRAM_SHAPE[:3]):
+            histogram = values[stage_index, series, days]
+            if not histogram[-1]:
+                continue
+            labels = f'stage="{STAGES[stage_index]}",series="{SERIES_LABELS[series]}",days="{DAY_LABELS[days]}"'
+            cumulative = np.cumsum(histogram[:len(LATENCY_BUCKETS) + 1])
+            for bound, count in zip(LATENCY_BUCKETS, cumulative):
+                lines.append(f'dashboard_stage_seconds_bucket{{{labels},le="{bound}"}} {count:.0f}')
+            lines.append(f'dashboard_stage_seconds_bucket{{{labels},le="+Inf"}} {cumulative[-1]:.0f}')
+            lines.append(f'dashboard_stage_seconds_sum{{{labels}}} {float(histogram[-2])!r}')
+            lines.append(f'dashboard_stage_seconds_count{{{labels}}} {histogram[-1]:.0f}')
+        for (name, help_text), value in zip(COUNTERS.items(), self.collect('.counters', (len(COUNTERS),))):
+            lines += [f'# HELP dashboard_{name}_total {help_text}', f'# TYPE dashboard_{name}_total counter',
+                      f'dashboard_{name}_total {value:.0f}']
+        return '\n'.join(lines) + '\n'
+
+
+class SlowCallProfiler:
+    """
+    Runs calls under cProfile and keeps the stats of those slower than a threshold.
+    """
+
+    def __init__(self, threshold, directory):
+        """
+
+        :param threshold: Seconds; None disables profiling.
+        :param directory: Where the .prof files of slow calls are written.
+        """
+        self.threshold = threshold
+        self.directory = Path(directory)
+
+    @classmethod
+    def from_environ(cls):
+        """
+        Configure from PROFILE_SLOW_SECONDS (unset disables) and PROFILE_DIR.
+
+        :return: A SlowCallProfiler.
+        """
+        threshold = os.environ.get('PROFILE_SLOW_SECONDS')
+        directory = os.environ.get('PROFILE_DIR', default_cache_dir() / 'profiles')
+        return cls(float(threshold) if threshold else None, directory)
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Profile the block; if it took longer than the threshold, write the stats to
+        DIRECTORY/<name>-<time>-<ms>ms-<pid>.prof for ``python -m pstats`` or snakeviz.
+        """
+        if self.threshold is None:
+            yield
+            return
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is already active in this thread
+            profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+            if profiler is not None and elapsed > self.threshold:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                path = self.directory / (f"{name}-{datetime.now():%Y%m%dT%H%M%S%f}-"
+                                         f"{elapsed * 1000:.0f}ms-{os.getpid()}.prof")
+                profiler.dump_stats(path)
+                logger.warning("%s took %.0f ms, profile written to %s", name, elapsed * 1000, path)
+
+
+# Histograms of this process, shared by the modules that time their stages
+registry = StageMetrics.from_environ()
+selection = registry.selection
+stage = registry.stage
+count = registry.count
+
+
+def register_metrics(server, timed_path='/_dash-update-component'):
+    """
+    Serve the histograms at /metrics on a Flask server and time every request to
+    timed_path as the 'request' stage, labelled with the selection of its callback.
+    """
+    from flask import Response, request
+
+    registry.remove_stale()
+
+    @server.before_request
+    def start_timer():
+        if request.path == timed_path:
+            registry.reset_last_selection()
+            request.environ['metrics.start'] = time.perf_counter()
+
+    @server.after_request
+    def stop_timer(response):
+        start = request.environ.get('metrics.start')
+        if start is not None:
+            registry.observe('request', time.perf_counter() - start, registry.last_selection())
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    return server
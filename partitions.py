@@ -0,0 +1,214 @@
+"""
+Optional partitioned backend for records of several counties and years.
+
+The records are stored as one snapshot (see dataset.py) per county and year, in
+ROOT/<county>/<year>/. Every partition is memory-mapped and summarised on its own:
+its daily distinct-case counts, populations and morbidity counts. dask runs the
+partitions in parallel, so at most one partition per dask worker is being read at
+any time and the full history never has to fit in memory.
+
+A case belongs to one county and dies in one year, so the summaries of different
+partitions add up exactly. A request combines the summaries of the selected
+counties' partitions whose year overlaps its date range into a DashboardData; the
+row data is not read again. Add a county's records with:
+
+    python partitions.py "Cook County" assets/final_covid_2.csv --root data/partitions
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from aggregates import SERIES_COLUMNS, CaseCube
+from dataset import DATE_COLUMN, load_snapshot, read_rows, write_snapshot
+from figures import LabelTable
+from ingest import DashboardData, first_death_date, morbidity_case_counts
+from population import PopulationTable
+
+try:
+    import dask
+except ImportError:  # summarised one partition after another instead
+    dask = None
+
+logger = logging.getLogger(__name__)
+
+# Rows of a county's extract read at a time by add_county
+CHUNK_ROWS = 200000
+
+
+class PartitionSummary:
+    """
+    Everything the dashboard needs from one partition, small enough to keep for all of them.
+    """
+
+    def __init__(self, daily, population, morbidity_cases, first_death_date):
+        """
+
+        :param daily: Distinct cases per day and series, see CaseCube.daily_counts.
+        :param population: PopulationTable of the partition's county.
+        :param morbidity_cases: Distinct non-COVID-19 cases per morbidity, see ingest.morbidity_case_counts.
+        :param first_death_date: Earliest non-COVID-19 date of death, or NaT.
+        """
+        self.daily = daily
+        self.population = population
+        self.morbidity_cases = morbidity_cases
+        self.first_death_date = first_death_date
+
+    @classmethod
+    def from_snapshot(cls, path):
+        """
+
+        :param path: Snapshot directory of one partition.
+        :return: A PartitionSummary.
+        """
+        df = load_snapshot(path)
+        daily = CaseCube.daily_counts(df)
+        # Plain levels, so the summaries of partitions with different categories concatenate
+        daily.index = daily.index.set_levels([level.astype(object) for level in daily.index.levels[1:]],
+                                             level=SERIES_COLUMNS)
+        return cls(daily, PopulationTable.from_csv(path / 'population.csv'), morbidity_case_counts(df),
+                   first_death_date(df))
+
+
+class PartitionedDataset:
+    """
+    The partitions under a root directory and their summaries.
+    """
+
+    def __init__(self, root, scheduler='threads'):
+        """
+
+        :param root: Directory of <county>/<year>/ snapshots, see add_county.
+        :param scheduler: dask scheduler the partitions are summarised with.
+        """
+        self.root = Path(root)
+        self.partitions = sorted((path.parent.name, int(path.name), path) for path in self.root.glob('*/*')
+                                 if path.name.isdigit() and (path / 'manifest.json').is_file())
+        if not self.partitions:
+            raise ValueError(f"{self.root} has no <county>/<year> partitions")
+        self.counties = sorted({county for county, year, path in self.partitions})
+
+        paths = [path for county, year, path in self.partitions]
+        if dask is not None:
+            tasks = [dask.delayed(PartitionSummary.from_snapshot)(path) for path in paths]
+            self.summaries = list(dask.compute(*tasks, scheduler=scheduler))
+        else:
+            self.summaries = [PartitionSummary.from_snapshot(path) for path in paths]
+        # Rebuilding a partition changes its manifest, and with it the version of every combination
+        stamps = '|'.join(f"{path}:{os.stat(path / 'manifest.json').st_mtime_ns}" for path in paths)
+        self.version = 'partitions-' + hashlib.sha256(stamps.encode()).hexdigest()[:16]
+        logger.info("summarised %d partitions of %d counties", len(paths), len(self.counties))
+
+    @classmethod
+    def from_environ(cls):
+        """
+        Configure from PARTITIONED_DATA_DIR and DASK_SCHEDULER (default threads).
+
+        :return: A PartitionedDataset, or None when PARTITIONED_DATA_DIR is not set.
+        """
+        root = os.environ.get('PARTITIONED_DATA_DIR')
+        if not root:
+            return None
+        return cls(root, scheduler=os.environ.get('DASK_SCHEDULER', 'threads'))
+
+    def select(self, counties=None, start_date=None, end_date=None):
+        """
+        Prune the partitions to the counties and the years of a date range.
+
+        :param counties: Selected counties; None selects all of them.
+        :return: Tuple of partition positions.
+        """
+        first_year = pd.Timestamp(start_date).year if start_date else -1
+        last_year = pd.Timestamp(end_date).year if end_date else sys.maxsize
+        counties = set(self.counties if counties is None else counties)
+        return tuple(position for position, (county, year, path) in enumerate(self.partitions)
+                     if county in counties and first_year <= year <= last_year)
+
+    def data(self, counties=None, start_date=None, end_date=None):
+        """
+
+        :return: DashboardData of the selected partitions, see select.
+        """
+        return self._combine(self.select(counties, start_date, end_date))
+
+    @lru_cache(maxsize=32)
+    def _combine(self, positions):
+        summaries = [self.summaries[position] for position in positions]
+        if not summaries:
+            first = self.summaries[0]
+            summaries = [PartitionSummary(first.daily.iloc[:0], first.population, first.morbidity_cases.iloc[:0],
+                                          pd.NaT)]
+
+        # The latest year's populations of each county, added up over the counties; a
+        # demographic some county has no population for gets none (NaN per capita)
+        by_county = {}
+        for position, summary in zip(positions, summaries):
+            county = self.partitions[position][0]
+            by_county[county] = by_county[county].overlay(summary.population) if county in by_county \
+                else summary.population
+        population = PopulationTable.total(by_county.values()) if by_county else summaries[0].population
+
+        cube = CaseCube.from_counts(pd.concat([summary.daily for summary in summaries]), population)
+        morbidity_cases = summaries[0].morbidity_cases
+        for summary in summaries[1:]:
+            morbidity_cases = morbidity_cases.add(summary.morbidity_cases, fill_value=0)
+        first_date = min([summary.first_death_date for summary in summaries
+                          if not pd.isna(summary.first_death_date)], default=pd.NaT)
+        version = f"{self.version}-{hashlib.sha256(repr(positions).encode()).hexdigest()[:12]}"
+        return DashboardData((), None, cube, population, LabelTable(cube.levels),
+                             morbidity_cases.astype(np.int64), first_date, version)
+
+
+def add_county(root, county, csv_path, chunk_rows=CHUNK_ROWS):
+    """
+    Split a county's extract by year of death into partitions, replacing any it had.
+
+    The extract is read chunk_rows lines at a time and its lines are copied to a
+    file per year; each year is then parsed and written on its own, so at most one
+    year of records is in memory.
+
+    :param root: Partition root directory.
+    :param county: County name, used as its directory name.
+    :param csv_path: CSV with the columns of assets/final_covid_2.csv.
+    :param chunk_rows: Lines read at a time.
+    :return: The years written.
+    """
+    county_dir = Path(root) / county
+    county_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=county_dir, prefix='.split-') as split_dir:
+        year_files = {}
+        # Text as in the extract, so each year's columns are typed as read_rows types them
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_rows, dtype=str, keep_default_na=False):
+            years = pd.to_datetime(chunk[DATE_COLUMN]).dt.year
+            for year, rows in chunk.groupby(years, sort=False):
+                year_file = Path(split_dir) / f"{int(year)}.csv"
+                rows.to_csv(year_file, mode='a', header=int(year) not in year_files, index=False)
+                year_files[int(year)] = year_file
+        for year, year_file in sorted(year_files.items()):
+            path = county_dir / str(year)
+            shutil.rmtree(path, ignore_errors=True)
+            write_snapshot(read_rows(year_file, 0, os.stat(year_file).st_size), path)
+    return sorted(year_files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add a county's records to a partitioned data directory.")
+    parser.add_argument('county', help='County name.')
+    parser.add_argument('csv', help='Extract with the columns of assets/final_covid_2.csv.')
+    parser.add_argument('--root', default='data/partitions', help='Partition root, used as PARTITIONED_DATA_DIR.')
+    args = parser.parse_args()
+
+    years = add_county(args.root, args.county, args.csv)
+    print(f"wrote {args.county} {', '.join(map(str, years))} to {args.root}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
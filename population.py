@@ -0,0 +1,142 @@
+"""
+Population denominators of the per-capita charts, kept as a small dimension table.
+
+The extract repeats TOTAL_POP on every row, although it only depends on the
+demographic (age group, race and gender) of the row. A PopulationTable holds one
+value per demographic instead; it is joined to the case cube per series, after
+aggregation, so the row data does not need the column at all. A different census
+vintage, e.g. a file like assets/demo2.csv, is swapped in with with_vintage without
+touching the records. Census files label age groups their own way ("19 to 29");
+VINTAGE_LABELS maps those labels to the codes of the extract ("19-29 Yrs").
+"""
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEMOGRAPHIC_COLUMNS = ['AGE_GROUP', 'RACE', 'GENDER']
+POPULATION_COLUMN = 'TOTAL_POP'
+
+# Census labels of the extract's codes, per demographic column
+VINTAGE_LABELS = {
+    'AGE_GROUP': {
+        'Under 18 years': '< 18 Yrs',
+        '19 to 29': '19-29 Yrs',
+        '30 to 39': '30-39 Yrs',
+        '40 to 49': '40-49 Yrs',
+        '50 to 59': '50-59 Yrs',
+        '60 to 69': '60-69 Yrs',
+        '70 to 79': '70-79 Yrs',
+        '80 to 89': '80-89 Yrs',
+        '90 to 99': '90-99 Yrs',
+        '100 plus': '100 Yrs <',
+    },
+}
+
+
+class PopulationTable:
+    """
+    TOTAL_POP per demographic, indexed by the DEMOGRAPHIC_COLUMNS.
+    """
+
+    def __init__(self, populations):
+        """
+
+        :param populations: float64 Series indexed by a MultiIndex of the DEMOGRAPHIC_COLUMNS values.
+        """
+        self.populations = populations
+        digest = hashlib.sha256(pd.util.hash_pandas_object(populations.sort_index()).to_numpy().tobytes())
+        self.version = digest.hexdigest()[:12]
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Take the populations from rows that carry them, one value per demographic.
+
+        :param df: DataFrame with the DEMOGRAPHIC_COLUMNS and TOTAL_POP.
+        :return: A PopulationTable.
+        """
+        rows = df[DEMOGRAPHIC_COLUMNS + [POPULATION_COLUMN]].astype({column: object for column in DEMOGRAPHIC_COLUMNS})
+        grouped = rows.groupby(DEMOGRAPHIC_COLUMNS)[POPULATION_COLUMN]
+        conflicting = int((grouped.nunique() > 1).sum())
+        if conflicting:
+            logger.warning("%d demographics have more than one %s; using the first of each",
+                           conflicting, POPULATION_COLUMN)
+        return cls(grouped.first().astype(np.float64))
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Read a population table or a census vintage, with census labels translated
+        to the extract's codes, see VINTAGE_LABELS.
+
+        :param path: CSV with the DEMOGRAPHIC_COLUMNS and TOTAL_POP, e.g. assets/demo2.csv.
+        :return: A PopulationTable.
+        """
+        df = pd.read_csv(path)
+        missing = [column for column in DEMOGRAPHIC_COLUMNS + [POPULATION_COLUMN] if column not in df]
+        if missing:
+            raise ValueError(f"{path} has no {', '.join(missing)} column")
+        return cls.from_frame(df.replace(VINTAGE_LABELS))
+
+    @classmethod
+    def total(cls, tables):
+        """
+        Populations of several disjoint areas, e.g. counties, added up per demographic.
+        A demographic missing from some of the tables is left out, logged as a
+        warning, since the sum of the others would understate its population.
+
+        :param tables: Iterable of PopulationTables.
+        :return: A PopulationTable.
+        """
+        tables = list(tables)
+        populations = pd.concat([table.populations for table in tables])
+        grouped = populations.groupby(level=DEMOGRAPHIC_COLUMNS)
+        complete = grouped.size() == len(tables)
+        if not complete.all():
+            missing = complete.index[~complete]
+            logger.warning("%d demographics have no population in some of the %d areas and are left out: %s",
+                           len(missing), len(tables), ', '.join(' / '.join(map(str, key)) for key in missing))
+        return cls(grouped.sum()[complete])
+
+    def to_csv(self, path):
+        self.populations.rename(POPULATION_COLUMN).reset_index().to_csv(path, index=False)
+
+    def overlay(self, other):
+        """
+
+        :return: A table with the populations of other, and those of this table for
+            demographics other does not have.
+        """
+        return type(self)(other.populations.combine_first(self.populations))
+
+    def with_vintage(self, vintage):
+        """
+        Take the populations of a census vintage for the demographics it has. The
+        vintage's rows that match no demographic of this table are ignored and, like
+        the demographics that keep their previous population, logged as a warning.
+
+        :param vintage: PopulationTable of the census vintage.
+        :return: A table with the demographics of this one.
+        """
+        unmatched = vintage.populations.index.difference(self.populations.index)
+        if len(unmatched):
+            logger.warning("%d of %d census vintage rows match no demographic of the records and are ignored: %s",
+                           len(unmatched), len(vintage.populations), ', '.join(' / '.join(map(str, key)) for key in unmatched))
+        kept = self.populations.index.difference(vintage.populations.index)
+        if len(kept):
+            logger.warning("%d of %d demographics are not in the census vintage and keep their previous population",
+                           len(kept), len(self.populations))
+        return type(self)(vintage.populations.reindex(self.populations.index).combine_first(self.populations))
+
+    def lookup(self, keys):
+        """
+
+        :param keys: DataFrame with the DEMOGRAPHIC_COLUMNS, e.g. CaseCube.keys.
+        :return: float64 population of each row of keys, NaN for unknown demographics.
+        """
+        index = pd.MultiIndex.from_frame(keys[DEMOGRAPHIC_COLUMNS].astype(object))
+        return self.populations.reindex(index).to_numpy(dtype=np.float64)
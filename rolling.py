@@ -0,0 +1,43 @@
+"""
+Calendar rolling windows for many daily series at once.
+
+Counts come from the dense day grid of aggregates.CaseCube, one column per
+series. Days without deaths are zero rows rather than missing rows, so an N-day
+window always spans N calendar days. Sums are differences of one cumulative
+sum, which makes the cost independent of the window length.
+"""
+import numpy as np
+
+
+def rolling_sum(counts, window):
+    """
+
+    :param counts: Array of shape (days, series) on a dense daily grid.
+    :param window: Window length in days, 1 or more.
+    :return: float64 array of the same shape with the sum over the trailing window.
+    """
+    window = max(int(window), 1)
+    totals = np.cumsum(counts, axis=0, dtype=np.float64)
+    totals[window:] -= totals[:-window].copy()
+    return totals
+
+
+def window_lengths(days, window):
+    """
+    Days actually covered by each trailing window, so the first days of a range are
+    averaged over the days available (like min_periods=1).
+
+    :return: float64 array of shape (days, 1).
+    """
+    return np.minimum(np.arange(1, days + 1), max(int(window), 1)).astype(np.float64)[:, None]
+
+
+def rolling_mean(counts, window):
+    """
+    Trailing N-day means of every series; CaseCube.per_capita scales them per 100,000.
+
+    :param counts: Array of shape (days, series) on a dense daily grid.
+    :param window: Window length in days; 1 returns the daily values.
+    :return: float64 array of shape (days, series).
+    """
+    return rolling_sum(counts, window) / window_lengths(len(counts), window)
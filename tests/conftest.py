@@ -0,0 +1,56 @@
+"""
+Shared fixtures: small synthetic extracts written by benchmarks/synthetic_data.py.
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(REPO_ROOT), str(REPO_ROOT / 'benchmarks')]
+
+import synthetic_data  # noqa: E402
+
+
+@pytest.fixture
+def extract_lines(tmp_path):
+    """
+    Lines of a synthetic extract of 300 cases, header first. A tenth of the rows are
+    repeated, as for two conditions of a case in the same morbidity category, and
+    the rows are shuffled so every case is spread over the whole file.
+
+    :return: List of CSV lines with their newlines.
+    """
+    path = tmp_path / 'synthetic.csv'
+    synthetic_data.generate(path, 300, seed=3, days=120)
+    df = pd.read_csv(path)
+    rng = np.random.default_rng(3)
+    df = pd.concat([df, df.sample(frac=0.1, random_state=3)], ignore_index=True)
+    df = df.iloc[rng.permutation(len(df))]
+    df.to_csv(path, index=False)
+    return path.read_text().splitlines(keepends=True)
+
+
+def cube_counts(data):
+    """
+
+    :return: Series of the non-zero counts of a DashboardData's cube by (date, series key).
+    """
+    cube = data.cube
+    keys = [tuple(map(str, key)) for key in cube.keys.itertuples(index=False)]
+    counts = np.asarray(cube.counts)[:, :len(keys)]
+    days, columns = np.nonzero(counts)
+    index = pd.MultiIndex.from_arrays([np.asarray(cube.dates)[days], [keys[column] for column in columns]])
+    return pd.Series(counts[days, columns], index=index).sort_index()
+
+
+def cube_populations(data):
+    """
+
+    :return: Dict of series key to the population of that series in a DashboardData's cube.
+    """
+    cube = data.cube
+    return {tuple(map(str, key)): cube.population[position]
+            for position, key in enumerate(cube.keys.itertuples(index=False))}
@@ -0,0 +1,106 @@
+"""
+Export endpoint: the streamed files hold the series the trend chart draws.
+"""
+import importlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import synthetic_data
+from conftest import REPO_ROOT
+from export import csv_stream, parquet_stream, series_frames
+
+QUERY = {'morbidity': ['All Deaths', 'DIABETES'], 'age': ['All', '80-89 Yrs'], 'sex': ['All'], 'race': ['All'],
+         'start_date': '2020-04-01', 'end_date': '2020-12-31', 'time_span': 7, 'tabs': 'Total'}
+
+
+@pytest.fixture(scope='module')
+def extract(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('export')
+    csv_path = directory / 'extract.csv'
+    synthetic_data.generate(csv_path, 2000, seed=8, days=400)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(REPO_ROOT)
+        patch.setenv('COVID_DATA_PATH', str(csv_path))
+        patch.setenv('COVID_CACHE_DIR', str(directory / 'cache'))
+        patch.setenv('INGEST_POLL_SECONDS', '0')
+        patch.setenv('SHARED_DATA', '0')
+        app = importlib.import_module('app')
+    return pd.read_csv(csv_path, parse_dates=['DATE_OF_DEATH']), app.server.test_client()
+
+
+def download(client, **query):
+    response = client.get('/export', query_string=dict(QUERY, **query))
+    assert response.status_code == 200, response.data
+    return response
+
+
+def test_csv_holds_daily_deaths_and_their_rolling_average(extract):
+    rows, client = extract
+    response = download(client, format='csv')
+    assert response.content_type.startswith('text/csv')
+    assert response.headers['Content-Disposition'] == \
+        'attachment; filename="covid_deaths_2020-04-01_2020-12-31.csv"'
+    df = pd.read_csv(io.BytesIO(response.data), parse_dates=['DATE'])
+
+    assert list(df.columns) == ['DATE', 'AGE_GROUP', 'GENDER', 'RACE', 'GENERAL_MORBIDITY', 'SERIES', 'DEATHS',
+                                'DEATHS_7_DAY_AVERAGE']
+    assert df['DATE'].min() == pd.Timestamp('2020-04-01') and df['DATE'].max() <= pd.Timestamp('2020-12-31')
+    assert df.groupby('DATE').size().eq(4).all()
+
+    # Distinct cases per day, straight from the records
+    for (age, morbidity), series in df.groupby(['AGE_GROUP', 'GENERAL_MORBIDITY']):
+        selected = rows[(rows['AGE_GROUP'] == age) & (rows['GENERAL_MORBIDITY'] == morbidity)
+                        & (rows['GENDER'] == 'All') & (rows['RACE'] == 'All')]
+        daily = selected.groupby('DATE_OF_DEATH')['CASE_NUMBER'].nunique()
+        expected = daily.reindex(series['DATE'], fill_value=0).to_numpy()
+        assert np.array_equal(series['DEATHS'].to_numpy(), expected)
+        assert np.allclose(series['DEATHS_7_DAY_AVERAGE'], series['DEATHS'].rolling(7, min_periods=1).mean())
+
+
+def test_parquet_matches_csv(extract):
+    pytest.importorskip('pyarrow')
+    rows, client = extract
+    csv = pd.read_csv(io.BytesIO(download(client, format='csv', tabs='Per Capita').data), parse_dates=['DATE'])
+    response = download(client, format='parquet', tabs='Per Capita')
+    assert response.content_type == 'application/vnd.apache.parquet'
+    parquet = pd.read_parquet(io.BytesIO(response.data))
+    assert 'DEATHS_PER_100K_7_DAY_AVERAGE' in parquet
+    pd.testing.assert_frame_equal(parquet.astype({'DATE': 'datetime64[ns]'}), csv, check_exact=False)
+
+
+def frames():
+    dates = np.arange('2020-01-01', '2020-01-11', dtype='datetime64[D]')
+    counts = np.arange(30).reshape(10, 3)
+    return series_frames(dates, counts, counts / 2, [('All', 'All', 'All', 'A'), ('All', 'All', 'All', 'B'),
+                                                      ('All', 'All', 'All', 'C')], ['a', 'b', 'c'], 'VALUE',
+                         chunk_rows=6)
+
+
+def test_streams_write_a_block_at_a_time():
+    expected = pd.concat(frames(), ignore_index=True)
+    assert len(list(frames())) == 5
+
+    chunks = list(csv_stream(frames()))
+    assert len(chunks) == 5 and chunks[1].count(b'DATE') == 0
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(b''.join(chunks)), parse_dates=['DATE']), expected,
+                                  check_dtype=False)
+
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+    chunks = list(parquet_stream(frames()))
+    assert all(chunks[:5])
+    parquet = pyarrow.parquet.ParquetFile(io.BytesIO(b''.join(chunks)))
+    assert parquet.metadata.num_row_groups == 5
+    pd.testing.assert_frame_equal(parquet.read().to_pandas(), expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('query', [
+    {'time_span': 0}, {'time_span': 'week'}, {'tabs': 'Average'}, {'start_date': 'yesterday'},
+    {'end_date': '2020-13-45'}, {'format': 'xlsx'},
+])
+def test_bad_arguments_are_rejected(extract, query):
+    rows, client = extract
+    assert client.get('/export', query_string=dict(QUERY, **query)).status_code == 400
@@ -0,0 +1,83 @@
+"""
+Figure cache: byte-bounded LRU eviction, versioning, and the disabled cache.
+"""
+import itertools
+import sqlite3
+
+import pytest
+
+import figure_cache
+from figure_cache import FigureCache
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # Distinct, increasing last-used times however fast the test runs
+    ticks = itertools.count(1)
+    monkeypatch.setattr(figure_cache.time, 'time', lambda: float(next(ticks)))
+
+
+def stored(cache):
+    # Read directly, as a get would make every entry recently used
+    with sqlite3.connect(cache.path) as db:
+        return {key for key, in db.execute('SELECT key FROM figures')}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = FigureCache(tmp_path / 'figures.sqlite', 'v1', max_bytes=450)
+    for key in range(10):
+        cache.put(str(key), b'x' * 100)
+    assert stored(cache) == {'6', '7', '8', '9'}
+
+    # Reading an entry makes it the most recently used
+    assert cache.get('6') == b'x' * 100
+    cache.put('10', b'x' * 100)
+    assert stored(cache) == {'6', '8', '9', '10'}
+
+    # A large entry evicts as many of the oldest as it needs
+    cache.put('11', b'y' * 250)
+    assert stored(cache) == {'6', '10', '11'}
+
+    # One over the whole budget is not stored at all
+    cache.put('12', b'z' * 451)
+    assert stored(cache) == {'6', '10', '11'}
+
+
+def test_other_versions_are_dropped(tmp_path):
+    FigureCache(tmp_path / 'figures.sqlite', 'v1').put('a', b'{}')
+    assert FigureCache(tmp_path / 'figures.sqlite', 'v1').get('a') == b'{}'
+    assert FigureCache(tmp_path / 'figures.sqlite', 'v2').get('a') is None
+    assert FigureCache(tmp_path / 'figures.sqlite', 'v1').get('a') is None
+
+
+def test_memoize_returns_cached_figures(tmp_path):
+    cache = FigureCache(tmp_path / 'figures.sqlite', 'v1')
+    calls = []
+
+    @cache.memoize
+    def chart(value):
+        calls.append(value)
+        return {'data': [{'y': [value]}], 'layout': {}}
+
+    assert chart(1) == chart(1) == {'data': [{'y': [1]}], 'layout': {}}
+    assert chart(2)['data'][0]['y'] == [2]
+    assert calls == [1, 2]
+    assert cache.get(chart.cache_key(1)) is not None
+
+
+def test_disabled_cache_stores_and_encodes_nothing(tmp_path, monkeypatch):
+    cache = FigureCache(tmp_path / 'figures.sqlite', 'v1', max_bytes=0)
+    monkeypatch.setattr(figure_cache.pio, 'to_json', lambda *args, **kwargs: pytest.fail('figure encoded'))
+    calls = []
+
+    @cache.memoize
+    def chart(value):
+        calls.append(value)
+        return {'data': [], 'layout': {}}
+
+    chart(1)
+    chart(1)
+    cache.put('a', b'{}')
+    assert calls == [1, 1]
+    assert cache.get('a') is None
+    assert not (tmp_path / 'figures.sqlite').exists()
@@ -0,0 +1,153 @@
+"""
+Figure building: LTTB downsampling of trend series, and figure patches, which applied
+to the figure the browser shows must give the new figure.
+"""
+import json
+
+import numpy as np
+import pytest
+from dash import Patch, no_update
+from plotly.io.json import to_json_plotly
+
+from figures import bar_figure, figure_patch, lttb_indices, trend_figure
+
+DATES = np.arange('2021-01-01', '2021-04-11', dtype='datetime64[D]')
+MORBIDITIES = ['DIABETES', 'HYPERTENSION', 'OBESITY', 'ASTHMA']
+
+
+def series(n, k=3, seed=6):
+    rng = np.random.default_rng(seed)
+    return np.arange(n, dtype=np.float64), rng.poisson(5, (n, k)).astype(np.float64)
+
+
+def test_lttb_keeps_the_ends_and_one_point_per_bucket():
+    x, y = series(1000)
+    kept = lttb_indices(x, y, 100)
+    assert kept.shape == (100, 3)
+    assert (kept[0] == 0).all() and (kept[-1] == 999).all()
+    assert (np.diff(kept, axis=0) > 0).all()
+
+
+def test_lttb_keeps_a_spike():
+    x, y = series(5000)
+    y[2345, 1] = 1000
+    y[777, 2] = -1000
+    kept = lttb_indices(x, y, 50)
+    assert 2345 in kept[:, 1] and 777 in kept[:, 2]
+
+
+@pytest.mark.parametrize('n', [10, 100])
+def test_lttb_keeps_short_series_whole(n):
+    x, y = series(n)
+    kept = lttb_indices(x, y, 100)
+    assert kept.shape == (n, 3)
+    assert (kept == np.arange(n)[:, None]).all()
+    assert np.array_equal(y[kept, np.arange(3)], y)
+
+
+def test_long_trend_is_downsampled_to_the_point_budget():
+    dates = np.arange('2020-01-01', '2022-01-01', dtype='datetime64[D]')
+    values = np.random.default_rng(7).poisson(5, (len(dates), 2)).astype(np.float64)
+    figure = trend_figure(dates, values, ['a', 'b'], 'Deaths', 'Deaths', max_points=200)
+    for position, trace in enumerate(figure['data']):
+        assert len(trace['x']) == len(trace['y']) == 200
+        assert trace['x'][0] == '2020-01-01' and trace['x'][-1] == '2021-12-31'
+        assert trace['y'][0] == values[0, position] and trace['y'][-1] == values[-1, position]
+
+
+def browser(figure):
+    # The figure as the browser holds it, and as the callbacks get it back
+    return json.loads(to_json_plotly(figure))
+
+
+def apply(figure, patch):
+    """
+    Apply the operations of a Patch to a decoded figure like Dash's renderer does.
+
+    :return: The patched figure, decoded.
+    """
+    figure = json.loads(json.dumps(figure))
+    for operation in browser(patch)['operations']:
+        *path, last = operation['location']
+        parent = figure
+        for key in path:
+            parent = parent[key]
+        params = operation['params']
+        if operation['operation'] == 'Assign':
+            parent[last] = params['value']
+        elif operation['operation'] == 'Delete':
+            del parent[last]
+        elif operation['operation'] == 'Insert':
+            parent[last].insert(params['index'], params['value'])
+        else:
+            raise ValueError(operation['operation'])
+    return figure
+
+
+def operations(patch):
+    return [(operation['operation'], operation['location']) for operation in browser(patch)['operations']]
+
+
+def trend(morbidities, tab='Total', x_range=None):
+    # Each series has the same values whichever others are shown
+    values = np.column_stack([np.random.default_rng(MORBIDITIES.index(morbidity)).poisson(5, len(DATES)) * 1.0
+                              for morbidity in morbidities])
+    if tab == 'Per Capita':
+        values = values / 3.7
+    return trend_figure(DATES, values.reshape(len(DATES), len(morbidities)), morbidities,
+                        f'Deaths, {tab}', tab, x_range=x_range)
+
+
+def assert_patches(old, new):
+    patch = figure_patch(browser(old), new)
+    assert isinstance(patch, Patch)
+    assert apply(browser(old), patch) == browser(new)
+    return patch
+
+
+def test_tab_switch_sends_only_what_changed():
+    patch = assert_patches(trend(MORBIDITIES[:2]), trend(MORBIDITIES[:2], tab='Per Capita'))
+    locations = [location for _, location in operations(patch)]
+    assert ['data', 0, 'y'] in locations and ['data', 1, 'y'] in locations
+    assert ['layout', 'yaxis', 'title', 'text'] in locations
+    assert not any('x' in location for location in locations)
+
+    bars = bar_figure(MORBIDITIES, np.arange(4.0), 'Deaths, Total', 'Total')
+    assert_patches(bars, bar_figure(MORBIDITIES, np.arange(4.0) / 3.7, 'Deaths, Per Capita', 'Per Capita'))
+
+
+def test_added_morbidity_is_inserted_in_place():
+    patch = assert_patches(trend(['DIABETES', 'OBESITY']), trend(['DIABETES', 'HYPERTENSION', 'OBESITY']))
+    assert operations(patch) == [('Insert', ['data'])]
+
+
+def test_removed_morbidities_are_deleted():
+    patch = assert_patches(trend(MORBIDITIES), trend(['HYPERTENSION', 'ASTHMA']))
+    assert operations(patch) == [('Delete', ['data', 2]), ('Delete', ['data', 0])]
+
+
+def test_zoom_and_reset_patch_the_axis_range():
+    shown = trend(MORBIDITIES[:2])
+    zoomed = trend(MORBIDITIES[:2], x_range=['2021-02-01', '2021-03-01'])
+    patch = assert_patches(shown, zoomed)
+    assert operations(patch) == [('Assign', ['layout', 'xaxis', 'range'])]
+    patch = assert_patches(zoomed, shown)
+    assert operations(patch) == [('Delete', ['layout', 'xaxis', 'range'])]
+
+
+def test_unchanged_figure_is_no_update():
+    assert figure_patch(browser(trend(MORBIDITIES[:2])), trend(MORBIDITIES[:2])) is no_update
+
+
+@pytest.mark.parametrize('old, new', [
+    (['DIABETES', 'HYPERTENSION'], ['HYPERTENSION', 'DIABETES']),
+    (['DIABETES', 'HYPERTENSION', 'OBESITY'], ['OBESITY', 'ASTHMA', 'DIABETES']),
+])
+def test_reordered_traces_need_the_whole_figure(old, new):
+    assert figure_patch(browser(trend(old)), trend(new)) is None
+
+
+def test_duplicate_trace_names_need_the_whole_figure():
+    figure = trend(MORBIDITIES[:2])
+    figure['data'][1]['name'] = figure['data'][0]['name']
+    assert figure_patch(browser(trend(MORBIDITIES[:2])), figure) is None
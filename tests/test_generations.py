@@ -0,0 +1,75 @@
+"""
+Request generations: a newer request of a session supersedes the older ones, in any process.
+"""
+import multiprocessing
+
+import pytest
+
+from generations import RequestGenerations, Superseded
+
+
+def test_newer_request_supersedes_older(tmp_path):
+    generations = RequestGenerations(tmp_path / 'generations.npy')
+    with generations.request('tab-a'):
+        generations.checkpoint()
+        with generations.request('tab-b'):
+            generations.checkpoint()
+        # Another session's request changes nothing for this one
+        generations.checkpoint()
+
+        generations.begin('tab-a')
+        with pytest.raises(Superseded):
+            generations.checkpoint()
+
+    # Nothing to supersede outside a request, or in one without a session
+    generations.checkpoint()
+    with generations.request(None):
+        generations.begin('tab-a')
+        generations.checkpoint()
+
+
+def test_request_in_another_process_supersedes(tmp_path):
+    generations = RequestGenerations(tmp_path / 'generations.npy')
+    with generations.request('tab-a'):
+        # A second mapping of the same file, as another worker has
+        RequestGenerations(tmp_path / 'generations.npy').begin('tab-a')
+        with pytest.raises(Superseded):
+            generations.checkpoint()
+
+    with generations.request('tab-a'):
+        process = multiprocessing.get_context('fork').Process(target=generations.begin, args=('tab-a',))
+        process.start()
+        process.join()
+        assert process.exitcode == 0
+        with pytest.raises(Superseded):
+            generations.checkpoint()
+
+
+def test_session_whose_slot_was_taken_is_not_cancelled(tmp_path):
+    generations = RequestGenerations(tmp_path / 'generations.npy', slots=1)
+    with generations.request('tab-a'):
+        # tab-b takes the only slot, so tab-a can no longer tell whether it was superseded
+        other = generations.begin('tab-b')
+        generations.checkpoint()
+
+        # tab-a takes the slot back, its generations counted afresh; now tab-b is never cancelled
+        assert generations.begin('tab-a')[2] == 1
+        assert not generations.superseded(other)
+        generations.checkpoint()
+
+        # While the slot stays tab-a's, newer requests supersede again
+        generations.begin('tab-a')
+        with pytest.raises(Superseded):
+            generations.checkpoint()
+
+
+def begin_many(path, session, times):
+    generations = RequestGenerations(path)
+    return [generations.begin(session)[2] for _ in range(times)]
+
+
+def test_processes_never_hand_out_the_same_generation(tmp_path):
+    with multiprocessing.get_context('fork').Pool(4) as pool:
+        handed_out = pool.starmap(begin_many, [(tmp_path / 'generations.npy', 'tab-a', 500)] * 4)
+    handed_out = [generation for generations_of_process in handed_out for generation in generations_of_process]
+    assert sorted(handed_out) == list(range(1, 2001))
@@ -0,0 +1,116 @@
+"""
+Incremental ingestion must give the same data as loading all records at once.
+"""
+import pytest
+
+from conftest import cube_counts, cube_populations
+
+import dataset
+from dataset import load_dataset
+from ingest import DashboardData, Ingestor, LiveData
+from population import PopulationTable
+
+
+def load(csv_path, cache_dir):
+    df = load_dataset(csv_path, cache_dir)
+    return df, DashboardData.from_frame(df, df.attrs['snapshot'], PopulationTable.from_csv(df.attrs['population']))
+
+
+def assert_same_data(merged, full):
+    # Same columns in the same order, so the bars are ordered as after a restart
+    assert merged.cube.keys.equals(full.cube.keys)
+    assert list(merged.column_labels) == list(full.column_labels)
+    assert cube_counts(merged).equals(cube_counts(full))
+    assert cube_populations(merged) == cube_populations(full)
+    assert merged.morbidity_order == full.morbidity_order
+    assert merged.morbidity_cases.sort_index().equals(full.morbidity_cases.sort_index())
+    assert merged.first_death_date == full.first_death_date
+
+
+def test_split_batches_match_full_load(tmp_path, extract_lines):
+    header, rows = extract_lines[0], extract_lines[1:]
+    first, second = len(rows) // 2, len(rows) * 3 // 4
+    csv_path, drop_dir = tmp_path / 'extract.csv', tmp_path / 'drop'
+    drop_dir.mkdir()
+    csv_path.write_text(header + ''.join(rows[:first]))
+
+    df, data = load(csv_path, tmp_path / 'cache')
+    live = LiveData(data)
+    ingestor = Ingestor(live, csv_path, df.attrs['source_bytes'], drop_dir=drop_dir, poll_seconds=0)
+
+    # A writer half-way through a line: only the whole lines are merged
+    with open(csv_path, 'a') as handle:
+        handle.write(''.join(rows[first:second]) + rows[second][:10])
+    assert ingestor.poll() == second - first
+    with open(csv_path, 'a') as handle:
+        handle.write(rows[second][10:])
+    (drop_dir / 'batch.csv').write_text(header + ''.join(rows[second + 1:]))
+    assert ingestor.poll() == len(rows) - second
+    assert ingestor.poll() == 0
+
+    (tmp_path / 'all.csv').write_text(''.join(extract_lines))
+    assert_same_data(live.current, load(tmp_path / 'all.csv', tmp_path / 'full-cache')[1])
+
+
+def test_large_tail_is_folded_into_the_snapshot(tmp_path, extract_lines, monkeypatch):
+    monkeypatch.setattr(dataset, 'MAX_TAIL_FRACTION', 0.1)
+    header, rows = extract_lines[0], extract_lines[1:]
+    csv_path, cache_dir = tmp_path / 'extract.csv', tmp_path / 'cache'
+    csv_path.write_text(header + ''.join(rows[:len(rows) // 2]))
+    snapshot = load_dataset(csv_path, cache_dir).attrs['snapshot']
+
+    # A small tail is left to the ingestor
+    with open(csv_path, 'a') as handle:
+        handle.write(''.join(rows[len(rows) // 2:len(rows) // 2 + 5]))
+    df = load_dataset(csv_path, cache_dir)
+    assert df.attrs['snapshot'] == snapshot
+    assert df.attrs['source_bytes'] < csv_path.stat().st_size
+
+    # A large one is parsed into a new snapshot
+    with open(csv_path, 'a') as handle:
+        handle.write(''.join(rows[len(rows) // 2 + 5:]))
+    df = load_dataset(csv_path, cache_dir)
+    assert df.attrs['snapshot'] != snapshot
+    assert df.attrs['source_bytes'] == csv_path.stat().st_size
+    assert len(df) == len(rows)
+
+
+def test_new_series_are_sorted_into_the_cube(tmp_path, extract_lines):
+    header, rows = extract_lines[0], extract_lines[1:]
+    # The first load lacks every record of the later morbidities
+    rows = sorted(rows, key=lambda line: line.split(',')[header.split(',').index('GENERAL_MORBIDITY')])
+    csv_path = tmp_path / 'extract.csv'
+    csv_path.write_text(header + ''.join(rows[:len(rows) // 3]))
+    df, data = load(csv_path, tmp_path / 'cache')
+    live = LiveData(data)
+    ingestor = Ingestor(live, csv_path, df.attrs['source_bytes'], poll_seconds=0)
+    with open(csv_path, 'a') as handle:
+        handle.write(''.join(rows[len(rows) // 3:]))
+    assert ingestor.poll() == len(rows) - len(rows) // 3
+    assert len(live.current.cube.keys) > len(data.cube.keys)
+
+    full = load(csv_path, tmp_path / 'full-cache')[1]
+    assert_same_data(live.current, full)
+
+
+@pytest.mark.filterwarnings('ignore:Could not infer format')
+def test_failed_drop_file_is_retried(tmp_path, extract_lines, caplog):
+    header, rows = extract_lines[0], extract_lines[1:]
+    csv_path, drop_dir = tmp_path / 'extract.csv', tmp_path / 'drop'
+    drop_dir.mkdir()
+    csv_path.write_text(header + ''.join(rows[:len(rows) // 2]))
+    df, data = load(csv_path, tmp_path / 'cache')
+    live = LiveData(data)
+    ingestor = Ingestor(live, csv_path, df.attrs['source_bytes'], drop_dir=drop_dir, poll_seconds=0)
+
+    batch = drop_dir / 'batch.csv'
+    batch.write_text(header + ''.join(rows[len(rows) // 2:]).replace(',2020-', ',not a date-', 1))
+    assert ingestor.poll() == 0
+    assert 'batch.csv failed' in caplog.text
+    assert live.current is data
+
+    batch.write_text(header + ''.join(rows[len(rows) // 2:]))
+    assert ingestor.poll() == len(rows) - len(rows) // 2
+    assert ingestor.poll() == 0
+    (tmp_path / 'all.csv').write_text(''.join(extract_lines))
+    assert_same_data(live.current, load(tmp_path / 'all.csv', tmp_path / 'full-cache')[1])
@@ -0,0 +1,33 @@
+"""
+Stage metrics: durations are labelled with the shape of the selection they were timed for.
+"""
+import re
+
+from metrics import StageMetrics
+
+
+def counts_by_label(metrics):
+    """
+
+    :return: Dict of (stage, series, days) to the observation count rendered for it.
+    """
+    pattern = r'dashboard_stage_seconds_count\{stage="(\w+)",series="([^"]+)",days="([^"]+)"\} (\S+)'
+    return {labels[:3]: float(labels[3]) for labels in re.findall(pattern, metrics.render())}
+
+
+def test_selection_shapes_are_bucketed(tmp_path):
+    metrics = StageMetrics(tmp_path)
+    for series, days in [(0, 10), (0, 0), (1, 31), (1, 32), (3, 500), (300, 2000)]:
+        with metrics.selection(series, days):
+            metrics.observe('filter', 0.01)
+    metrics.observe('filter', 0.01)
+
+    assert counts_by_label(metrics) == {
+        ('filter', '0', '1-31'): 1,
+        ('filter', '0', '0'): 1,
+        ('filter', '1', '1-31'): 1,
+        ('filter', '1', '32-92'): 1,
+        ('filter', '2-4', '367-1096'): 1,
+        ('filter', '257+', '1097+'): 1,
+        ('filter', 'unknown', 'unknown'): 1,
+    }
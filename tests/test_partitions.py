@@ -0,0 +1,60 @@
+"""
+Partitioned backend: a county's extract split by year, and counties combined.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+
+import synthetic_data
+from conftest import cube_counts
+from dataset import DATE_COLUMN, load_snapshot, read_rows
+from partitions import PartitionedDataset, add_county
+
+
+def test_extract_is_split_by_year_in_chunks(tmp_path):
+    csv_path = tmp_path / 'county.csv'
+    synthetic_data.generate(csv_path, 300, seed=5, days=900)
+    years = add_county(tmp_path / 'partitions', 'Cook County', csv_path, chunk_rows=97)
+
+    df = read_rows(csv_path, 0, csv_path.stat().st_size)
+    assert years == sorted(df[DATE_COLUMN].dt.year.unique().tolist())
+    assert len(years) > 1
+    for year in years:
+        expected = df[df[DATE_COLUMN].dt.year == year].reset_index(drop=True)
+        partition = load_snapshot(tmp_path / 'partitions' / 'Cook County' / str(year))
+        # The snapshot sorts by date, keeps TOTAL_POP in population.csv and adds CASE_ID
+        order = ['CASE_NUMBER', DATE_COLUMN, 'GENERAL_MORBIDITY']
+        columns = [column for column in expected.columns if column in partition]
+        partition = partition.astype({column: object for column in partition.select_dtypes('category')})
+        pd.testing.assert_frame_equal(partition.sort_values(order, ignore_index=True)[columns],
+                                      expected.sort_values(order, ignore_index=True)[columns])
+    assert not list((tmp_path / 'partitions' / 'Cook County').glob('.split-*'))
+
+
+def test_demographics_missing_from_a_county_have_no_population(tmp_path, caplog):
+    csv_path = tmp_path / 'county.csv'
+    synthetic_data.generate(csv_path, 300, seed=5, days=200)
+    df = pd.read_csv(csv_path)
+    # The other county has no records, so no population, of one age group
+    missing = df['AGE_GROUP'].unique()[1]
+    other = df[df['AGE_GROUP'] != missing].assign(CASE_NUMBER=lambda rows: rows['CASE_NUMBER'] + 10 ** 6)
+    other.to_csv(tmp_path / 'other.csv', index=False)
+    root = tmp_path / 'partitions'
+    add_county(root, 'Cook County', csv_path)
+    add_county(root, 'Lake County', tmp_path / 'other.csv')
+
+    partitioned = PartitionedDataset(root)
+    cook, lake = partitioned.data(['Cook County']), partitioned.data(['Lake County'])
+    with caplog.at_level(logging.WARNING, logger='population'):
+        both = partitioned.data()
+    assert 'left out' in caplog.text
+
+    assert cube_counts(both).astype(np.int64).equals(
+        cube_counts(cook).add(cube_counts(lake), fill_value=0).astype(np.int64))
+    ages = both.cube.keys['AGE_GROUP'].to_numpy()
+    assert np.isnan(both.cube.population[ages == missing]).all()
+    populations = both.population.populations
+    assert missing not in populations.index.get_level_values('AGE_GROUP')
+    shared = populations.index
+    assert np.allclose(populations, cook.population.populations[shared] + lake.population.populations[shared])
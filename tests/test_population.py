@@ -0,0 +1,87 @@
+"""
+Population denominators: the dimension table must give the per-capita values the
+per-row TOTAL_POP column gave, and census vintages must map onto the extract.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import PER_CAPITA_SCALE, SERIES_COLUMNS
+from conftest import REPO_ROOT, cube_counts
+from dataset import load_dataset
+from ingest import DashboardData
+from population import PopulationTable
+
+VINTAGE_PATH = REPO_ROOT / 'assets' / 'demo2.csv'
+
+
+@pytest.fixture
+def extract(tmp_path, extract_lines):
+    """
+
+    :return: (records read straight from the CSV with their TOTAL_POP, DashboardData of the snapshot)
+    """
+    csv_path = tmp_path / 'extract.csv'
+    csv_path.write_text(''.join(extract_lines))
+    df = load_dataset(csv_path, tmp_path / 'cache')
+    data = DashboardData.from_frame(df, df.attrs['snapshot'], PopulationTable.from_csv(df.attrs['population']))
+    return pd.read_csv(csv_path, parse_dates=['DATE_OF_DEATH']), data
+
+
+def test_per_capita_matches_row_populations(extract):
+    rows, data = extract
+    # Per capita as the callbacks computed it with TOTAL_POP as a groupby key
+    expected = (rows.groupby(['DATE_OF_DEATH'] + SERIES_COLUMNS + ['TOTAL_POP'])['CASE_NUMBER'].nunique()
+                .reset_index(name='deaths'))
+    expected['per_capita'] = expected['deaths'] / expected['TOTAL_POP'] * PER_CAPITA_SCALE
+
+    cube = data.cube
+    columns = np.array([cube.select([age], [race], [gender], [morbidity]).item()
+                        for age, race, gender, morbidity in expected[SERIES_COLUMNS].itertuples(index=False)])
+    days = np.searchsorted(cube.dates, expected['DATE_OF_DEATH'].to_numpy().astype(cube.dates.dtype))
+    per_capita = cube.per_capita(cube.counts[days, columns], columns)
+    assert np.array_equal(per_capita, expected['per_capita'].to_numpy())
+
+    # And over the whole range, as the bar chart shows them
+    totals = rows.groupby(SERIES_COLUMNS + ['TOTAL_POP'])['CASE_NUMBER'].nunique().reset_index(name='deaths')
+    columns = np.array([cube.select([age], [race], [gender], [morbidity]).item()
+                        for age, race, gender, morbidity in totals[SERIES_COLUMNS].itertuples(index=False)])
+    assert np.array_equal(cube.per_capita(cube.totals(slice(None), columns), columns),
+                          (totals['deaths'] / totals['TOTAL_POP'] * PER_CAPITA_SCALE).to_numpy())
+
+
+def test_census_labels_are_mapped_to_extract_codes():
+    populations = PopulationTable.from_csv(VINTAGE_PATH).populations
+    assert populations[('19-29 Yrs', 'All', 'All')] == 740847
+    assert populations[('< 18 Yrs', 'All', 'All')] == 1067842
+    assert populations[('100 Yrs <', 'All', 'All')] == 1277
+    assert not populations.index.get_level_values('AGE_GROUP').isin(['19 to 29', '100 plus']).any()
+
+
+def test_vintage_swap_reports_what_it_does_not_cover(extract, caplog):
+    rows, data = extract
+    vintage = PopulationTable.from_csv(VINTAGE_PATH)
+    with caplog.at_level(logging.WARNING, logger='population'):
+        population = data.population.with_vintage(vintage)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any('census vintage rows match no demographic' in message and 'Hispanic' in message
+               for message in messages)
+    assert any('keep their previous population' in message for message in messages)
+
+    # The demographics of the records, with the vintage's populations where it has them
+    assert population.populations.index.equals(data.population.populations.index)
+    covered = data.population.populations.index.intersection(vintage.populations.index)
+    assert len(covered) == 16
+    assert population.populations[covered].equals(vintage.populations[covered])
+    others = data.population.populations.index.difference(covered)
+    assert population.populations[others].equals(data.population.populations[others])
+
+    # The records and their counts are untouched; only the denominators and the version change
+    swapped = data.with_population(population)
+    assert cube_counts(swapped).equals(cube_counts(data))
+    assert str(swapped) != str(data)
+    column = data.cube.select(['19-29 Yrs'], ['All'], ['All'], ['All Deaths']).item()
+    assert swapped.cube.series_population(np.array([column]))[0] == 740847
@@ -0,0 +1,38 @@
+"""
+Rolling means from cumulative sums must match pandas' calendar rolling mean.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from rolling import rolling_mean, rolling_sum
+
+
+@pytest.fixture
+def counts():
+    # Mostly small daily counts with runs of zero days, as on the cube's dense day grid
+    rng = np.random.default_rng(4)
+    counts = rng.poisson(3, (60, 5)) * (rng.random((60, 5)) > 0.3)
+    return counts.astype(np.int32)
+
+
+@pytest.mark.parametrize('window', [1, 7, 30, 90])
+def test_rolling_mean_matches_pandas(counts, window):
+    expected = pd.DataFrame(counts).rolling(window, min_periods=1).mean().to_numpy()
+    assert np.allclose(rolling_mean(counts, window), expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('window', [1, 7, 30, 90])
+def test_rolling_sum_matches_pandas(counts, window):
+    expected = pd.DataFrame(counts).rolling(window, min_periods=1).sum().to_numpy()
+    assert np.array_equal(rolling_sum(counts, window), expected)
+
+
+def test_window_of_one_is_the_daily_counts(counts):
+    result = rolling_mean(counts, 1)
+    assert result.dtype == np.float64
+    assert np.array_equal(result, counts)
+
+
+def test_empty_range():
+    assert rolling_mean(np.zeros((0, 3), dtype=np.int32), 7).shape == (0, 3)
@@ -0,0 +1,116 @@
+"""
+Background warm-up of the figure cache after start-up.
+
+Nothing is computed until a callback fires, so the first visitor after a deploy
+pays for every figure they see. A CacheWarmer computes the figures of likely
+dashboard states in a small thread pool right after a worker starts, without
+delaying the worker's readiness. The figure cache is shared, so only one process
+warms it at a time; the others skip the warm-up. States that are already cached
+cost a lookup. Progress is logged; in /metrics each state is timed as the
+'warmup' stage, and the dashboard_warmup_states* counters give the number of
+states queued, warmed and failed.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from metrics import count, stage
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - without it every process warms
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class CacheWarmer:
+    """
+    Runs warm-up tasks once per process in a background thread pool.
+    """
+
+    def __init__(self, tasks, threads=2, lock_path=None):
+        """
+
+        :param tasks: Callable returning the list of (description, callable) pairs to run;
+            called when the warm-up starts, so it sees the data current at that time.
+        :param threads: Size of the thread pool; 0 disables the warm-up.
+        :param lock_path: File locked while warming, so concurrent processes skip it.
+        """
+        self.tasks = tasks
+        self.threads = threads
+        self.lock_path = Path(lock_path) if lock_path else None
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+
+    @classmethod
+    def from_environ(cls, tasks, lock_path=None):
+        """
+        Configure from WARMUP_THREADS (default 2, 0 disables).
+
+        :return: A CacheWarmer.
+        """
+        return cls(tasks, threads=int(os.environ.get('WARMUP_THREADS', 2)), lock_path=lock_path)
+
+    def start(self):
+        """
+        Start warming in a background thread of this process, unless it already did.
+        """
+        if self.threads <= 0 or self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread_pid != os.getpid():
+                threading.Thread(target=self._run_locked, name='cache-warmer', daemon=True).start()
+                self._thread_pid = os.getpid()
+
+    def _run_locked(self):
+        if self.lock_path is None or fcntl is None:
+            self.run()
+            return
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("another process is warming the figure cache")
+                return
+            self.run()
+
+    def run(self):
+        """
+        Run every task and log the progress.
+
+        :return: Number of tasks that succeeded.
+        """
+        try:
+            tasks = self.tasks()
+        except Exception:
+            logger.exception("listing the warm-up states failed")
+            return 0
+        start = time.perf_counter()
+        done = 0
+        count('warmup_states', len(tasks))
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='cache-warmer') as pool:
+            futures = {pool.submit(self._timed, task): description for description, task in tasks}
+            for position, future in enumerate(as_completed(futures), 1):
+                try:
+                    seconds = future.result()
+                except Exception:
+                    logger.exception("warm-up %d/%d failed: %s", position, len(tasks), futures[future])
+                    count('warmup_states_failed')
+                    continue
+                done += 1
+                count('warmup_states_warmed')
+                logger.info("warm-up %d/%d: %s in %.0f ms", position, len(tasks), futures[future], seconds * 1000)
+        logger.info("warmed %d of %d dashboard states in %.1f s", done, len(tasks), time.perf_counter() - start)
+        return done
+
+    @staticmethod
+    def _timed(task):
+        begin = time.perf_counter()
+        with stage('warmup'):
+            task()
+        return time.perf_counter() - begin